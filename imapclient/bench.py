@@ -0,0 +1,422 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+"""
+Benchmarks for IMAPClient's performance sensitive code paths.
+
+Run with::
+
+    python -m imapclient.bench [options] [benchmark names...]
+
+Each benchmark reports operations per second and, where the
+tracemalloc module is available (Python 3.4+), the memory allocated
+while running a single operation. Use ``--json`` to write the results
+to a file so that they can be compared between releases.
+"""
+
+from __future__ import print_function, unicode_literals
+
+import gc
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+from optparse import OptionParser
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from . import __version__, imap_utf7
+from .fixed_offset import FixedOffset
+from .datetime_util import parse_to_datetime
+from .imapclient import messages_to_str, datetime_to_imap
+from .response_lexer import TokenSource
+from .response_parser import parse_fetch_response, parse_simple_fetch_response
+from .response_types import HeaderMap, decode_encoded_words
+
+__all__ = ['BENCHMARKS', 'benchmark', 'run_benchmark', 'main']
+
+clock = getattr(time, 'perf_counter', time.time)
+
+# name -> (setup function, description). The setup function takes the
+# corpus size and returns an (operation, ops per call) pair.
+BENCHMARKS = {}
+
+
+def benchmark(name, description):
+    """Register a benchmark setup function."""
+    def decorator(func):
+        BENCHMARKS[name] = (func, description)
+        return func
+    return decorator
+
+
+# -- corpora --
+
+def flags_corpus(count):
+    flag_sets = ('', '\\Seen', '\\Seen \\Flagged', '\\Answered \\Seen $Label1')
+    return ['%d (UID %d FLAGS (%s))' % (i, i + 1000, flag_sets[i % len(flag_sets)])
+            for i in range(1, count + 1)]
+
+
+def internaldate_corpus(count):
+    zones = ('+0000', '+1200', '-0430')
+    return ['%d (UID %d INTERNALDATE "%2d-Apr-2014 %02d:%02d:%02d %s")'
+            % (i, i + 1000, i % 28 + 1, i % 24, i % 60, i // 60 % 60, zones[i % len(zones)])
+            for i in range(1, count + 1)]
+
+
+def envelope_corpus(count):
+    return ['%d (UID %d ENVELOPE ("Tue, 15 Apr 2014 09:%02d:00 +1200" '
+            '"=?utf-8?q?Re:_weekly_report_%d?=" '
+            '(("Alice Example" NIL "alice" "example.com")) '
+            '(("Alice Example" NIL "alice" "example.com")) '
+            '(("Alice Example" NIL "alice" "example.com")) '
+            '(("Bob" NIL "bob" "example.org")("Carol" NIL "carol" "example.org")) '
+            'NIL NIL "<parent-%d@example.com>" "<msg-%d@example.com>"))'
+            % (i, i + 1000, i % 60, i, i, i) for i in range(1, count + 1)]
+
+
+def bodystructure_corpus(count):
+    text = '("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "QUOTED-PRINTABLE" 1234 40 NIL NIL NIL NIL)'
+    html = '("TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "QUOTED-PRINTABLE" 5678 120 NIL NIL NIL NIL)'
+    image = ('("IMAGE" "PNG" ("NAME" "logo.png") "<logo@example.com>" NIL "BASE64" 20480 NIL '
+             '("INLINE" ("FILENAME" "logo.png")) NIL NIL)')
+    structure = ('((%s%s "ALTERNATIVE" ("BOUNDARY" "b1") NIL NIL NIL)%s "RELATED" '
+                 '("BOUNDARY" "b2") NIL NIL NIL)' % (text, html, image))
+    return ['%d (UID %d BODYSTRUCTURE %s)' % (i, i + 1000, structure)
+            for i in range(1, count + 1)]
+
+
+def nested_bodystructure_corpus(count, depth=40):
+    # Chains of forwarded messages, each wrapped in a multipart
+    text = '("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "7BIT" 120 4 NIL NIL NIL NIL)'
+    structure = text
+    for _ in range(depth):
+        structure = '(%s%s "MIXED" ("BOUNDARY" "b") NIL NIL NIL)' % (structure, text)
+    return ['%d (UID %d BODYSTRUCTURE %s)' % (i, i + 1000, structure)
+            for i in range(1, count + 1)]
+
+
+def literal_corpus(count):
+    header = ('From: Alice <alice@example.com>\r\nTo: bob@example.org\r\n'
+              'Subject: Benchmark message\r\nMessage-ID: <%d@example.com>\r\n\r\n')
+    corpus = []
+    for i in range(1, count + 1):
+        literal = header % i
+        corpus.append(('%d (UID %d FLAGS (\\Seen) BODY[HEADER] {%d}'
+                       % (i, i + 1000, len(literal)), literal))
+        corpus.append(')')
+    return corpus
+
+
+def folder_names(count):
+    words = ('Entw\u00fcrfe', '\u65e5\u672c\u8a9e', 'Archive', 'Proj & Co',
+             '\u0412\u0445\u043e\u0434\u044f\u0449\u0438\u0435')
+    return ['%s/%s %d' % (words[i % len(words)], words[(i + 1) % len(words)], i)
+            for i in range(count)]
+
+
+# -- benchmarks --
+
+@benchmark('lexer', 'Tokenise ENVELOPE FETCH responses')
+def bench_lexer(size):
+    corpus = envelope_corpus(size)
+
+    def run():
+        for _ in TokenSource(corpus):
+            pass
+    return run, size
+
+
+def _parse_benchmark(corpus_func, parser=parse_fetch_response):
+    def setup(size):
+        corpus = corpus_func(size)
+        return (lambda: parser(corpus)), size
+    return setup
+
+
+benchmark('parse_flags', 'Parse FLAGS FETCH responses')(_parse_benchmark(flags_corpus))
+benchmark('parse_flags_simple', 'Parse FLAGS FETCH responses with the fast path parser')(
+    _parse_benchmark(flags_corpus, parse_simple_fetch_response))
+benchmark('parse_flags_compact', 'Parse FLAGS FETCH responses in to FetchRecords')(
+    _parse_benchmark(flags_corpus, lambda text: parse_simple_fetch_response(
+        text, result_type='compact')))
+benchmark('parse_internaldate', 'Parse INTERNALDATE FETCH responses')(
+    _parse_benchmark(internaldate_corpus, parse_simple_fetch_response))
+benchmark('parse_envelope', 'Parse ENVELOPE FETCH responses')(_parse_benchmark(envelope_corpus))
+benchmark('parse_envelope_threading', 'Parse ENVELOPE FETCH responses, reading two fields')(
+    _parse_benchmark(envelope_corpus, lambda text: [
+        (msg['ENVELOPE'].subject, msg['ENVELOPE'].message_id)
+        for msg in parse_fetch_response(text).values()]))
+benchmark('parse_bodystructure', 'Parse BODYSTRUCTURE FETCH responses')(
+    _parse_benchmark(bodystructure_corpus))
+benchmark('parse_nested_bodystructure', 'Parse deeply nested BODYSTRUCTURE FETCH responses')(
+    _parse_benchmark(nested_bodystructure_corpus))
+benchmark('parse_literals', 'Parse FETCH responses containing literals')(
+    _parse_benchmark(literal_corpus))
+
+
+@benchmark('utf7_encode', 'Encode non-ASCII folder names (uncached)')
+def bench_utf7_encode(size):
+    names = folder_names(size)
+
+    def run():
+        imap_utf7._encode_cache.clear()
+        for name in names:
+            imap_utf7.encode(name)
+    return run, size
+
+
+@benchmark('utf7_decode', 'Decode non-ASCII folder names (uncached)')
+def bench_utf7_decode(size):
+    encoded = [imap_utf7.encode(name) for name in folder_names(size)]
+
+    def run():
+        imap_utf7._decode_cache.clear()
+        for name in encoded:
+            imap_utf7.decode(name)
+    return run, size
+
+
+@benchmark('utf7_ascii', 'Encode and decode ASCII folder names')
+def bench_utf7_ascii(size):
+    names = ['INBOX/Folder %d' % i for i in range(size)]
+
+    def run():
+        for name in names:
+            imap_utf7.decode(imap_utf7.encode(name))
+    return run, size
+
+
+@benchmark('utf7_round_trip', 'Encode and decode non-ASCII folder names (cached)')
+def bench_utf7_round_trip(size):
+    names = folder_names(size)
+
+    def run():
+        for name in names:
+            imap_utf7.decode(imap_utf7.encode(name))
+    return run, size
+
+
+@benchmark('messages_to_str', 'Format a message id list')
+def bench_messages_to_str(size):
+    messages = list(range(1000, 1000 + size))
+    return (lambda: messages_to_str(messages)), size
+
+
+@benchmark('datetime_to_imap', 'Format datetimes for APPEND')
+def bench_datetime_to_imap(size):
+    dts = [datetime(2014, 4, 15, 9, i % 60, 0, 0, FixedOffset(720)) for i in range(size)]
+
+    def run():
+        for dt in dts:
+            datetime_to_imap(dt)
+    return run, size
+
+
+@benchmark('parse_to_datetime', 'Parse ENVELOPE dates')
+def bench_parse_to_datetime(size):
+    dates = ['Tue, 15 Apr 2014 09:%02d:00 +1200' % (i % 60) for i in range(size)]
+
+    def run():
+        for date in dates:
+            parse_to_datetime(date)
+    return run, size
+
+
+@benchmark('decode_subjects', 'Decode RFC 2047 subjects from a mailing list')
+def bench_decode_subjects(size):
+    subjects = ['=?utf-8?q?Re:_=5Bdev=5D_caf=C3=A9_thread_%d?=' % (i % 200) for i in range(size)]
+
+    def run():
+        for subject in subjects:
+            decode_encoded_words(subject)
+    return run, size
+
+
+@benchmark('header_map', 'Read From and Subject from fetched header fields')
+def bench_header_map(size):
+    headers = ['From: Alice <alice@example.com>\r\nTo: bob@example.org\r\n'
+               'Subject: Benchmark message %d\r\n that is folded\r\n'
+               'List-Id: <dev.example.com>\r\n\r\n' % i for i in range(size)]
+
+    def run():
+        for text in headers:
+            header_map = HeaderMap(text)
+            header_map['from'], header_map['subject']
+    return run, size
+
+
+@benchmark('fetch_e2e', 'FETCH FLAGS and RFC822.SIZE from a local fake server')
+def bench_fetch_e2e(size):
+    from .test.fake_imap_server import FakeIMAPServer
+
+    server = FakeIMAPServer().start()
+    try:
+        for i in range(size):
+            server.add_message('INBOX', b'Subject: message ' + str(i).encode('ascii') +
+                               b'\r\n\r\nbody\r\n', flags=['\\Seen'] if i % 2 else [])
+        client = server.connect()
+        client.select_folder('INBOX', readonly=True)
+    except Exception:
+        server.stop()
+        raise
+
+    def run():
+        client.fetch('1:*', ['FLAGS', 'RFC822.SIZE'])
+
+    def cleanup():
+        try:
+            client.logout()
+        finally:
+            server.stop()
+    run.cleanup = cleanup
+    return run, size
+
+
+# -- runner --
+
+def run_benchmark(name, size=1000, min_time=1.0, memory=True):
+    """Run the benchmark called *name*, returning a dict of results.
+
+    The operation is run at least once and repeated until *min_time*
+    seconds have elapsed. If *memory* is True and tracemalloc is
+    available, allocation statistics for a single extra call are also
+    collected.
+    """
+    setup, description = BENCHMARKS[name]
+    func, ops_per_call = setup(size)
+    try:
+        func()  # warm up caches and lazily initialised state
+
+        calls = 0
+        elapsed = 0.0
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            while True:
+                start = clock()
+                func()
+                elapsed += clock() - start
+                calls += 1
+                if elapsed >= min_time:
+                    break
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        result = {
+            'name': name,
+            'description': description,
+            'size': size,
+            'calls': calls,
+            'seconds': elapsed,
+            'ops_per_sec': calls * ops_per_call / elapsed,
+            'allocated_blocks': None,
+            'peak_traced_bytes': None,
+        }
+        if memory and tracemalloc is not None:
+            result.update(_trace_memory(func))
+        return result
+    finally:
+        cleanup = getattr(func, 'cleanup', None)
+        if cleanup:
+            cleanup()
+
+
+def _trace_memory(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    # Blocks still allocated after the operation (eg. the result)
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename')
+                 if stat.count_diff > 0)
+    return {'allocated_blocks': blocks, 'peak_traced_bytes': peak}
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def command_line(argv=None):
+    p = OptionParser(usage='%prog [options] [benchmark...]')
+    p.add_option('-s', '--size', dest='size', action='store', type=int, default=1000,
+                 help='Number of items in each corpus (default: %default)')
+    p.add_option('-t', '--min-time', dest='min_time', action='store', type=float,
+                 default=1.0, help='Minimum seconds to run each benchmark (default: %default)')
+    p.add_option('-j', '--json', dest='json', action='store', default=None,
+                 help='Write results as JSON to this file ("-" for stdout)')
+    p.add_option('-M', '--no-memory', dest='memory', action='store_false', default=True,
+                 help="Don't collect allocation statistics")
+    p.add_option('-l', '--list', dest='list', action='store_true', default=False,
+                 help='List the available benchmarks and exit')
+    opts, args = p.parse_args(argv)
+    unknown = [name for name in args if name not in BENCHMARKS]
+    if unknown:
+        p.error('unknown benchmarks: %s' % ' '.join(unknown))
+    return opts, args
+
+
+def main(argv=None):
+    opts, names = command_line(argv)
+    if opts.list:
+        for name in sorted(BENCHMARKS):
+            print('%-22s %s' % (name, BENCHMARKS[name][1]))
+        return 0
+
+    to_stdout = opts.json == '-'
+    out = sys.stderr if to_stdout else sys.stdout
+    results = []
+    for name in names or sorted(BENCHMARKS):
+        try:
+            result = run_benchmark(name, opts.size, opts.min_time, opts.memory)
+        except Exception as err:
+            result = {'name': name, 'error': '%s: %s' % (err.__class__.__name__, err)}
+            print('%-22s ERROR %s' % (name, result['error']), file=out)
+        else:
+            print('%-22s %12.1f ops/sec  %s allocated blocks  %s peak bytes' % (
+                name, result['ops_per_sec'], result['allocated_blocks'],
+                result['peak_traced_bytes']), file=out)
+        results.append(result)
+
+    if opts.json:
+        report = {
+            'imapclient_version': __version__,
+            'python_version': platform.python_version(),
+            'python_implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'size': opts.size,
+            'peak_rss_bytes': _peak_rss(),
+            'results': results,
+        }
+        if to_stdout:
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+            print()
+        else:
+            with open(opts.json, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+"""
+Parsing of FETCH responses in to NumPy arrays, one per data item.
+
+See :py:meth:`IMAPClient.fetch_columns <imapclient.IMAPClient.fetch_columns>`.
+"""
+
+from __future__ import unicode_literals
+
+from calendar import timegm
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .response_parser import (parse_fetch_response, _convert_INTERNALDATE,
+                              _simple_line_re, _simple_item_re)
+from .six import binary_type, iteritems
+
+__all__ = ['parse_fetch_columns', 'SYSTEM_FLAG_BITS']
+
+# Bits used in the "flags" column for each system flag
+SYSTEM_FLAG_BITS = {
+    '\\Seen': 1,
+    '\\Answered': 2,
+    '\\Flagged': 4,
+    '\\Deleted': 8,
+    '\\Draft': 16,
+    '\\Recent': 32,
+}
+
+# FETCH data item -> (column name, dtype)
+COLUMNS = {
+    'UID': ('uid', 'uint32'),
+    'RFC822.SIZE': ('size', 'int64'),
+    'INTERNALDATE': ('internaldate', 'int64'),  # later viewed as datetime64[s]
+    'FLAGS': ('flags', 'uint8'),
+    'MODSEQ': ('modseq', 'uint64'),
+}
+
+
+def parse_fetch_columns(text, items):
+    """Parse a FETCH response containing the data *items* in to a
+    dictionary of NumPy arrays, with one element per message.
+    """
+    if numpy is None:
+        raise ImportError('NumPy is required for columnar FETCH results')
+
+    dtypes = {'seq': 'uint32'}
+    for item in items:
+        try:
+            name, dtype = COLUMNS[item.upper()]
+        except KeyError:
+            raise ValueError('%s is not supported for columnar FETCH results' % item)
+        dtypes[name] = dtype
+
+    lines = [_decode(line) for line in text if line is not None]
+    columns = dict((name, numpy.zeros(len(lines), dtype=dtype))
+                   for name, dtype in iteritems(dtypes))
+    rows = fill_columns(lines, columns)
+    if rows < len(lines):
+        columns = dict((name, array[:rows]) for name, array in iteritems(columns))
+    if 'internaldate' in columns:
+        columns['internaldate'] = columns['internaldate'].view('datetime64[s]')
+    return columns
+
+
+def fill_columns(lines, columns):
+    """Store values from the FETCH response *lines* in the
+    preallocated sequences in *columns*, returning the number of rows
+    filled.
+
+    Lines for the same message (eg. an unsolicited FLAGS update sent
+    during the FETCH) are merged in to one row and rows are ordered
+    by sequence number.
+    """
+    seqs = columns['seq']
+    uids = columns.get('uid')
+    sizes = columns.get('size')
+    dates = columns.get('internaldate')
+    flag_bits = columns.get('flags')
+    modseqs = columns.get('modseq')
+    date_cache = {}
+    flags_cache = {}
+    rows = {}   # seq -> row
+    last_seq = 0
+    ordered = True
+
+    line_match = _simple_line_re.match
+    item_match = _simple_item_re.match
+    for line in lines:
+        match = not isinstance(line, tuple) and line_match(line)
+        if not match:
+            return _fill_columns_slow(lines, columns)
+        seq = int(match.group(1))
+        row = rows.get(seq)
+        if row is None:
+            row = rows[seq] = len(rows)
+            seqs[row] = seq
+            ordered = ordered and seq > last_seq
+            last_seq = seq
+        body = match.group(2)
+        pos = 0
+        end = len(body)
+        while pos < end:
+            item = item_match(body, pos)
+            if not item:
+                return _fill_columns_slow(lines, columns)
+            pos = item.end()
+            word, number, flags, modseq, internaldate = item.groups()
+            if word == 'UID':
+                if uids is not None:
+                    uids[row] = int(number)
+            elif word:
+                if sizes is not None:
+                    sizes[row] = int(number)
+            elif modseq:
+                if modseqs is not None:
+                    modseqs[row] = int(modseq)
+            elif internaldate is not None:
+                if dates is not None:
+                    seconds = date_cache.get(internaldate)
+                    if seconds is None:
+                        seconds = date_cache[internaldate] = _internaldate_to_epoch(internaldate)
+                    dates[row] = seconds
+            elif flag_bits is not None:
+                bits = flags_cache.get(flags)
+                if bits is None:
+                    bits = flags_cache[flags] = _flag_bits((flags or '').split(' '))
+                flag_bits[row] = bits
+
+    count = len(rows)
+    if not ordered:
+        order = sorted(range(count), key=seqs.__getitem__)
+        for array in columns.values():
+            array[:count] = [array[i] for i in order]
+    return count
+
+
+def _fill_columns_slow(lines, columns):
+    # Something the regular expressions can't handle (eg. literals)
+    # was found so fall back to the general parser.
+    parsed = parse_fetch_response(lines, normalise_times=False, uid_is_key=False)
+    converters = {
+        'seq': ('SEQ', int),
+        'uid': ('UID', int),
+        'size': ('RFC822.SIZE', int),
+        'internaldate': ('INTERNALDATE', lambda dt: timegm(dt.utctimetuple())),
+        'flags': ('FLAGS', _flag_bits),
+        'modseq': ('MODSEQ', lambda value: value[0]),
+    }
+    rows = sorted(parsed.values(), key=lambda msg: msg['SEQ'])
+    for name, array in iteritems(columns):
+        key, convert = converters[name]
+        for row, msg in enumerate(rows):
+            if key in msg:
+                array[row] = convert(msg[key])
+    return len(rows)
+
+
+def _internaldate_to_epoch(text):
+    dt = _convert_INTERNALDATE(text, normalise_times=False)
+    return timegm(dt.utctimetuple())
+
+
+def _flag_bits(flags):
+    bits = 0
+    for flag in flags:
+        bits |= SYSTEM_FLAG_BITS.get(flag, 0)
+    return bits
+
+
+def _decode(line):
+    if isinstance(line, tuple):
+        return tuple(_decode(part) for part in line)
+    if isinstance(line, binary_type) and not isinstance(line, str):
+        return line.decode('latin-1')
+    return line
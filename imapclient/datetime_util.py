@@ -4,11 +4,25 @@
 
 from __future__ import unicode_literals
 
+import re
 from datetime import datetime
 from email.utils import parsedate_tz
 
 from .fixed_offset import FixedOffset
 
+_MONTHS = dict((name, i + 1) for i, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun',
+     'jul', 'aug', 'sep', 'oct', 'nov', 'dec')))
+
+# The usual RFC 2822 layout, eg. "Tue, 15 Apr 2014 09:10:00 +1200 (NZST)".
+# Anything else (including dates without a timezone, which different
+# Python versions treat differently) is left to email.utils.parsedate_tz.
+_rfc2822_re = re.compile(
+    r'\s*(?:[A-Za-z]{3},\s*)?(\d{1,2}) ([A-Za-z]{3}) (\d{4}|\d{2})\s+'
+    r'(\d{1,2}):(\d\d)(?::(\d\d))?'
+    r'\s+(?:([-+])(\d\d)(\d\d)|(UTC?|GMT|Z))'
+    r'\s*(?:\([^()]*\)\s*)?$')
+
 
 def parse_to_datetime(timestamp, normalise=True):
     """Convert an IMAP datetime string to a datetime.
@@ -19,20 +33,51 @@ def parse_to_datetime(timestamp, normalise=True):
     If normalise is False, then the returned datetime will be
     unadjusted but will contain timezone information as per the input.
     """
-    time_tuple = parsedate_tz(timestamp)
-    if time_tuple == None:
-        raise ValueError("couldn't parse datetime %r" % timestamp)
+    dt = _parse_rfc2822(timestamp)
+    if dt is None:
+        time_tuple = parsedate_tz(timestamp)
+        if time_tuple == None:
+            raise ValueError("couldn't parse datetime %r" % timestamp)
 
-    tz_offset_seconds = time_tuple[-1]
-    tz = None
-    if tz_offset_seconds is not None:
-        tz = FixedOffset(tz_offset_seconds / 60)
+        tz_offset_seconds = time_tuple[-1]
+        tz = None
+        if tz_offset_seconds is not None:
+            tz = FixedOffset.for_minutes(tz_offset_seconds // 60)
 
-    dt = datetime(*time_tuple[:6], tzinfo=tz)
-    if normalise and tz:
+        dt = datetime(*time_tuple[:6], tzinfo=tz)
+    if normalise and dt.tzinfo:
        dt = datetime_to_native(dt)
 
     return dt
 
+
+def _parse_rfc2822(timestamp):
+    # Returns None for input which should be handled by parsedate_tz
+    match = _rfc2822_re.match(timestamp)
+    if not match:
+        return None
+    day, month, year_text, hour, minute, second, sign, zoneh, zonem, zone_name = match.groups()
+    month = _MONTHS.get(month.lower())
+    if month is None:
+        return None
+    year = int(year_text)
+    if len(year_text) == 2:
+        # Same interpretation of 2 digit years as parsedate_tz
+        year += 1900 if year > 68 else 2000
+
+    if zone_name:
+        tz = FixedOffset.for_minutes(0)
+    else:
+        offset = int(zoneh) * 60 + int(zonem)
+        if sign == '-':
+            # "-0000" means the timezone is unknown (see above)
+            if not offset:
+                return None
+            offset = -offset
+        tz = FixedOffset.for_minutes(offset)
+    return datetime(year, month, int(day), int(hour), int(minute), int(second or 0),
+                    tzinfo=tz)
+
+
 def datetime_to_native(dt):
     return dt.astimezone(FixedOffset.for_system()).replace(tzinfo=None)
@@ -15,6 +15,9 @@ class FixedOffset(tzinfo):
     east from UTC 
     """
 
+    # Shared instances, keyed by offset in minutes (see for_minutes())
+    _instances = {}
+
     def __init__(self, minutes):
         self.__offset = timedelta(minutes=minutes)
 
@@ -33,6 +36,16 @@ class FixedOffset(tzinfo):
     def dst(self, _):
         return ZERO
 
+    @classmethod
+    def for_minutes(klass, minutes):
+        """Return a shared FixedOffset instance for an offset of
+        *minutes*. Instances are created once per offset.
+        """
+        try:
+            return klass._instances[minutes]
+        except KeyError:
+            return klass._instances.setdefault(minutes, klass(minutes))
+
     @classmethod
     def for_system(klass):
         """Return a FixedOffset instance for the current working timezone and
@@ -42,4 +55,4 @@ class FixedOffset(tzinfo):
             offset = time.altzone
         else:
             offset = time.timezone
-        return klass(-offset // 60)
+        return klass.for_minutes(-offset // 60)
@@ -24,9 +24,23 @@
 
 from __future__ import unicode_literals
 
-from .six import text_type, binary_type, iteritems
+import re
 
-PRINTABLE = set(range(0x20, 0x26)) | set(range(0x27, 0x7f))
+from .lru import LRUCache
+from .six import text_type, binary_type
+
+# Runs of characters which must be base64 encoded, or a lone "&"
+_ENCODE_RE = re.compile('[^\x20-\x7e]+|&')
+
+# An encoded section. The terminating "-" may be missing at the end
+# of the string.
+_DECODE_RE = re.compile('&([^-]*)-?')
+
+# Folder names are converted over and over again (eg. for every
+# LIST response) so the results for names that need actual
+# conversion are remembered.
+_encode_cache = LRUCache(4096)
+_decode_cache = LRUCache(4096)
 
 def encode(s):
     """Encode a folder name using IMAP modified UTF-7 encoding.
@@ -36,27 +50,20 @@ def encode(s):
     if not isinstance(s, text_type):
         return s
 
-    r = []
-    _in = []
-
-    def extend_result_if_chars_buffered():
-        if _in:
-            r.extend(['&', modified_utf7(''.join(_in)), '-'])
-            del _in[:]
-
-    for c in s:
-        if ord(c) in PRINTABLE:
-            extend_result_if_chars_buffered()
-            r.append(c)
-        elif c == '&':
-            extend_result_if_chars_buffered()
-            r.append('&-')
-        else:
-            _in.append(c)
+    # Fast path: nothing to encode
+    if not _ENCODE_RE.search(s):
+        return s
 
-    extend_result_if_chars_buffered()
+    encoded = _encode_cache.get(s)
+    if encoded is None:
+        encoded = _encode_cache[s] = _ENCODE_RE.sub(_encode_match, s)
+    return encoded
 
-    return ''.join(r)
+def _encode_match(match):
+    chars = match.group()
+    if chars == '&':
+        return '&-'
+    return '&' + modified_utf7(chars) + '-'
 
 def decode(s):
     """Decode a folder name from IMAP modified UTF-7 encoding to unicode.
@@ -69,25 +76,20 @@ def decode(s):
     if not isinstance(s, text_type):
         return s
 
-    r = []
-    _in = []
-    for c in s:
-        if c == '&' and not _in:
-            _in.append('&')
-        elif c == '-' and _in:
-            if len(_in) == 1:
-                r.append('&')
-            else:
-                r.append(modified_deutf7(''.join(_in[1:])))
-            _in = []
-        elif _in:
-            _in.append(c)
-        else:
-            r.append(c)
-    if _in:
-        r.append(modified_deutf7(''.join(_in[1:])))
-
-    return ''.join(r)
+    # Fast path: nothing to decode
+    if '&' not in s:
+        return s
+
+    decoded = _decode_cache.get(s)
+    if decoded is None:
+        decoded = _decode_cache[s] = _DECODE_RE.sub(_decode_match, s)
+    return decoded
+
+def _decode_match(match):
+    chars = match.group(1)
+    if not chars:
+        return '&'
+    return modified_deutf7(chars)
 
 def modified_utf7(s):
     # encode to utf-7: '\xff' => b'+AP8-', decode from latin-1 => '+AP8-'
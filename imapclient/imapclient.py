@@ -5,15 +5,19 @@
 from __future__ import unicode_literals
 
 import imaplib
+import logging
+import os
 import select
 import socket
 import sys
 import re
+import time
 import warnings
 from datetime import datetime
 from operator import itemgetter
 
 from . import response_lexer
+from .metrics import MetricsRecorder, clock
 
 # Confusingly, this module is for OAUTH v1, not v2
 try:
@@ -23,7 +27,8 @@ except ImportError:
 
 from .imap_utf7 import encode as encode_utf7, decode as decode_utf7
 from .fixed_offset import FixedOffset
-from .six import moves, iteritems, text_type, integer_types, PY3, binary_type
+from .six import (moves, iteritems, text_type, integer_types, PY3, binary_type,
+                  string_types)
 xrange = moves.xrange
 
 if PY3:
@@ -32,7 +37,10 @@ if PY3:
 
 __all__ = ['IMAPClient', 'DELETED', 'SEEN', 'ANSWERED', 'FLAGGED', 'DRAFT', 'RECENT']
 
-from .response_parser import parse_response, parse_fetch_response
+from .response_parser import (parse_response, parse_fetch_response,
+                              parse_simple_fetch_response, SIMPLE_FETCH_ITEMS)
+from .response_types import HeaderMap, intern_flags
+from .preview import find_text_part, preview_octets, decode_preview
 
 # We also offer the gmail-specific XLIST command...
 if 'XLIST' not in imaplib.Commands:
@@ -42,6 +50,14 @@ if 'XLIST' not in imaplib.Commands:
 if 'IDLE' not in imaplib.Commands:
   imaplib.Commands['IDLE'] = imaplib.Commands['APPEND']
 
+# ...and UNSELECT (RFC 3691)
+if 'UNSELECT' not in imaplib.Commands:
+  imaplib.Commands['UNSELECT'] = ('SELECTED',)
+
+# ...and ENABLE (RFC 5161)
+if 'ENABLE' not in imaplib.Commands:
+  imaplib.Commands['ENABLE'] = ('AUTH',)
+
 
 # System flags
 DELETED = r'\Deleted'
@@ -51,6 +67,58 @@ FLAGGED = r'\Flagged'
 DRAFT = r'\Draft'
 RECENT = r'\Recent'         # This flag is read-only
 
+# Debug output for every connection. Records carry the server's host
+# name as their "host" attribute.
+logger = logging.getLogger(__name__)
+
+# Data item names in the responses to partial fetches, eg. "BODY[1.TEXT]<1024>"
+_partial_key_re = re.compile(r'^BODY\[[^\]]*\]<(\d+)>$')
+
+# Line endings which imaplib converts to CRLF in APPENDed messages
+_line_end_re = re.compile(br'\r\n|\r|\n')
+
+# Number of bytes read from a file at a time when streaming APPENDs
+_APPEND_CHUNK_SIZE = 64 * 1024
+
+# Non-synchronising literals allowed with LITERAL- (RFC 7888)
+_LITERAL_MINUS_MAX = 4096
+
+_path_types = getattr(os, 'PathLike', ())
+
+_utf8_imap_classes = {}
+
+
+def _utf8_imap_class(base):
+    """Return the imaplib class *base*, or a subclass of it providing
+    the ``_mode_utf8()`` method if it doesn't have one (Python 2).
+
+    Python 2's imaplib builds a unicode command line from unicode
+    arguments. Once in UTF-8 mode this is sent encoded as UTF-8
+    rather than ASCII so that folder names can be passed as is.
+    """
+    if hasattr(base, '_mode_utf8'):
+        return base
+    cls = _utf8_imap_classes.get(base)
+    if cls is not None:
+        return cls
+
+    # imaplib's classes are old-style on Python 2 so super() can't be used
+    class UTF8IMAP4(base):
+
+        _utf8_mode = False
+
+        def _mode_utf8(self):
+            self._utf8_mode = True
+
+        def send(self, data):
+            if self._utf8_mode and isinstance(data, text_type):
+                data = data.encode('utf-8')
+            return base.send(self, data)
+
+    _utf8_imap_classes[base] = UTF8IMAP4
+    return UTF8IMAP4
+
+
 class Namespace(tuple):
     def __new__(cls, personal, other, shared):
         return tuple.__new__(cls, (personal, other, shared))
@@ -78,6 +146,11 @@ class IMAPClient(object):
     ``False``). This is useful for exotic connection or authentication
     setups.
 
+    If *record_to* is given (a filename or a file object opened in
+    binary mode), all data sent to and received from the server is
+    recorded to it, with credentials redacted. Recordings can be
+    replayed using :py:class:`imapclient.wire.ReplayIMAPClient`.
+
     The *normalise_times* attribute specifies whether datetimes
     returned by ``fetch()`` are normalised to the local system time
     and include no timezone information (native), or are datetimes
@@ -92,16 +165,50 @@ class IMAPClient(object):
     and ``False`` can also be assigned where ``True`` sets debug level
     4.
 
-    By default, debug output goes to stderr. The *log_file* attribute
-    can be assigned to an alternate file handle for writing debug
-    output to.
+    Debug output is sent to the standard :py:mod:`logging` module at
+    ``DEBUG`` level using the logger in the *logger* attribute. By
+    default this is a ``LoggerAdapter`` for the ``imapclient.imapclient``
+    logger which adds the server's host name to each record as its
+    ``host`` attribute (eg. for use as ``%(host)s`` in a format
+    string). Any ``logging.Logger`` (or ``LoggerAdapter``) can be
+    assigned to *logger* to distinguish individual connections.
+    Arguments to ``LOGIN`` and ``AUTHENTICATE`` commands are redacted.
+    When the logger isn't enabled for ``DEBUG`` no formatting is done
+    for debug messages.
+
+    For backwards compatibility, the *log_file* attribute can be
+    assigned a file handle to write debug output to directly,
+    bypassing the logging module. It defaults to None, so debug
+    output is no longer written to stderr unless logging is configured
+    to do so (or *log_file* is set to ``sys.stderr``).
+
+    The *folder_cache_ttl* attribute enables caching of the folder
+    list for the connection. When set to a number of seconds, the
+    full folder list is fetched once and used to answer
+    ``list_folders()`` calls without arguments and ``folder_exists()``
+    until the cache is older than *folder_cache_ttl*. The cache is
+    invalidated whenever folders are created, renamed, deleted,
+    subscribed or unsubscribed using this client. Use
+    ``invalidate_folder_cache()`` if folders are known to have been
+    changed by other means. Defaults to None (no caching).
+
+    The *metrics_hook* attribute can be set to a callable to collect
+    per-command statistics such as time to first byte, total time on
+    the wire, bytes sent and received and time spent parsing the
+    response. The callable is called with a
+    :py:class:`CommandStats <imapclient.metrics.CommandStats>`
+    instance once a command has completed and its response has been
+    parsed. It should return quickly and must not raise
+    exceptions. Set *metrics_hook* to None (the default) to disable
+    instrumentation.
     """
 
     Error = imaplib.IMAP4.error
     AbortError = imaplib.IMAP4.abort
     ReadOnlyError = imaplib.IMAP4.readonly
 
-    def __init__(self, host, port=None, use_uid=True, ssl=False, stream=False):
+    def __init__(self, host, port=None, use_uid=True, ssl=False, stream=False,
+                 record_to=None):
         if stream:
             if port is not None:
                 raise ValueError("can't set 'port' when 'stream' True")
@@ -115,11 +222,24 @@ class IMAPClient(object):
         self.ssl = ssl
         self.stream = stream
         self.use_uid = use_uid
+        self.record_to = record_to
         self.folder_encode = True
-        self.log_file = sys.stderr
+        self.log_file = None
+        self.logger = logging.LoggerAdapter(logger, {'host': host})
         self.normalise_times = True
+        self.folder_cache_ttl = None
 
         self._cached_capabilities = None
+        self._enabled_capabilities = ()
+        self._cached_namespace = None
+        self._cached_folder_delimiter = None
+        self._folder_cache = None
+        self._folder_cache_list = None
+        self._folder_cache_time = None
+        self._selected_folder = None
+        self._selected_response = None
+        self._applied_untagged = {}
+        self._metrics = None
         self._imap = self._create_IMAP4()
         self._imap._mesg = self._log    # patch in custom debug log method
         self._idle_tag = None
@@ -127,9 +247,15 @@ class IMAPClient(object):
     def _create_IMAP4(self):
         # Create the IMAP instance in a separate method to make unit tests easier
         if self.stream:
-            return imaplib.IMAP4_stream(self.host)
-        ImapClass = self.ssl and imaplib.IMAP4_SSL or imaplib.IMAP4
-        return ImapClass(self.host, self.port)
+            ImapClass, args = imaplib.IMAP4_stream, (self.host,)
+        else:
+            ImapClass = self.ssl and imaplib.IMAP4_SSL or imaplib.IMAP4
+            args = (self.host, self.port)
+        ImapClass = _utf8_imap_class(ImapClass)
+        if self.record_to is not None:
+            from .wire import WireRecorder, recording_imap_class
+            return recording_imap_class(ImapClass)(WireRecorder(self.record_to), *args)
+        return ImapClass(*args)
 
     def login(self, username, password):
         """Login using *username* and *password*, returning the
@@ -163,10 +289,18 @@ class IMAPClient(object):
         """Logout, returning the server response.
         """
         typ, data = self._imap.logout()
+        self._clear_session_caches()
         data = from_bytes(data)
         self._check_resp('BYE', 'logout', typ, data)
         return data[0]
 
+    def _clear_session_caches(self):
+        self._enabled_capabilities = ()
+        self._cached_namespace = None
+        self._cached_folder_delimiter = None
+        self.invalidate_folder_cache()
+        self._clear_selected()
+
     def capabilities(self):
         """Returns the server capability list.
 
@@ -212,6 +346,43 @@ class IMAPClient(object):
         # be detected by this method.
         return capability.upper() in self.capabilities()
 
+    def enable(self, *capabilities):
+        """Activate one or more server side capability extensions
+        using the ENABLE command (see :rfc:`5161`).
+
+        Returns the list of capabilities the server reported as
+        enabled. Capabilities not supported by the server are silently
+        ignored by it and won't appear in the returned list.
+
+        If ``UTF8=ACCEPT`` is enabled (see :rfc:`6855`), folder names
+        are sent and received as UTF-8 rather than modified UTF-7 and
+        the server may return strings in FETCH responses (eg. ENVELOPE
+        subjects) as UTF-8 without :rfc:`2047` encoding.
+
+        It is the responsibility of the caller to check that the
+        server supports the ``ENABLE`` capability first.
+        """
+        if not capabilities:
+            raise ValueError('no capabilities specified')
+        typ, data = self._imap._simple_command('ENABLE', *normalise_text_list(capabilities))
+        data = from_bytes(data)
+        self._checkok('enable', typ, data)
+        typ, data = self._imap._untagged_response(typ, data, 'ENABLED')
+
+        enabled = []
+        for line in from_bytes(data):
+            if line:
+                enabled.extend(to_unicode(line).upper().split())
+        self._enabled_capabilities += tuple(enabled)
+        if self._utf8_enabled and hasattr(self._imap, '_mode_utf8'):
+            # imaplib needs to be told to send UTF-8
+            self._imap._mode_utf8()
+        return enabled
+
+    @property
+    def _utf8_enabled(self):
+        return 'UTF8=ACCEPT' in self._enabled_capabilities
+
     def namespace(self):
         """Return the namespace for the account as a (personal, other,
         shared) tuple.
@@ -224,9 +395,14 @@ class IMAPClient(object):
         *shared*.
 
         See :rfc:`2342` for more details.
+
+        The namespace doesn't change during a session so the response
+        is cached after the first call.
         """
-        data = self._command_and_check('namespace')
-        return Namespace(*parse_response(data))
+        if self._cached_namespace is None:
+            data = self._command_and_check('namespace')
+            self._cached_namespace = Namespace(*self._timed_parse(parse_response, data))
+        return self._cached_namespace
 
     def get_folder_delimiter(self):
         """Return the folder separator used by the IMAP server.
@@ -236,14 +412,24 @@ class IMAPClient(object):
             The implementation just picks the first folder separator
             from the first namespace returned. This is not
             particularly sensible. Use namespace instead().
+
+        The separator is cached for the session. If folders have
+        already been listed the separator returned by the server in
+        the listing is used, avoiding a ``NAMESPACE`` command.
         """
         warnings.warn(DeprecationWarning('get_folder_delimiter is going away. Use namespace() instead.'))
+        if self._cached_folder_delimiter is None:
+            self._cached_folder_delimiter = self._namespace_delimiter()
+        return self._cached_folder_delimiter
+
+    def _namespace_delimiter(self):
         for part in self.namespace():
-            for ns in part:
+            for ns in part or ():
                 return ns[1]
         raise self.Error('could not determine folder separator')
 
-    def list_folders(self, directory="", pattern="*"):
+    def list_folders(self, directory="", pattern="*", selection=None,
+                     return_options=None):
         """Get a listing of folders on the server as a list of
         ``(flags, delimiter, name)`` tuples.
 
@@ -257,10 +443,49 @@ class IMAPClient(object):
         character and ``%`` matches 0 or more characters except the
         folder delimiter.
 
+        *selection* and *return_options* are sequences of LIST
+        selection and return options as defined by the LIST-EXTENDED
+        extension (:rfc:`5258`). For example, ``selection=['SUBSCRIBED']``
+        only returns subscribed folders and
+        ``return_options=['SPECIAL-USE', 'CHILDREN']`` asks the server
+        to include special-use (:rfc:`6154`) and child attributes in
+        the returned flags. Extended data items returned by the server
+        are not included in the output. It is the responsibility of
+        the caller to check that the server supports the
+        ``LIST-EXTENDED`` capability before using these arguments.
+
         Folder names are always returned as unicode strings, and decoded from
         modifier utf-7, except if folder_decode is not set.
+
+        If folder caching is enabled (see *folder_cache_ttl*) and no
+        arguments are given, the cached folder list is returned.
+        """
+        if (self.folder_cache_ttl is not None and directory == "" and pattern == "*"
+            and not selection and not return_options):
+            self._get_folder_cache()
+            return list(self._folder_cache_list)
+        return self._do_list('LIST', directory, pattern, selection, return_options)
+
+    def find_special_folder(self, folder_flag):
+        """Return the name of the folder with the special-use attribute
+        *folder_flag* (eg. ``'\\Sent'``, ``'\\Trash'`` or
+        ``'\\All'``), or None if no such folder exists.
+
+        If the server supports the ``SPECIAL-USE`` extension
+        (:rfc:`6154`) only the special-use folders are requested from
+        the server. Otherwise all folders are listed and their flags
+        checked.
         """
-        return self._do_list('LIST', directory, pattern)
+        if self.has_capability('SPECIAL-USE'):
+            folders = self.list_folders(selection=['SPECIAL-USE'])
+        else:
+            folders = self.list_folders()
+
+        folder_flag = folder_flag.upper()
+        for flags, _, name in folders:
+            if folder_flag in (flag.upper() for flag in flags):
+                return name
+        return None
 
     def xlist_folders(self, directory="", pattern="*"):
         """Execute the XLIST command, returning ``(flags, delimiter,
@@ -305,27 +530,46 @@ class IMAPClient(object):
         """
         return self._do_list('LSUB', directory, pattern)
 
-    def _do_list(self, cmd, directory, pattern):
-        directory = self._normalise_folder(directory)
-        pattern = self._normalise_folder(pattern)
-        typ, dat = self._imap._simple_command(cmd, directory, pattern)
+    def _do_list(self, cmd, directory, pattern, selection=None, return_options=None):
+        args = [self._normalise_folder(directory), self._normalise_folder(pattern)]
+        if selection:
+            args.insert(0, seq_to_parenstr_upper(selection))
+        if return_options:
+            args.extend(['RETURN', seq_to_parenstr_upper(return_options)])
+        typ, dat = self._imap._simple_command(cmd, *args)
         dat = from_bytes(dat)
         self._checkok(cmd, typ, dat)
         typ, dat = self._imap._untagged_response(typ, dat, cmd)
-        return self._proc_folder_list(from_bytes(dat))
+        return self._timed_parse(self._proc_folder_list, from_bytes(dat))
 
-    def _proc_folder_list(self, folder_data):
-        # Filter out empty strings and None's.
-        # This also deals with the special case of - no 'untagged'
-        # responses (ie, no folders). This comes back as [None].
-        folder_data = [item for item in folder_data if item not in ('', None)]
+    def invalidate_folder_cache(self):
+        """Discard the cached folder list (see *folder_cache_ttl*).
 
+        The folder list will be fetched from the server again the next
+        time it is needed.
+        """
+        self._folder_cache = None
+        self._folder_cache_list = None
+        self._folder_cache_time = None
+
+    def _get_folder_cache(self):
+        if (self._folder_cache is None or
+            time.time() - self._folder_cache_time > self.folder_cache_ttl):
+            folders = self._do_list('LIST', '', '*')
+            self._folder_cache = dict((_folder_cache_key(folder[2]), folder)
+                                      for folder in folders)
+            self._folder_cache_list = folders
+            self._folder_cache_time = time.time()
+        return self._folder_cache
+
+    def _proc_folder_list(self, folder_data):
         ret = []
-        parsed = parse_response(folder_data)
-        while parsed:
-            # TODO: could be more efficient
-            flags, delim, name = parsed[:3]
-            parsed = parsed[3:]
+        for line in _group_response_lines(folder_data):
+            # LIST-EXTENDED responses may carry extended data items
+            # after the name. These are ignored.
+            flags, delim, name = parse_response(line)[:3]
+            if self._cached_folder_delimiter is None and delim:
+                self._cached_folder_delimiter = delim
 
             if isinstance(name, int):
                 # Some IMAP implementations return integer folder names
@@ -333,7 +577,10 @@ class IMAPClient(object):
                 # back to strings.
                 name = text_type(name)
             elif self.folder_encode:
-                name = decode_utf7(name)
+                if not self._utf8_enabled:
+                    name = decode_utf7(name)
+                elif isinstance(name, binary_type):
+                    name = name.decode('utf-8')
 
             ret.append((flags, delim, name))
         return ret
@@ -356,9 +603,104 @@ class IMAPClient(object):
              'UIDNEXT': 11,
              'UIDVALIDITY': 1239278212}
         """
-        self._command_and_check('select', self._normalise_folder(folder), readonly)
+        folder = self._normalise_folder(folder)
+        # A failed SELECT leaves no folder selected
+        self._clear_selected()
+        self._command_and_check('select', folder, readonly)
         untagged = self._imap.untagged_responses
-        return self._process_select_response(from_bytes(untagged))
+        response = self._process_select_response(from_bytes(untagged))
+        self._selected_folder = (_selected_key(folder), bool(readonly))
+        self._selected_response = response
+        # The responses collected so far are part of the SELECT response
+        self._new_untagged()
+        return response
+
+    def ensure_selected(self, folder, readonly=False, refresh=True):
+        """Make sure *folder* is the currently selected folder.
+
+        If *folder* is already selected in the requested mode, no
+        ``SELECT`` is issued and the response from the original
+        ``select_folder()`` call is returned, updated with any
+        ``EXISTS``, ``RECENT``, ``EXPUNGE`` and ``UIDNEXT`` responses
+        received since (during any command, including IDLE). If
+        *refresh* is ``True`` (the default) a ``NOOP`` is issued first
+        so that changes the server hasn't reported yet are included.
+
+        Otherwise the folder is selected with ``select_folder()`` and
+        its response returned.
+        """
+        key = (_selected_key(self._normalise_folder(folder)), bool(readonly))
+        if key != self._selected_folder:
+            return self.select_folder(folder, readonly)
+        if refresh:
+            self.noop()
+        else:
+            self._update_selected_response()
+        return dict(self._selected_response)
+
+    def _clear_selected(self):
+        self._selected_folder = None
+        self._selected_response = None
+
+    def _update_selected_response(self, responses=None):
+        """Apply untagged EXISTS, RECENT and EXPUNGE responses to the
+        cached SELECT response.
+
+        *responses* are parsed untagged responses, in the order they
+        were received. If not given, the responses collected by
+        imaplib since the last update (eg. unsolicited responses sent
+        during a FETCH or SEARCH) are applied instead. Call this with
+        no arguments before issuing a command whose parsed responses
+        are applied, as imaplib collects those too.
+
+        imaplib's collected responses are left in place for other
+        users of them (eg. imaplib's ``response()``). Those already
+        applied are remembered so that each is only applied once.
+        """
+        out = self._selected_response
+        if out is None:
+            return
+        new = self._new_untagged()
+        if responses is None:
+            # imaplib doesn't keep the order of responses of different
+            # types so this is an approximation: EXPUNGEs are applied
+            # first, then the last EXISTS received (which is absolute).
+            # EXISTS ends up too high if messages were expunged after
+            # that EXISTS was sent.
+            expunged = len(new['EXPUNGE'])
+            if expunged and out.get('EXISTS'):
+                out['EXISTS'] = max(out['EXISTS'] - expunged, 0)
+            for kind in ('EXISTS', 'RECENT'):
+                if new[kind]:
+                    out[kind] = int(new[kind][-1])
+        else:
+            # imaplib collected these too but they're applied here, in
+            # the order they were received.
+            for resp in responses:
+                if len(resp) != 2 or not isinstance(resp[0], integer_types):
+                    continue
+                num, kind = resp
+                kind = kind.upper()
+                if kind in ('EXISTS', 'RECENT'):
+                    out[kind] = num
+                elif kind == 'EXPUNGE' and out.get('EXISTS'):
+                    out['EXISTS'] -= 1
+        if new['UIDNEXT']:
+            out['UIDNEXT'] = int(new['UIDNEXT'][-1])
+
+    def _new_untagged(self):
+        # Return the EXISTS, RECENT, EXPUNGE and UIDNEXT responses
+        # collected by imaplib since the last call, keyed by type.
+        # imaplib appends to a list per type until something pops it,
+        # so the list and its length at the last call are remembered.
+        collected = self._imap.untagged_responses
+        new = {}
+        for kind in ('EXISTS', 'RECENT', 'EXPUNGE', 'UIDNEXT'):
+            values = collected.get(kind) or []
+            last, count = self._applied_untagged.get(kind, (None, 0))
+            new[kind] = values[count:] if values is last else values
+            self._applied_untagged[kind] = (values, len(values))
+        return new
 
     def _process_select_response(self, resp):
         out = {}
@@ -370,7 +712,7 @@ class IMAPClient(object):
             if match:
                 key = match.group('key')
                 if key == 'PERMANENTFLAGS':
-                    out[key] = tuple(match.group('data').split())
+                    out[key] = intern_flags(match.group('data').split())
 
         for key, value in iteritems(resp):
             key = key.upper()
@@ -381,7 +723,7 @@ class IMAPClient(object):
             elif key == 'READ-WRITE':
                 value = True
             elif key == 'FLAGS':
-                value = tuple(value[0][1:-1].split())
+                value = intern_flags(value[0][1:-1].split())
             out[key] = value
         return out
 
@@ -401,8 +743,12 @@ class IMAPClient(object):
               (6, 'FETCH', ('FLAGS', ('sne',)))])
 
         """
+        self._update_selected_response()
         tag = self._imap._command('NOOP')
-        return self._consume_until_tagged_response(tag, 'NOOP')
+        response = self._consume_until_tagged_response(tag, 'NOOP')
+        if self._selected_response is not None:
+            self._update_selected_response(response[1])
+        return response
 
     def idle(self):
         """Put the server into IDLE mode.
@@ -419,6 +765,7 @@ class IMAPClient(object):
 
         See :rfc:`2177` for more information about the IDLE extension.
         """
+        self._update_selected_response()
         self._idle_tag = self._imap._command('IDLE')
         resp = from_bytes(self._imap._get_response())
         if resp is not None:
@@ -467,7 +814,8 @@ class IMAPClient(object):
                         else:
                             raise
                     else:
-                        resps.append(_parse_untagged_response(line))
+                        resps.append(self._timed_parse(_parse_untagged_response, line))
+            self._update_selected_response(resps)
             return resps
         finally:
             sock.setblocking(1)
@@ -487,7 +835,10 @@ class IMAPClient(object):
         ``idle_check()``.
         """
         self._imap.send(b'DONE\r\n')
-        return self._consume_until_tagged_response(self._idle_tag, 'IDLE')
+        response = self._consume_until_tagged_response(self._idle_tag, 'IDLE')
+        if self._selected_response is not None:
+            self._update_selected_response(response[1])
+        return response
 
     def folder_status(self, folder, what=None):
         """Return the status of *folder*.
@@ -506,23 +857,45 @@ class IMAPClient(object):
         what_ = '(%s)' % (' '.join(what))
 
         data = self._command_and_check('status', self._normalise_folder(folder), what_, unpack=True)
-        _, status_items = parse_response([data])
+        _, status_items = self._timed_parse(parse_response, [data])
         return dict(as_pairs(status_items))
 
     def close_folder(self):
         """Close the currently selected folder, returning the server
         response string.
+
+        Note that closing a folder permanently removes all messages
+        with the ``\\Deleted`` flag set. Use ``unselect_folder()`` to
+        leave a folder without doing this.
         """
+        self._clear_selected()
         return self._command_and_check('close', unpack=True)
 
+    def unselect_folder(self):
+        """Unselect the currently selected folder without expunging
+        deleted messages, returning the server response string.
+
+        This only works with IMAP servers that support the UNSELECT
+        extension (see :rfc:`3691`).
+        """
+        self._clear_selected()
+        typ, data = self._imap._simple_command('UNSELECT')
+        data = from_bytes(data)
+        self._checkok('unselect', typ, data)
+        self._imap.state = 'AUTH'
+        return data[0]
+
     def create_folder(self, folder):
         """Create *folder* on the server returning the server response string.
         """
+        self.invalidate_folder_cache()
         return self._command_and_check('create', self._normalise_folder(folder), unpack=True)
 
     def rename_folder(self, old_name, new_name):
         """Change the name of a folder on the server.
         """
+        self.invalidate_folder_cache()
+        self._forget_if_selected(old_name)
         return self._command_and_check('rename',
                                        self._normalise_folder(old_name),
                                        self._normalise_folder(new_name),
@@ -531,11 +904,26 @@ class IMAPClient(object):
     def delete_folder(self, folder):
         """Delete *folder* on the server returning the server response string.
         """
+        self.invalidate_folder_cache()
+        self._forget_if_selected(folder)
         return self._command_and_check('delete', self._normalise_folder(folder), unpack=True)
 
+    def _forget_if_selected(self, folder):
+        if self._selected_folder:
+            if self._selected_folder[0] == _selected_key(self._normalise_folder(folder)):
+                self._clear_selected()
+
     def folder_exists(self, folder):
         """Return ``True`` if *folder* exists on the server.
+
+        If folder caching is enabled (see *folder_cache_ttl*) the
+        cached folder list is consulted instead of querying the
+        server.
         """
+        if self.folder_cache_ttl is not None:
+            if isinstance(folder, binary_type):
+                folder = folder.decode('ascii')
+            return _folder_cache_key(folder) in self._get_folder_cache()
         data = self._command_and_check('list', '""', self._normalise_folder(folder))
         data = [x for x in data if x]
         return len(data) == 1 and data[0] != None
@@ -543,11 +931,13 @@ class IMAPClient(object):
     def subscribe_folder(self, folder):
         """Subscribe to *folder*, returning the server response string.
         """
+        self.invalidate_folder_cache()
         return self._command_and_check('subscribe', self._normalise_folder(folder))
 
     def unsubscribe_folder(self, folder):
         """Unsubscribe to *folder*, returning the server response string.
         """
+        self.invalidate_folder_cache()
         return self._command_and_check('unsubscribe', self._normalise_folder(folder))
 
     def search(self, criteria='ALL', charset=None):
@@ -624,7 +1014,7 @@ class IMAPClient(object):
         args.extend(normalise_search_criteria(criteria))
 
         data = self._command_and_check('thread', *args, uid=True)
-        return parse_response(data)
+        return self._timed_parse(parse_response, data)
 
     def sort(self, sort_criteria, criteria='ALL', charset='UTF-8'):
         """Return a list of message ids sorted by *sort_criteria* and
@@ -755,7 +1145,7 @@ class IMAPClient(object):
         """
         return self.add_flags(messages, DELETED)
 
-    def fetch(self, messages, data, modifiers=None):
+    def fetch(self, messages, data, modifiers=None, result_type='dict', failures=None):
         """Retrieve selected *data* associated with one or more *messages*.
 
         *data* should be specified as a sequnce of strings, one item
@@ -772,7 +1162,9 @@ class IMAPClient(object):
         appropriately typed. For example, integer values will be returned as
         Python integers, timestamps will be returned as datetime
         instances and ENVELOPE responses will be returned as
-        :py:class:`Envelope <imapclient.response_types.Envelope>` instances.
+        :py:class:`LazyEnvelope <imapclient.response_types.LazyEnvelope>`
+        instances (which behave like
+        :py:class:`Envelope <imapclient.response_types.Envelope>`).
 
         In addition to an element for each *data* item, the dict
         returned for each message also contains a *SEQ* key containing
@@ -789,14 +1181,298 @@ class IMAPClient(object):
              3293: {'FLAGS': (),
                     'INTERNALDATE': datetime.datetime(2011, 2, 24, 19, 30, 36),
                     'SEQ': 110}}
+
+        If *result_type* is ``'compact'``, each message's data is
+        returned as a :py:class:`FetchRecord
+        <imapclient.response_types.FetchRecord>` instead of a
+        dictionary. These use much less memory, provide attribute
+        access to common data items (eg. ``record.flags``) and can
+        still be used like the dictionaries returned by default.
+
+        By default an exception is raised if the server's response
+        can't be parsed. If a list is passed as *failures*, messages
+        with malformed responses are left out of the result instead
+        and a :py:class:`FetchFailure
+        <imapclient.response_types.FetchFailure>` (holding the
+        sequence number, the raw response and the error) is appended
+        to *failures* for each of them. The data for all other
+        messages is still returned, so only the failed messages need
+        to be fetched again.
         """
         if not messages:
             return {}
 
+        items = seq_to_parenstr_upper(data)
+        if SIMPLE_FETCH_ITEMS.issuperset(items[1:-1].split(' ')):
+            # Only simple data items requested so a faster parser can be used
+            parser = parse_simple_fetch_response
+        else:
+            parser = parse_fetch_response
+
+        data = self._fetch_raw(messages, items, modifiers)
+        return self._timed_parse(parser, data,
+                                 self.normalise_times, self.use_uid, result_type,
+                                 failures)
+
+    def fetch_columns(self, messages, data=('RFC822.SIZE', 'INTERNALDATE', 'FLAGS'),
+                      modifiers=None):
+        """Retrieve metadata for *messages* as NumPy arrays.
+
+        *data* may contain any of ``UID``, ``RFC822.SIZE``,
+        ``INTERNALDATE``, ``FLAGS`` and ``MODSEQ``. A dictionary of
+        equal length arrays is returned, with one element per message
+        ordered by sequence number. The ``seq`` array (always
+        present) holds message sequence numbers. ``uid`` (uint32) is
+        also present if UIDs were requested or *use_uid* is True. The
+        other arrays are ``size`` (int64), ``internaldate``
+        (datetime64, UTC), ``flags`` (uint8 bitmask of system flags;
+        see :py:data:`imapclient.columns.SYSTEM_FLAG_BITS`) and
+        ``modseq`` (uint64).
+
+        This avoids building a dictionary per message when analysing
+        large mailboxes. NumPy must be installed.
+        """
+        # Imported here so that NumPy is only loaded when needed
+        from .columns import parse_fetch_columns
+        items = [item.upper() for item in normalise_text_list(data)]
+        if self.use_uid and 'UID' not in items:
+            items.insert(0, 'UID')
+        if not messages:
+            return parse_fetch_columns([None], items)
+        data = self._fetch_raw(messages, seq_to_parenstr(items), modifiers)
+        return self._timed_parse(parse_fetch_columns, data, items)
+
+    def fetch_headers(self, messages, fields=None):
+        """Retrieve the header *fields* (a sequence of header names, eg.
+        ``['From', 'Subject']``) of *messages* without setting the
+        \\Seen flag. All headers are retrieved if *fields* isn't given.
+
+        A dictionary is returned, indexed by message id, containing a
+        :py:class:`HeaderMap <imapclient.response_types.HeaderMap>` for
+        each message. These are case-insensitive mappings of header
+        names to values which are only parsed when first used, making
+        scans of the headers of large numbers of messages cheap.
+        """
+        if fields:
+            section = 'HEADER.FIELDS %s' % seq_to_parenstr_upper(fields)
+        else:
+            section = 'HEADER'
+        response = self.fetch(messages, ['BODY.PEEK[%s]' % section])
+
+        # The server names the returned data item without ".PEEK" and
+        # may quote or reorder the field names.
+        prefix = 'BODY[%s' % section.split(' ')[0]
+        headers = {}
+        for msg_id, msg_data in iteritems(response):
+            headers[msg_id] = HeaderMap('')
+            for key, value in iteritems(msg_data):
+                if key.upper().startswith(prefix) and value is not None:
+                    headers[msg_id] = HeaderMap(value)
+                    break
+        return headers
+
+    def fetch_previews(self, messages, length=256):
+        """Return a short plain text preview of each of *messages*,
+        as shown in message lists.
+
+        The BODYSTRUCTURE of each message is fetched to find its first
+        text part (text/plain is preferred over other text types). Only
+        the start of that part is then fetched, without setting the
+        \\Seen flag, using a single command for all the messages
+        whose text part has the same section number. These commands
+        are all sent before any of the responses are read. The transfer
+        encoding and charset are decoded, markup is removed from HTML
+        parts and whitespace is collapsed.
+
+        A dictionary is returned, indexed by message id, with a
+        preview of at most *length* characters for each message, or
+        None for messages with no text part.
+        """
+        structures = self.fetch(messages, ['BODYSTRUCTURE'])
+
+        previews = {}
+        parts = {}
+        to_fetch = {}   # section -> (octets, msg_ids)
+        for msg_id, msg_data in iteritems(structures):
+            found = None
+            if 'BODYSTRUCTURE' in msg_data:
+                found = find_text_part(msg_data['BODYSTRUCTURE'])
+            if found is None:
+                previews[msg_id] = None
+                continue
+            section, part = found
+            parts[msg_id] = part
+            octets, msg_ids = to_fetch.get(section, (0, []))
+            msg_ids.append(msg_id)
+            to_fetch[section] = (max(octets, preview_octets(part, length)), msg_ids)
+        if not to_fetch:
+            return previews
+
+        # One FETCH per section, all sent before any responses are read
+        sections = sorted(to_fetch)
+        data = self._fetch_raw_pipelined([
+            (to_fetch[section][1], 'BODY.PEEK[%s]<0.%d>' % (section, to_fetch[section][0]))
+            for section in sections])
+        response = self._timed_parse(parse_fetch_response, data,
+                                     self.normalise_times, self.use_uid)
+        for section in sections:
+            # The server names the returned item "BODY[<section>]<0>"
+            prefix = 'BODY[%s]' % section
+            for msg_id in to_fetch[section][1]:
+                data = b''
+                for key, value in iteritems(response.get(msg_id, {})):
+                    if key.upper().startswith(prefix) and value is not None:
+                        data = value
+                        break
+                part = parts[msg_id]
+                # Only use as much as would have been fetched for this part
+                data = data[:preview_octets(part, length)]
+                previews[msg_id] = decode_preview(data, part, length)
+        return previews
+
+    def download(self, msg_id, section, dest, chunk_size=1024 * 1024, in_flight=1):
+        """Download part of a message, or the whole message if
+        *section* is ``''``, to *dest* in chunks of *chunk_size* bytes
+        using partial fetches (``BODY.PEEK[section]<offset.size>``).
+        Only one chunk needs to be held in memory at a time.
+
+        *dest* may be a filename or a file object opened for writing
+        in binary mode. When a filename is given, the data is written
+        to *dest* with ".part" appended, which is renamed to *dest*
+        once the download is complete. If a download is interrupted
+        (eg. by a dropped connection), calling download() again with
+        the same arguments, after reconnecting and selecting the
+        folder, continues from where the previous attempt stopped.
+        Before continuing, the last chunk of the partial download is
+        compared with the server. If it differs (eg. the partial
+        download is of another message, or of one with the same UID
+        before the folder's UIDVALIDITY changed) the download starts
+        again. Only that chunk is compared, so a partial download
+        which differs from the message only in earlier data isn't
+        detected. When a file object is given, downloading starts at the offset
+        given by its current position.
+
+        Up to *in_flight* chunk requests are sent before waiting for
+        the responses, which helps on high latency connections.
+
+        When downloading a whole message, its RFC822.SIZE is fetched
+        first and an error is raised if the downloaded size doesn't
+        match. Returns the total number of bytes downloaded.
+        """
+        msg_id = int(msg_id)
+        section = section.upper()
+        size = None
+        if not section:
+            response = self.fetch(msg_id, ['RFC822.SIZE'])
+            if msg_id not in response:
+                raise self.Error('message %s not found' % msg_id)
+            size = response[msg_id]['RFC822.SIZE']
+
+        if isinstance(dest, string_types):
+            part_path = dest + '.part'
+            offset = 0
+            if os.path.exists(part_path):
+                offset = os.path.getsize(part_path)
+                if offset and not self._partial_matches(msg_id, section, part_path,
+                                                        offset, size, chunk_size):
+                    # Left over from a different message (or a different
+                    # version of it), so start again.
+                    offset = 0
+            with open(part_path, 'ab' if offset else 'wb') as f:
+                offset = self._download_chunks(msg_id, section, f, offset, size,
+                                               chunk_size, in_flight)
+            self._check_download_size(msg_id, offset, size)
+            os.rename(part_path, dest)
+        else:
+            offset = self._download_chunks(msg_id, section, dest, dest.tell(), size,
+                                           chunk_size, in_flight)
+            self._check_download_size(msg_id, offset, size)
+        return offset
+
+    def _partial_matches(self, msg_id, section, part_path, offset, size, chunk_size):
+        # Check that a partial download is of this message by
+        # comparing its last chunk with the server.
+        if size is not None and offset > size:
+            return False
+        start = max(offset - chunk_size, 0)
+        expected = self._fetch_partial(msg_id, section, [start], offset - start).get(start)
+        with open(part_path, 'rb') as f:
+            f.seek(start)
+            return f.read() == expected
+
+    def _check_download_size(self, msg_id, offset, size):
+        if size is not None and offset != size:
+            raise self.Error('downloaded %d bytes of message %s but RFC822.SIZE is %d'
+                             % (offset, msg_id, size))
+
+    def _download_chunks(self, msg_id, section, f, offset, size, chunk_size, in_flight):
+        while size is None or offset < size:
+            offsets = [offset + i * chunk_size for i in range(max(in_flight, 1))]
+            if size is not None:
+                offsets = [o for o in offsets if o < size]
+            chunks = self._fetch_partial(msg_id, section, offsets, chunk_size)
+            for chunk_offset in offsets:
+                data = chunks.get(chunk_offset) or b''
+                f.write(data)
+                f.flush()
+                offset += len(data)
+                if len(data) < chunk_size:
+                    # Short chunk: the end of the data has been reached
+                    # (or the server returned less than the size says).
+                    return offset
+        return offset
+
+    def _fetch_partial(self, msg_id, section, offsets, chunk_size):
+        """Fetch chunks of *section* of a message in a single round
+        trip, returning a dictionary of chunk offset -> data.
+        """
+        items_list = ['(BODY.PEEK[%s]<%d.%d>)' % (section, o, chunk_size) for o in offsets]
+        data = self._fetch_raw_pipelined([(msg_id, items) for items in items_list])
+        response = self._timed_parse(parse_fetch_response, data,
+                                     self.normalise_times, self.use_uid)
+        chunks = {}
+        for key, value in iteritems(response.get(msg_id, {})):
+            match = _partial_key_re.match(key.upper())
+            if match and value is not None:
+                if isinstance(value, text_type):
+                    value = value.encode('latin-1')
+                chunks[int(match.group(1))] = value
+        return chunks
+
+    def _fetch_raw_pipelined(self, commands):
+        # Like _fetch_raw() but for a list of (messages, items) FETCH
+        # commands, which are all sent before any of the responses
+        # are read.
+        tags = []
+        for messages, items in commands:
+            args = ['FETCH', messages_to_str(messages), items]
+            if self.use_uid:
+                args.insert(0, 'UID')
+            tags.append(self._imap._command(*args))
+        error = None
+        for tag in tags:
+            # The responses to every command are read, even after one
+            # fails, so that none are left for the next command.
+            try:
+                typ, data = self._imap._command_complete('FETCH', tag)
+                self._checkok('fetch', typ, from_bytes(data))
+            except self.AbortError:
+                raise
+            except self.Error as err:
+                if error is None:
+                    error = err
+        if error is not None:
+            # Discard the data returned by the commands that succeeded
+            self._imap.untagged_responses.pop('FETCH', None)
+            raise error
+        typ, data = self._imap._untagged_response(typ, data, 'FETCH')
+        return from_bytes(data)
+
+    def _fetch_raw(self, messages, items, modifiers):
         args = [
             'FETCH',
             messages_to_str(messages),
-            seq_to_parenstr_upper(data),
+            items,
             seq_to_parenstr_upper(modifiers) if modifiers else None
         ]
         if self.use_uid:
@@ -806,13 +1482,19 @@ class IMAPClient(object):
         data = from_bytes(data)
         self._checkok('fetch', typ, data)
         typ, data = self._imap._untagged_response(typ, data, 'FETCH')
-        return parse_fetch_response(from_bytes(data), self.normalise_times, self.use_uid)
+        return from_bytes(data)
 
     def append(self, folder, msg, flags=(), msg_time=None):
         """Append a message to *folder*.
 
         *msg* should be a string contains the full message including
-        headers.
+        headers. Alternatively, *msg* may be a seekable file object
+        opened in binary mode (or, under Python 3, a path-like object
+        such as a ``pathlib.Path``) from which the message is read. The
+        message is then streamed to the server in chunks so that large
+        messages aren't loaded in to memory. The file is read from its
+        current position to its end. Note that a string *msg* is always
+        taken to be the message itself, not a filename.
 
         *flags* should be a sequence of message flags to set. If not
         specified no flags will be set.
@@ -833,13 +1515,47 @@ class IMAPClient(object):
                 time_val = to_bytes(time_val)
         else:
             time_val = None
-        return self._command_and_check('append',
-                                       self._normalise_folder(folder),
-                                       seq_to_parenstr(flags),
-                                       time_val,
-                                       to_bytes(msg),
+        folder = self._normalise_folder(folder)
+        flags = seq_to_parenstr(flags)
+        if isinstance(msg, _path_types):
+            with open(msg, 'rb') as msg_file:
+                return self._append_file(folder, flags, time_val, msg_file)
+        if hasattr(msg, 'read'):
+            return self._append_file(folder, flags, time_val, msg)
+        return self._command_and_check('append', folder, flags, time_val, to_bytes(msg),
                                        unpack=True)
 
+    def _append_file(self, folder, flags, time_val, msg_file):
+        # Line endings are converted to CRLF as imaplib does for
+        # in-memory messages. This changes the size of the literal so
+        # the file is read twice: once to size it and once to send it.
+        start = msg_file.tell()
+        size = sum(len(chunk) for chunk in _crlf_chunks(msg_file))
+        msg_file.seek(start)
+
+        non_sync = self.has_capability('LITERAL+') or (
+            size <= _LITERAL_MINUS_MAX and self.has_capability('LITERAL-'))
+        literal = '{%d%s}' % (size, '+' if non_sync else '')
+        tag = self._imap._command('APPEND', folder, flags, time_val, literal)
+        tagged_commands = self._imap.tagged_commands
+        if not non_sync:
+            # Wait for the continuation response. The server may
+            # reject the message (eg. because it's too big) instead.
+            while self._imap._get_response():
+                if tagged_commands[tag]:
+                    break
+        if non_sync or not tagged_commands[tag]:
+            try:
+                for chunk in _crlf_chunks(msg_file):
+                    self._imap.send(chunk)
+                self._imap.send(b'\r\n')
+            except socket.error as err:
+                raise self.AbortError('socket error: %s' % err)
+        typ, data = self._imap._command_complete('APPEND', tag)
+        data = from_bytes(data)
+        self._checkok('append', typ, data)
+        return data[0]
+
     def copy(self, messages, folder):
         """Copy one or more messages from the current folder to
         *folder*. Returns the COPY response string returned by the
@@ -869,8 +1585,12 @@ class IMAPClient(object):
         See :rfc:`3501#section-6.4.3` section 6.4.3 and
         :rfc:`3501#section-7.4.1` section 7.4.1 for more details.
         """
+        self._update_selected_response()
         tag = self._imap._command('EXPUNGE')
-        return self._consume_until_tagged_response(tag, 'EXPUNGE')
+        response = self._consume_until_tagged_response(tag, 'EXPUNGE')
+        if self._selected_response is not None:
+            self._update_selected_response(response[1])
+        return response
 
     def getacl(self, folder):
         """Returns a list of ``(who, acl)`` tuples describing the
@@ -907,7 +1627,7 @@ class IMAPClient(object):
             line = self._imap._get_response()
             if tagged_commands[tag]:
                 break
-            resps.append(_parse_untagged_response(from_bytes(line)))
+            resps.append(self._timed_parse(_parse_untagged_response, from_bytes(line)))
         typ, data = tagged_commands.pop(tag)
         data = from_bytes(data)
         self._checkok(command, typ, data)
@@ -944,12 +1664,36 @@ class IMAPClient(object):
                                        cmd,
                                        seq_to_parenstr(flags),
                                        uid=True)
-        return self._filter_fetch_dict(parse_fetch_response(data), fetch_key)
+        return self._filter_fetch_dict(self._timed_parse(parse_simple_fetch_response, data),
+                                       fetch_key)
 
     def _filter_fetch_dict(self, fetch_dict, key):
         return dict((msgid, data[key])
                     for msgid, data in iteritems(fetch_dict))
 
+    def _timed_parse(self, parse_func, *args):
+        metrics = self._metrics
+        if metrics is None:
+            return parse_func(*args)
+        start = clock()
+        result = parse_func(*args)
+        metrics.parsed(clock() - start, result)
+        return result
+
+    def __metrics_hook_get(self):
+        if self._metrics:
+            return self._metrics.hook
+        return None
+
+    def __metrics_hook_set(self, hook):
+        if self._metrics:
+            self._metrics.uninstall()
+            self._metrics = None
+        if hook is not None:
+            self._metrics = MetricsRecorder(self._imap, hook)
+
+    metrics_hook = property(__metrics_hook_get, __metrics_hook_set)
+
     def __debug_get(self):
         return self._imap.debug
 
@@ -963,10 +1707,21 @@ class IMAPClient(object):
     debug = property(__debug_get, __debug_set)
 
     def _log(self, text):
-        self.log_file.write('%s %s\n' % (datetime.now().strftime('%M:%S.%f'), text))
-        self.log_file.flush()
+        if self.log_file is not None:
+            self.log_file.write('%s %s\n' % (datetime.now().strftime('%M:%S.%f'),
+                                             _RedactedText(text)))
+            self.log_file.flush()
+        elif self.logger.isEnabledFor(logging.DEBUG):
+            # Redaction is only done if the message is actually emitted
+            self.logger.debug('%s', _RedactedText(text))
 
     def _normalise_folder(self, folder_name):
+        if self._utf8_enabled:
+            # Folder names are sent as is when UTF8=ACCEPT is enabled
+            if isinstance(folder_name, binary_type):
+                folder_name = folder_name.decode('utf-8')
+            return self._imap._quote(folder_name)
+
         if isinstance(folder_name, binary_type):
             folder_name = folder_name.decode('ascii')
         if self.folder_encode:
@@ -1026,6 +1781,62 @@ def _parse_untagged_response(text):
         return tuple(text.split(' ', 1))
     return parse_response([text])
 
+def _folder_cache_key(name):
+    # INBOX is case-insensitive
+    if name.upper() == 'INBOX':
+        return 'INBOX'
+    return name
+
+class _RedactedText(object):
+    """Wraps a debug message, hiding any credentials when it is
+    converted to a string.
+    """
+
+    # Matches the arguments to LOGIN and the initial response (if any)
+    # of AUTHENTICATE in commands as logged by imaplib. The closing
+    # quote of repr'd bytes is retained.
+    redact_re = re.compile(r"""^(> \S+ (?:LOGIN|AUTHENTICATE [^\s'"]+))( .*?)(['"]?)$""",
+                           re.IGNORECASE)
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return self.redact_re.sub(r'\1 **REDACTED**\3', text_type(self.text))
+
+    __unicode__ = __str__
+
+def _selected_key(folder):
+    # INBOX is case-insensitive
+    if folder.upper() == '"INBOX"':
+        return '"INBOX"'
+    return folder
+
+def _group_response_lines(data):
+    """Group the records returned by imaplib for a command into
+    complete response lines.
+
+    imaplib returns a line containing a literal as a ``(text,
+    literal)`` tuple followed by the remainder of the line as a
+    separate string. Empty strings and None's are dropped. This also
+    deals with the special case of no untagged responses which comes
+    back as [None].
+    """
+    line = []
+    for item in data:
+        if isinstance(item, tuple):
+            line.append(item)
+            continue
+        if item:
+            line.append(item)
+        if line:
+            yield line
+            line = []
+    if line:
+        yield line
+
 def pop_with_default(dct, key, default):
     if key in dct:
         return dct.pop(key)
@@ -1041,6 +1852,26 @@ def as_pairs(items):
             last_item = item
         i += 1
 
+def _crlf_chunks(msg_file):
+    """Yield the rest of *msg_file* in chunks with all line endings
+    converted to CRLF.
+    """
+    pending_cr = False
+    while True:
+        chunk = to_bytes(msg_file.read(_APPEND_CHUNK_SIZE))
+        if not chunk:
+            break
+        if pending_cr:
+            chunk = b'\r' + chunk
+        # A CR at the end of a chunk may be the start of a CRLF
+        pending_cr = chunk.endswith(b'\r')
+        if pending_cr:
+            chunk = chunk[:-1]
+        yield _line_end_re.sub(b'\r\n', chunk)
+    if pending_cr:
+        yield b'\r\n'
+
+
 def to_unicode(s):
     if isinstance(s, binary_type):
         return s.decode('ascii')
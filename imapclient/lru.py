@@ -0,0 +1,64 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+"""
+A small bounded cache used to memoise expensive conversions of
+values which tend to repeat in IMAP responses.
+"""
+
+from __future__ import unicode_literals
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6: fall back to a plain dict which is emptied when it
+    # fills up instead of discarding just the oldest entry.
+    OrderedDict = None
+
+__all__ = ['LRUCache']
+
+
+class LRUCache(object):
+    """
+    A mapping holding at most *maxsize* items. When full, the least
+    recently used item is discarded to make room for a new one.
+
+    Only ``get()``, item assignment, ``len()`` and ``clear()`` are
+    supported.
+    """
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self._data = OrderedDict() if OrderedDict else {}
+
+    def get(self, key, default=None):
+        data = self._data
+        try:
+            value = data.pop(key)
+        except KeyError:
+            return default
+        data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._data
+        data.pop(key, None)
+        if len(data) >= self.maxsize:
+            try:
+                if OrderedDict:
+                    data.popitem(last=False)
+                else:
+                    data.clear()
+            except KeyError:
+                # Emptied by another thread
+                pass
+        data[key] = value
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
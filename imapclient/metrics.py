@@ -0,0 +1,201 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+"""
+Per-command instrumentation for IMAPClient.
+
+See the *metrics_hook* attribute of :py:class:`imapclient.IMAPClient`.
+"""
+
+from __future__ import unicode_literals
+
+import time
+
+from .six import binary_type, text_type
+
+__all__ = ['CommandStats']
+
+# Use the best timer available
+clock = getattr(time, 'perf_counter', time.time)
+
+# Commands with responses which IMAPClient parses after the command
+# has completed. Statistics for these are reported once parsing is done.
+PARSED_COMMANDS = frozenset(['FETCH', 'STORE', 'LIST', 'LSUB', 'XLIST',
+                             'NAMESPACE', 'STATUS', 'THREAD'])
+
+
+class CommandStats(object):
+    """
+    Statistics for a single IMAP command. Instances are passed to the
+    metrics hook once the command has completed and its response has
+    been parsed.
+
+    :ivar name: The command name (eg. ``'SELECT'`` or ``'UID FETCH'``).
+    :ivar tag: The tag the command was sent with.
+    :ivar status: The command completion status (``'OK'``, ``'NO'``
+      or ``'BAD'``) or None if no tagged response was seen.
+    :ivar message_count: The number of messages in a parsed FETCH or
+      STORE response, otherwise None.
+    :ivar first_byte_time: Seconds between sending the command and
+      receiving the first line of the response, or None if nothing
+      was received.
+    :ivar wire_time: Seconds between sending the command and receiving
+      the tagged completion response.
+    :ivar bytes_sent: Bytes sent for the command, including literals.
+    :ivar bytes_received: Bytes received in response to the command.
+    :ivar untagged_responses: The number of untagged responses received.
+    :ivar parse_time: Seconds spent parsing the response.
+    """
+
+    __slots__ = ('name', 'tag', 'status', 'message_count',
+                 'first_byte_time', 'wire_time', 'bytes_sent',
+                 'bytes_received', 'untagged_responses', 'parse_time',
+                 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.tag = None
+        self.status = None
+        self.message_count = None
+        self.first_byte_time = None
+        self.wire_time = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.untagged_responses = 0
+        self.parse_time = 0.0
+        self.start = clock()
+
+    def __repr__(self):
+        return '<CommandStats %s %s: %s>' % (
+            self.name, self.tag,
+            ', '.join('%s=%r' % (attr, getattr(self, attr))
+                      for attr in self.__slots__[2:-1]))
+
+
+class MetricsRecorder(object):
+    """
+    Collects CommandStats by wrapping the I/O methods of an imaplib
+    IMAP4 instance and passes them to *hook*.
+
+    Several commands may be in progress at once (eg. pipelined
+    FETCHes). Servers answer commands in the order they were sent, so
+    response data is credited to the oldest command still waiting for
+    its tagged response.
+    """
+
+    wrapped = ('_command', 'send', 'readline', 'read')
+
+    def __init__(self, imap, hook):
+        self.imap = imap
+        self.hook = hook
+        self.outstanding = []   # (tag prefix, stats) waiting for the tagged response
+        self.pending = []       # waiting for parsing to complete
+        self._orig = {}
+        for name in self.wrapped:
+            self._orig[name] = getattr(imap, name)
+            setattr(imap, name, getattr(self, name))
+
+    def uninstall(self):
+        self.flush()
+        for name, meth in self._orig.items():
+            setattr(self.imap, name, meth)
+
+    def flush(self):
+        """Report statistics for any command which hasn't been
+        reported yet.
+        """
+        self._report_pending()
+        outstanding, self.outstanding = self.outstanding, []
+        for _, stats in outstanding:
+            self.hook(stats)
+
+    def parsed(self, elapsed, result):
+        if self.pending:
+            # The responses to pipelined commands are parsed together;
+            # the parse is credited to the last of them.
+            stats = self.pending[-1]
+            stats.parse_time += elapsed
+            stats.message_count = _message_count(result)
+            self._report_pending()
+        elif self.outstanding:
+            self.outstanding[-1][1].parse_time += elapsed
+
+    def _report_pending(self):
+        pending, self.pending = self.pending, []
+        for stats in pending:
+            self.hook(stats)
+
+    def _command(self, name, *args):
+        self._report_pending()
+        if name == 'UID' and args:
+            name = 'UID ' + args[0].upper()
+        stats = CommandStats(name)
+        entry = [None, stats]
+        self.outstanding.append(entry)
+        try:
+            tag = self._orig['_command'](name.split(' ', 1)[0], *args)
+        except Exception:
+            self.outstanding.remove(entry)
+            self.hook(stats)
+            raise
+        entry[0] = tag + b' '
+        stats.tag = tag.decode('ascii') if isinstance(tag, binary_type) else tag
+        return tag
+
+    def send(self, data):
+        if self.outstanding:
+            size = len(data)
+            if isinstance(data, text_type):
+                # Python 2's imaplib sends unicode command lines, as
+                # UTF-8 once UTF8=ACCEPT is enabled
+                size = len(data.encode('utf-8'))
+            self.outstanding[-1][1].bytes_sent += size
+        return self._orig['send'](data)
+
+    def readline(self):
+        line = self._orig['readline']()
+        if not self.outstanding:
+            return line
+        if not line.startswith(b'* '):
+            for i, (prefix, stats) in enumerate(self.outstanding):
+                if prefix is not None and line.startswith(prefix):
+                    del self.outstanding[i]
+                    self._received(stats, line)
+                    stats.wire_time = clock() - stats.start
+                    status = line[len(prefix):].split(b' ', 1)[0].strip()
+                    stats.status = status.decode('ascii').upper()
+                    self._completed(stats)
+                    return line
+        stats = self.outstanding[0][1]
+        if line.startswith(b'* '):
+            stats.untagged_responses += 1
+        self._received(stats, line)
+        return line
+
+    def read(self, size):
+        data = self._orig['read'](size)
+        if self.outstanding:
+            self.outstanding[0][1].bytes_received += len(data)
+        return data
+
+    def _received(self, stats, data):
+        if stats.first_byte_time is None:
+            stats.first_byte_time = clock() - stats.start
+        stats.bytes_received += len(data)
+
+    def _completed(self, stats):
+        if stats.status == 'OK' and stats.name.split(' ')[-1] in PARSED_COMMANDS:
+            self.pending.append(stats)
+        else:
+            self.hook(stats)
+
+
+def _message_count(result):
+    if not isinstance(result, dict):
+        return None
+    if 'seq' in result:
+        # Columnar FETCH results: a sequence per data item
+        return len(result['seq'])
+    # A parsed FETCH response, keyed by message
+    return len(result)
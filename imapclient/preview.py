@@ -0,0 +1,141 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+"""
+Helpers for building short text previews of messages from partial
+fetches of their first text part.
+
+See :py:meth:`IMAPClient.fetch_previews <imapclient.IMAPClient.fetch_previews>`.
+"""
+
+from __future__ import unicode_literals
+
+import binascii
+import codecs
+import quopri
+import re
+
+from .six import string_types, text_type
+
+__all__ = ['find_text_part', 'preview_octets', 'decode_preview']
+
+# How many octets of a part to fetch per character of preview wanted,
+# by transfer encoding. This allows for multi-byte characters, the
+# encodings themselves and the whitespace (and for HTML the markup)
+# which is dropped.
+_OCTETS_PER_CHAR = {
+    'base64': 6,
+    'quoted-printable': 6,
+}
+_DEFAULT_OCTETS_PER_CHAR = 4
+_HTML_FACTOR = 4
+
+_html_drop_re = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->|<[^>]*>|<[^>]*$',
+                           re.IGNORECASE | re.DOTALL)
+_html_entities = {'&nbsp;': ' ', '&lt;': '<', '&gt;': '>', '&quot;': '"', '&#39;': "'",
+                  '&amp;': '&'}
+_html_entity_re = re.compile('|'.join(_html_entities))
+_qp_partial_re = re.compile(br'=[^\n]?$')
+_base64_junk_re = re.compile(br'[^A-Za-z0-9+/=]')
+
+
+def find_text_part(body):
+    """Find the part to build a preview from in the BODYSTRUCTURE
+    *body* (as returned by :py:meth:`IMAPClient.fetch
+    <imapclient.IMAPClient.fetch>`).
+
+    Returns a ``(section, part)`` tuple where *section* is the part
+    specifier (eg. ``'1.2'``) and *part* the part's body structure, or
+    None if the message has no text parts. The first text/plain part
+    is preferred, falling back to the first other text part (eg.
+    text/html).
+    """
+    first_text = None
+    # Walk the parts in order, using an explicit stack of (part,
+    # section) entries to the next parts to visit.
+    stack = [(body, None)]
+    while stack:
+        part, section = stack.pop()
+        if part.is_multipart:
+            prefix = section + '.' if section else ''
+            stack.extend(reversed([(child, '%s%d' % (prefix, i))
+                                   for i, child in enumerate(part[0], 1)]))
+            continue
+        if _lower(part[0]) != 'text':
+            continue
+        found = (section or '1', part)
+        if _lower(part[1]) == 'plain':
+            return found
+        if first_text is None:
+            first_text = found
+    return first_text
+
+
+def preview_octets(part, length):
+    """Return the number of octets of the text *part* to fetch for a
+    preview of *length* characters.
+    """
+    octets = length * _OCTETS_PER_CHAR.get(_encoding(part), _DEFAULT_OCTETS_PER_CHAR)
+    if _lower(part[1]) == 'html':
+        octets *= _HTML_FACTOR
+    return octets
+
+
+def decode_preview(data, part, length):
+    """Return up to *length* characters of preview text from *data*,
+    the start of the text *part*.
+
+    The transfer encoding and charset of the part are decoded (any
+    incomplete data at the end being ignored), markup is removed from
+    HTML parts and runs of whitespace are collapsed.
+    """
+    if isinstance(data, text_type):
+        data = data.encode('latin-1')
+    encoding = _encoding(part)
+    if encoding == 'base64':
+        data = _base64_junk_re.sub(b'', data)
+        data = data[:len(data) - len(data) % 4]
+        try:
+            data = binascii.a2b_base64(data)
+        except binascii.Error:
+            data = b''
+    elif encoding == 'quoted-printable':
+        data = quopri.decodestring(_qp_partial_re.sub(b'', data))
+
+    text = _text_decoder(_charset(part)).decode(data)
+    if _lower(part[1]) == 'html':
+        text = _html_drop_re.sub(' ', text)
+        text = _html_entity_re.sub(lambda m: _html_entities[m.group(0)], text)
+    return ' '.join(text.split())[:length]
+
+
+def _text_decoder(charset):
+    # An incremental decoder (which isn't told that the input is
+    # complete) drops an incomplete multi-byte character at the end.
+    try:
+        decoder = codecs.getincrementaldecoder(charset)
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('latin-1')
+    return decoder(errors='replace')
+
+
+def _encoding(part):
+    return _lower(part[5]) if len(part) > 5 else ''
+
+
+def _charset(part):
+    params = part[2]
+    if isinstance(params, tuple):
+        for i in range(0, len(params) - 1, 2):
+            if _lower(params[i]) == 'charset':
+                return _lower(params[i + 1]) or 'us-ascii'
+    return 'us-ascii'
+
+
+def _lower(value):
+    if isinstance(value, string_types):
+        return value.lower()
+    if isinstance(value, bytes):
+        return value.decode('latin-1').lower()
+    return ''
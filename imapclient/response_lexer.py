@@ -145,6 +145,11 @@ class LiteralHandlingIter:
             # just a line with no literals.
             self.src_text = resp_record
             self.literal = None
+        if not six.PY3 and isinstance(self.src_text, six.binary_type):
+            # Decode losslessly so that 8-bit characters (eg. UTF-8 in
+            # quoted strings once UTF8=ACCEPT is enabled) can be mixed
+            # with the unicode tokens.
+            self.src_text = self.src_text.decode('latin-1')
 
     def __iter__(self):
         return PushableIterator(self.src_text)
@@ -13,6 +13,7 @@ Initially inspired by http://effbot.org/zone/simple-iterator-parser.htm
 
 from __future__ import unicode_literals
 
+import re
 import sys
 from collections import defaultdict
 from datetime import datetime
@@ -20,10 +21,11 @@ from datetime import datetime
 from . import six
 xrange = six.moves.xrange
 
-from .datetime_util import parse_to_datetime
 from .fixed_offset import FixedOffset
 from .response_lexer import TokenSource
-from .response_types import Envelope, Address
+from .lru import LRUCache
+from .response_types import (FetchFailure, FetchRecord, FlagSet, LazyEnvelope,
+                             intern_flags)
 
 try:
     import imaplib2 as imaplib
@@ -31,7 +33,7 @@ except ImportError:
     imaplib2 = None
     import imaplib
 
-__all__ = ['parse_response', 'ParseError']
+__all__ = ['parse_response', 'parse_simple_fetch_response', 'ParseError']
 
 
 class ParseError(ValueError):
@@ -62,17 +64,52 @@ def gen_parsed_response(text):
         raise ParseError("%s: %s" % (str(err), token))
 
 
-def parse_fetch_response(text, normalise_times=True, uid_is_key=True):
+def parse_fetch_response(text, normalise_times=True, uid_is_key=True,
+                         result_type='dict', failures=None):
     """Pull apart IMAP FETCH responses as returned by imaplib.
 
     Returns a dictionary, keyed by message ID. Each value a dictionary
-    keyed by FETCH field type (eg."RFC822").
+    keyed by FETCH field type (eg."RFC822"), or a FetchRecord if
+    *result_type* is ``'compact'``.
+
+    Normally an exception is raised if any part of the response can't
+    be parsed. If a list is passed as *failures* then messages which
+    can't be parsed are left out of the result instead and a
+    FetchFailure is appended to *failures* for each of them.
     """
     if text == [None]:
         return {}
+    system_tz = FixedOffset.for_system() if normalise_times else None
+    parsed_response = _new_fetch_result(result_type)
+    try:
+        _parse_fetch_messages(text, normalise_times, uid_is_key, system_tz,
+                              parsed_response)
+    except _FETCH_ERRORS:
+        if failures is None:
+            raise
+        # Start again, parsing each message separately so that one bad
+        # message doesn't prevent the others from being returned.
+        parsed_response = _new_fetch_result(result_type)
+        for raw in _split_fetch_response(text):
+            msg_response = defaultdict(dict)
+            try:
+                _parse_fetch_messages(raw, normalise_times, uid_is_key, system_tz,
+                                      msg_response)
+            except _FETCH_ERRORS:
+                failures.append(FetchFailure(_raw_seq(raw), raw, sys.exc_info()[1]))
+            else:
+                for msg_id, msg_data in six.iteritems(msg_response):
+                    parsed_response[msg_id].update(msg_data)
+    return parsed_response
+
+
+# Exceptions raised by parse_fetch_response() for malformed responses
+_FETCH_ERRORS = (ValueError, IndexError, TypeError)
+
+
+def _parse_fetch_messages(text, normalise_times, uid_is_key, system_tz, parsed_response):
     response = gen_parsed_response(text)
 
-    parsed_response = defaultdict(dict)
     while True:
         try:
             msg_id = seq = _int_or_error(six.next(response),
@@ -104,19 +141,153 @@ def parse_fetch_response(text, normalise_times=True, uid_is_key=True):
                 else:
                     msg_data[word] = uid
             elif word == 'INTERNALDATE':
-                msg_data[word] = _convert_INTERNALDATE(value, normalise_times)
+                msg_data[word] = _convert_INTERNALDATE(value, normalise_times, system_tz)
             elif word == 'ENVELOPE':
                 msg_data[word] = _convert_ENVELOPE(value, normalise_times)
             elif word in ('BODY', 'BODYSTRUCTURE'):
                 msg_data[word] = BodyData.create(value)
+            elif word in ('FLAGS', 'X-GM-LABELS') and isinstance(value, tuple):
+                msg_data[word] = intern_flags(value)
             else:
                 msg_data[word] = value
 
         parsed_response[msg_id].update(msg_data)
 
+
+_fetch_start_re = re.compile(r'(\d+) \(')
+
+
+def _split_fetch_response(text):
+    """Split the items of a FETCH response as returned by imaplib in
+    to one list per message.
+    """
+    # Each message starts with "<seq> (". Text following a literal
+    # always starts with a space or ")" so can't be mistaken for the
+    # start of the next message.
+    raw = []
+    for item in text:
+        if item is None:
+            continue
+        if raw and _fetch_start_re.match(_item_text(item)):
+            yield raw
+            raw = []
+        raw.append(item)
+    if raw:
+        yield raw
+
+
+def _raw_seq(raw):
+    match = _fetch_start_re.match(_item_text(raw[0]))
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def _item_text(item):
+    if isinstance(item, tuple):
+        item = item[0]
+    if isinstance(item, six.binary_type) and not isinstance(item, str):
+        item = item.decode('latin-1')
+    return item
+
+
+# FETCH data items handled by parse_simple_fetch_response()
+SIMPLE_FETCH_ITEMS = frozenset(['UID', 'FLAGS', 'RFC822.SIZE', 'INTERNALDATE', 'MODSEQ'])
+
+# A flag atom which the general parser would return as a string (ie.
+# not NIL or an integer) and which the lexer wouldn't split up.
+_FLAG = r'\\?[^\s()"{}%\[\]\\*]*[^\s()"{}%\[\]\\*\d][^\s()"{}%\[\]\\*]*'
+_NO_FLAGS = FlagSet()
+_flag_sets_by_text = LRUCache(4096)
+_simple_line_re = re.compile(r'^(\d+) \((.*)\)$')
+_simple_item_re = re.compile(
+    r'(?:^| )(?:(UID|RFC822\.SIZE) (\d+)'
+    r'|FLAGS \(((?:%s)(?: %s)*)?\)'
+    r'|MODSEQ \((\d+)\)'
+    r'|INTERNALDATE "([^"\\]*)")' % (_FLAG, _FLAG))
+
+
+def parse_simple_fetch_response(text, normalise_times=True, uid_is_key=True,
+                                result_type='dict', failures=None):
+    """Fast version of parse_fetch_response() for responses which
+    only contain the data items in SIMPLE_FETCH_ITEMS.
+
+    Each line is matched with precompiled regular expressions instead
+    of being tokenised. The result is the same as
+    parse_fetch_response(). Input which can't be handled (eg. literals
+    or unexpected data items) is passed to parse_fetch_response(), as
+    is *failures*.
+    """
+    if text == [None]:
+        return {}
+    try:
+        parsed = _parse_simple_fetch_lines(text, normalise_times, uid_is_key,
+                                           _new_fetch_result(result_type))
+    except _FETCH_ERRORS:
+        if failures is None:
+            raise
+        parsed = None
+    if parsed is None:
+        return parse_fetch_response(text, normalise_times, uid_is_key, result_type,
+                                    failures)
+    return parsed
+
+
+def _parse_simple_fetch_lines(text, normalise_times, uid_is_key, parsed_response):
+    system_tz = FixedOffset.for_system() if normalise_times else None
+    line_match = _simple_line_re.match
+    item_match = _simple_item_re.match
+    for line in text:
+        if not isinstance(line, (str, six.text_type)):
+            return None
+        match = line_match(line)
+        if not match:
+            return None
+        msg_id = seq = int(match.group(1))
+        body = match.group(2)
+        msg_data = {'SEQ': seq}
+        pos = 0
+        end = len(body)
+        while pos < end:
+            item = item_match(body, pos)
+            if not item:
+                return None
+            pos = item.end()
+            word, number, flags, modseq, internaldate = item.groups()
+            if word == 'UID':
+                if uid_is_key:
+                    msg_id = int(number)
+                else:
+                    msg_data[word] = int(number)
+            elif word:
+                msg_data[word] = int(number)
+            elif modseq:
+                msg_data['MODSEQ'] = (int(modseq),)
+            elif internaldate is not None:
+                msg_data['INTERNALDATE'] = _convert_INTERNALDATE(internaldate, normalise_times,
+                                                                 system_tz)
+            elif flags:
+                flag_set = _flag_sets_by_text.get(flags)
+                if flag_set is None:
+                    flag_set = flags.split(' ')
+                    if 'NIL' in flag_set:
+                        return None
+                    flag_set = _flag_sets_by_text[flags] = intern_flags(flag_set)
+                msg_data['FLAGS'] = flag_set
+            else:
+                msg_data['FLAGS'] = _NO_FLAGS
+        parsed_response[msg_id].update(msg_data)
     return parsed_response
 
 
+def _new_fetch_result(result_type):
+    if result_type == 'dict':
+        return defaultdict(dict)
+    if result_type == 'compact':
+        return defaultdict(FetchRecord)
+    raise ValueError('unknown result_type %r' % (result_type,))
+
+
 def _int_or_error(value, error_text):
     try:
         return int(value)
@@ -132,21 +303,102 @@ class BodyData(tuple):
         # at the start. Nest these in to a list so that the returned
         # response tuple always has a consistent number of elements
         # regardless of whether the message is multipart or not.
-        if isinstance(response[0], tuple):
-            # Multipart, find where the message part tuples stop
-            for i, part in enumerate(response):
-                if isinstance(part, six.string_types):
-                    break
-            return cls(([cls.create(part) for part in response[:i]],) + response[i:])
-        else:
-            return cls(response)
+        #
+        # Parts are converted depth first using an explicit stack of
+        # [structure, index where its part tuples stop, converted parts]
+        # entries so that deeply nested messages (eg. chains of
+        # forwarded messages) can't hit the recursion limit.
+        stack = [[response, None, []]]
+        while True:
+            entry = stack[-1]
+            structure, end, parts = entry
+            if end is None:
+                end = 0
+                if isinstance(structure[0], tuple):
+                    # Multipart, find where the message part tuples stop
+                    for end, part in enumerate(structure):
+                        if isinstance(part, six.string_types):
+                            break
+                entry[1] = end
+            if len(parts) < end:
+                stack.append([structure[len(parts)], None, []])
+                continue
+
+            stack.pop()
+            if end:
+                body = cls((parts,) + structure[end:])
+            else:
+                body = cls(structure)
+            if not stack:
+                return body
+            stack[-1][2].append(body)
             
     @property
     def is_multipart(self):
         return isinstance(self[0], list)
     
 
-def _convert_INTERNALDATE(date_string, normalise_times=True):
+_MONTHS = dict((name, i + 1) for i, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')))
+
+# Parsed "DD-Mon-YYYY" and "+HHMM" parts of INTERNALDATE values. Most
+# messages in a mailbox share a handful of days and offsets.
+_internaldate_days = {}
+_internaldate_zones = {}
+_MAX_INTERNALDATE_DAYS = 4096
+
+
+def _convert_INTERNALDATE(date_string, normalise_times=True, system_tz=None):
+    """Convert an INTERNALDATE string to a datetime.
+
+    If *normalise_times* is True the result is a naive datetime in
+    *system_tz*, which defaults to FixedOffset.for_system(). Callers
+    converting many dates should work out *system_tz* once and pass it
+    in.
+    """
+    dt = _parse_INTERNALDATE(date_string)
+    if normalise_times:
+        # Normalise to host system's timezone
+        if system_tz is None:
+            system_tz = FixedOffset.for_system()
+        return dt.astimezone(system_tz).replace(tzinfo=None)
+    return dt
+
+
+def _parse_INTERNALDATE(date_string):
+    # INTERNALDATE has a fixed layout ("DD-Mon-YYYY HH:MM:SS +HHMM",
+    # with the day padded by a space) so pick it apart by position.
+    text = date_string
+    if len(text) == 25:
+        text = ' ' + text
+    if (len(text) != 26 or text[2] != '-' or text[6] != '-' or text[11] != ' '
+            or text[14] != ':' or text[17] != ':' or text[20] != ' '):
+        return _parse_INTERNALDATE_slow(date_string)
+    try:
+        day = _internaldate_days.get(text[:11])
+        if day is None:
+            day = (int(text[7:11]), _MONTHS[text[3:6]], int(text[:2]))
+            if len(_internaldate_days) >= _MAX_INTERNALDATE_DAYS:
+                _internaldate_days.clear()
+            _internaldate_days[text[:11]] = day
+        tz = _internaldate_zones.get(text[21:])
+        if tz is None:
+            sign = text[21]
+            zone = int(text[22:24]) * 60 + int(text[24:26])
+            if sign == '-':
+                zone = -zone
+            elif sign != '+':
+                raise ValueError
+            tz = _internaldate_zones[text[21:]] = FixedOffset.for_minutes(zone)
+        year, month, mday = day
+        return datetime(year, month, mday, int(text[12:14]), int(text[15:17]),
+                        int(text[18:20]), 0, tz)
+    except (KeyError, ValueError):
+        return _parse_INTERNALDATE_slow(date_string)
+
+
+def _parse_INTERNALDATE_slow(date_string):
     date_msg = 'INTERNALDATE "%s"' % date_string
     mo = imaplib.InternalDate.match(date_msg.encode('latin-1'))
     if not mo:
@@ -156,48 +408,31 @@ def _convert_INTERNALDATE(date_string, normalise_times=True):
     zonem = (zoneh * 60) + int(mo.group('zonem'))
     if mo.group('zonen') == b'-':
         zonem = -zonem
-    tz = FixedOffset(zonem)
+    tz = FixedOffset.for_minutes(zonem)
 
     year = int(mo.group('year'))
-    mon = imaplib.Mon2num[mo.group('mon')]
+    try:
+        mon = imaplib.Mon2num[mo.group('mon')]
+    except KeyError:
+        raise ValueError("couldn't parse date %r" % date_string)
     day = int(mo.group('day'))
     hour = int(mo.group('hour'))
     min = int(mo.group('min'))
     sec = int(mo.group('sec'))
 
-    dt = datetime(year, mon, day, hour, min, sec, 0, tz)
-
-    if normalise_times:
-        # Normalise to host system's timezone
-        return dt.astimezone(FixedOffset.for_system()).replace(tzinfo=None)
-    return dt
+    return datetime(year, mon, day, hour, min, sec, 0, tz)
 
 def _convert_ENVELOPE(envelope_response, normalise_times=True):
-    dt = parse_to_datetime(envelope_response[0], normalise=normalise_times)
-    subject = envelope_response[1]
-
-    # addresses contains a tuple of addresses
-    # from, sender, reply_to, to, cc, bcc headers
-    addresses = []
-    for addr_list in envelope_response[2:8]:
-        addrs = []
-        if addr_list:
-            for addr_tuple in addr_list:
-                 addrs.append(Address(*addr_tuple))
-            addresses.append(tuple(addrs))
-        else:
-            addresses.append(None)
-
-    return Envelope(
-        dt, subject, *addresses,
-        in_reply_to=envelope_response[8],
-        message_id=envelope_response[9]
-    )
+    # Fields are converted when they are first used
+    return LazyEnvelope(envelope_response, normalise_times)
 
 def atom(src, token):
     if token == '(':
         return parse_tuple(src)
-    elif token == 'NIL':
+    return _scalar(src, token)
+
+def _scalar(src, token):
+    if token == 'NIL':
         return None
     elif token[:1] == '{':
         literal_len = int(token[1:-1])
@@ -209,18 +444,44 @@ def atom(src, token):
                                 literal_len, len(literal_text)))
         return literal_text
     elif len(token) >= 2 and (token[:1] == token[-1:] == '"'):
-        return token[1:-1]
+        return _quoted(token[1:-1])
     elif token.isdigit():
         return int(token)
     else:
         return token
 
+if six.PY3:
+    def _quoted(text):
+        return text
+else:
+    _8bit_re = re.compile('[\x80-\xff]')
+
+    def _quoted(text):
+        # The lexer decodes 8-bit data as latin-1. Quoted strings
+        # containing it are returned as the original bytes, like
+        # literals, for the caller to decode (eg. as UTF-8).
+        if _8bit_re.search(text):
+            return text.encode('latin-1')
+        return text
+
 def parse_tuple(src):
+    # Nested tuples are built using an explicit stack of the enclosing
+    # tuples' items instead of recursion so that deeply nested
+    # responses can't hit the recursion limit.
+    stack = []
     out = []
     for token in src:
-        if token == ")":
-            return tuple(out)
-        out.append(atom(src, token))
+        if token == '(':
+            stack.append(out)
+            out = []
+        elif token == ')':
+            if not stack:
+                return tuple(out)
+            parent = stack.pop()
+            parent.append(tuple(out))
+            out = parent
+        else:
+            out.append(_scalar(src, token))
     # no terminator
     raise ParseError('Tuple incomplete before "(%s"' % _fmt_tuple(out))
 
@@ -2,9 +2,16 @@
 # Released subject to the New BSD License
 # Please see http://en.wikipedia.org/wiki/BSD_licenses
 
+import re
 from collections import namedtuple
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
 from email.utils import formataddr
 
+from .datetime_util import parse_to_datetime
+from .lru import LRUCache
+from .six import binary_type, text_type
+
 
 class Envelope(namedtuple("Envelope", "date subject from_ sender reply_to to " +
                           "cc bcc in_reply_to message_id")):
@@ -23,8 +30,15 @@ class Envelope(namedtuple("Envelope", "date subject from_ sender reply_to to " +
     :ivar bcc: As for from\_ but represents the "Bcc" recipients.
     :ivar in_reply_to: A string that contains the "In-Reply-To" header.
     :ivar message_id: A string that contains the "Message-Id" header.
+
+    ``decoded_subject`` gives the subject with any :rfc:`2047` encoded
+    words (eg. ``=?utf-8?q?caf=C3=A9?=``) decoded.
     """
 
+    @property
+    def decoded_subject(self):
+        return decode_encoded_words(self.subject)
+
 
 class Address(namedtuple("Address", "name route mailbox host")):
     """
@@ -45,7 +59,456 @@ class Address(namedtuple("Address", "name route mailbox host")):
         Address(name=u'Mary Smith', route=None, mailbox=u'mary', host=u'foo.com')
 
     See :rfc:`2822` for more.
+
+    ``decoded_name`` gives the name with any :rfc:`2047` encoded words
+    decoded.
     """
 
+    @property
+    def decoded_name(self):
+        return decode_encoded_words(self.name)
+
     def __str__(self):
         return formataddr((self.name, self.mailbox + '@' + self.host))
+
+
+class FetchFailure(namedtuple("FetchFailure", "seq raw error")):
+    """
+    Describes a message whose FETCH response couldn't be parsed. See
+    the *failures* argument of :py:meth:`IMAPClient.fetch
+    <imapclient.IMAPClient.fetch>`.
+
+    :ivar seq: The message sequence number, or None if it couldn't be
+      determined.
+    :ivar raw: The message's part of the response, in the form returned
+      by imaplib (a list of strings and ``(line, literal)`` tuples).
+    :ivar error: The exception raised while parsing the message.
+    """
+
+
+_UNSET = object()
+
+
+def _envelope_field(index):
+    return property(lambda self: self[index])
+
+
+class LazyEnvelope(object):
+    """
+    An :py:class:`Envelope` which is built from the parsed ENVELOPE
+    response on demand. Returned when parsing ENVELOPE responses.
+
+    Each field is converted (eg. the date parsed or the addresses
+    turned in to :py:class:`Address` objects) the first time it's
+    accessed and then kept, so only the fields actually used are
+    paid for.
+
+    LazyEnvelope supports the Envelope interface: the same
+    attributes, indexing, unpacking, ``len()``, ``_fields``,
+    ``_asdict()`` and ``_replace()``. It compares equal to an Envelope
+    with the same values. It isn't a tuple though; use
+    ``materialise()`` to get an Envelope.
+    """
+
+    __slots__ = ('_raw', '_normalise_times', '_values')
+
+    _fields = Envelope._fields
+
+    def __init__(self, raw, normalise_times=True):
+        self._raw = raw
+        self._normalise_times = normalise_times
+        self._values = None
+
+    date = _envelope_field(0)
+    subject = _envelope_field(1)
+    from_ = _envelope_field(2)
+    sender = _envelope_field(3)
+    reply_to = _envelope_field(4)
+    to = _envelope_field(5)
+    cc = _envelope_field(6)
+    bcc = _envelope_field(7)
+    in_reply_to = _envelope_field(8)
+    message_id = _envelope_field(9)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        if index < 0:
+            index += len(self._fields)
+        if not 0 <= index < len(self._fields):
+            raise IndexError('envelope index out of range')
+        values = self._values
+        if values is None:
+            values = self._values = [_UNSET] * len(self._fields)
+        value = values[index]
+        if value is _UNSET:
+            value = values[index] = self._convert(index)
+        return value
+
+    def _convert(self, index):
+        raw = self._raw[index]
+        if index == 0:
+            return parse_to_datetime(raw, normalise=self._normalise_times)
+        if 2 <= index <= 7:
+            # from, sender, reply_to, to, cc, bcc address lists
+            if not raw:
+                return None
+            return tuple(Address(*addr_tuple) for addr_tuple in raw)
+        return raw
+
+    decoded_subject = Envelope.decoded_subject
+
+    def materialise(self):
+        """Return an :py:class:`Envelope` holding all the fields."""
+        return Envelope(*self)
+
+    def _asdict(self):
+        return self.materialise()._asdict()
+
+    def _replace(self, **kwargs):
+        return self.materialise()._replace(**kwargs)
+
+    def __iter__(self):
+        for i in range(len(self._fields)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __eq__(self, other):
+        if isinstance(other, (tuple, LazyEnvelope)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return (Envelope, tuple(self))
+
+    def __repr__(self):
+        return repr(self.materialise())
+
+
+class FetchRecord(object):
+    """
+    A compact representation of the data returned for a single
+    message by a FETCH command. Returned by
+    :py:meth:`IMAPClient.fetch <imapclient.IMAPClient.fetch>` when
+    ``result_type='compact'`` is used.
+
+    Common data items are available as attributes, which raise
+    AttributeError if the item wasn't returned by the server:
+
+    :ivar seq: The message sequence number.
+    :ivar uid: The message UID.
+    :ivar flags: The message flags.
+    :ivar size: The message size ("RFC822.SIZE").
+    :ivar internaldate: The message's "INTERNALDATE".
+    :ivar modseq: The message modification sequence ("MODSEQ").
+
+    A FetchRecord can also be used like the dictionary returned for
+    each message by default, so ``record['RFC822.SIZE']`` and
+    ``'FLAGS' in record`` work as expected. Other data items (eg.
+    ``ENVELOPE``) are only available this way.
+    """
+
+    __slots__ = ('seq', 'uid', 'flags', 'size', 'internaldate', 'modseq', '_extra')
+
+    # Data item name -> attribute name
+    _attrs = {
+        'SEQ': 'seq',
+        'UID': 'uid',
+        'FLAGS': 'flags',
+        'RFC822.SIZE': 'size',
+        'INTERNALDATE': 'internaldate',
+        'MODSEQ': 'modseq',
+    }
+
+    def __init__(self, data=None):
+        self._extra = None
+        if data:
+            self.update(data)
+
+    def __getitem__(self, key):
+        attr = self._attrs.get(key)
+        if attr:
+            try:
+                return getattr(self, attr)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        attr = self._attrs.get(key)
+        if attr:
+            setattr(self, attr, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, data):
+        for key, value in data.items():
+            self[key] = value
+
+    def keys(self):
+        return [key for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def __iter__(self):
+        for key, attr in self._attrs.items():
+            if hasattr(self, attr):
+                yield key
+        if self._extra:
+            for key in self._extra:
+                yield key
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (FetchRecord, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'FetchRecord(%r)' % dict(self.items())
+
+
+# Line breaks which are followed by whitespace and so fold a header
+_header_fold_re = re.compile(r'\r?\n(?=[ \t])')
+_header_line_re = re.compile(r'\r?\n')
+
+
+class HeaderMap(object):
+    """
+    A read-only, case-insensitive mapping of message header names to
+    values. Returned by :py:meth:`IMAPClient.fetch_headers
+    <imapclient.IMAPClient.fetch_headers>`.
+
+    The raw header text (available as ``raw``) is only split in to
+    fields, with folded lines unfolded, when the mapping is first
+    used. No :py:class:`email.message.Message` is created.
+
+    Looking up a header returns its first value. Use ``get_all()`` to
+    get every value of a header that appears more than once. Iterating
+    gives each header name once, as it was first seen.
+    """
+
+    __slots__ = ('raw', '_names', '_values')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._names = None
+        self._values = None
+
+    def _parse(self):
+        text = self.raw
+        if isinstance(text, binary_type):
+            # Headers should be ASCII but raw UTF-8 is common
+            try:
+                text = text.decode('utf-8')
+            except UnicodeDecodeError:
+                text = text.decode('latin-1')
+        names = []
+        values = {}
+        # Only CRLF and LF end lines; str.splitlines() would also
+        # split on characters such as U+0085.
+        for line in _header_line_re.split(_header_fold_re.sub('', text)):
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+            name = name.strip()
+            key = name.lower()
+            if key in values:
+                values[key].append(value.strip())
+            else:
+                names.append(name)
+                values[key] = [value.strip()]
+        self._names = names
+        self._values = values
+        return values
+
+    def get_all(self, name, default=None):
+        """Return a list of all the values for the header *name*."""
+        values = self._values
+        if values is None:
+            values = self._parse()
+        return values.get(name.lower(), default)
+
+    def __getitem__(self, name):
+        values = self.get_all(name)
+        if values is None:
+            raise KeyError(name)
+        return values[0]
+
+    def get(self, name, default=None):
+        values = self.get_all(name)
+        if values is None:
+            return default
+        return values[0]
+
+    def __contains__(self, name):
+        return self.get_all(name) is not None
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def __iter__(self):
+        if self._names is None:
+            self._parse()
+        return iter(self._names)
+
+    def __len__(self):
+        if self._names is None:
+            self._parse()
+        return len(self._names)
+
+    def __repr__(self):
+        return 'HeaderMap(%r)' % (self.raw,)
+
+
+class FlagSet(tuple):
+    """
+    An immutable, hashable collection of message flags (or Gmail
+    labels), as returned for FLAGS and X-GM-LABELS data items and the
+    FLAGS and PERMANENTFLAGS responses to SELECT.
+
+    FlagSets are tuples so they compare equal to tuples holding the
+    same flags in the same order. They also support the ``&``, ``|``,
+    ``-`` and ``^`` set operators, plus ``issubset()`` and
+    ``issuperset()``, which ignore order. Identical flag sets are
+    shared (see :py:func:`intern_flags`) so holding flags for large
+    numbers of messages is cheap.
+    """
+
+    __slots__ = ()
+
+    def __and__(self, other):
+        other = frozenset(other)
+        return intern_flags(flag for flag in self if flag in other)
+
+    def __or__(self, other):
+        # Either side may hold a flag more than once (eg. if a server
+        # repeats one), the result holds each flag once
+        seen = set()
+        union = []
+        for flags in (self, other):
+            for flag in flags:
+                if flag not in seen:
+                    seen.add(flag)
+                    union.append(flag)
+        return intern_flags(union)
+
+    def __sub__(self, other):
+        other = frozenset(other)
+        return intern_flags(flag for flag in self if flag not in other)
+
+    def __xor__(self, other):
+        return (self - other) | (FlagSet(other) - self)
+
+    def issubset(self, other):
+        return frozenset(self).issubset(other)
+
+    def issuperset(self, other):
+        return frozenset(self).issuperset(other)
+
+    def __repr__(self):
+        return 'FlagSet(%s)' % tuple.__repr__(self)
+
+
+# Bounded pools of flag strings and flag sets seen in responses
+_flag_atoms = LRUCache(4096)
+_flag_sets = LRUCache(4096)
+
+
+def intern_flags(flags):
+    """Return the shared FlagSet holding *flags* (an iterable of
+    strings), creating it if necessary. The flag strings themselves
+    are also shared.
+    """
+    key = tuple(flags)
+    flag_set = _flag_sets.get(key)
+    if flag_set is None:
+        atoms = []
+        for flag in key:
+            atom = _flag_atoms.get(flag)
+            if atom is None:
+                _flag_atoms[flag] = atom = flag
+            atoms.append(atom)
+        flag_set = FlagSet(atoms)
+        _flag_sets[key] = flag_set
+    return flag_set
+
+
+# Raw header value -> decoded text
+_decoded_words = LRUCache(4096)
+
+
+def decode_encoded_words(value):
+    """Return *value* (a header value from an ENVELOPE response) as
+    text with any :rfc:`2047` encoded words decoded. None is returned
+    unchanged.
+
+    Results are cached as mailing list traffic tends to repeat the
+    same subjects and names many times.
+    """
+    if value is None:
+        return None
+    decoded = _decoded_words.get(value)
+    if decoded is None:
+        decoded = _decoded_words[value] = _decode_encoded_words(value)
+    return decoded
+
+
+def _decode_encoded_words(value):
+    if isinstance(value, binary_type):
+        value = value.decode('latin-1')
+    if '=?' not in value:
+        return text_type(value)
+    try:
+        return text_type(make_header(decode_header(value)))
+    except (HeaderParseError, LookupError, UnicodeError):
+        # Malformed encoded words or an unknown charset
+        return text_type(value)
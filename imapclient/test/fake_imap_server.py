@@ -0,0 +1,899 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+"""
+An in-process IMAP4rev1 stand-in server with in-memory mailboxes.
+
+This allows IMAPClient's socket, literal and parsing code to be
+exercised (and benchmarked) without a real IMAP account. Latency and
+bandwidth can be configured to simulate remote servers.
+
+Only the parts of the protocol used by IMAPClient are implemented and
+little effort is made to handle invalid commands gracefully. Example::
+
+    with FakeIMAPServer() as server:
+        server.add_message('INBOX', b'Subject: hi\\r\\n\\r\\nthere\\r\\n')
+        client = server.connect()
+        client.select_folder('INBOX')
+"""
+
+from __future__ import unicode_literals
+
+import re
+import select
+import threading
+import time
+from datetime import datetime
+from email.parser import HeaderParser
+from email.utils import getaddresses
+
+from imapclient.fixed_offset import FixedOffset
+from imapclient.response_parser import parse_response
+from imapclient.six import binary_type, text_type, integer_types, moves
+
+socketserver = moves.socketserver
+
+__all__ = ['FakeIMAPServer', 'Mailbox', 'Message']
+
+CRLF = b'\r\n'
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+SYSTEM_FLAGS = ('\\Answered', '\\Flagged', '\\Deleted', '\\Seen', '\\Draft')
+
+_literal_re = re.compile(br'\{(\d+)(\+?)\}$')
+_partial_re = re.compile(r'^(BODY(?:\.PEEK)?\[([^\]]*)\])(?:<(\d+)\.(\d+)>)?$')
+_safe_quoted_re = re.compile(r'^[\x20-\x7e]*$')
+
+
+class Atom(text_type):
+    """A string which is sent to the client as is, without quoting."""
+
+
+class Message(object):
+
+    def __init__(self, uid, body, flags=(), internaldate=None):
+        self.uid = uid
+        # Bodies are always stored with CRLF line endings
+        self.body = body.replace(b'\r\n', b'\n').replace(b'\n', CRLF)
+        self.flags = list(flags)
+        if internaldate is None:
+            internaldate = datetime.now(FixedOffset.for_system())
+        elif not internaldate.tzinfo:
+            internaldate = internaldate.replace(tzinfo=FixedOffset.for_system())
+        self.internaldate = internaldate
+        self._mime = None
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    @property
+    def mime(self):
+        if self._mime is None:
+            self._mime = MimePart(self.body)
+        return self._mime
+
+
+class Mailbox(object):
+
+    def __init__(self, name, uidvalidity):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages = []
+        self.subscribed = True
+
+    def add(self, body, flags=(), internaldate=None):
+        msg = Message(self.uidnext, body, flags, internaldate)
+        self.uidnext += 1
+        self.messages.append(msg)
+        return msg
+
+
+class MimePart(object):
+    """Splits a message (or message part) into its MIME parts,
+    keeping the raw bytes of each.
+    """
+
+    def __init__(self, raw):
+        idx = raw.find(b'\r\n\r\n')
+        if idx < 0:
+            self.header, self.text = raw, b''
+        else:
+            self.header, self.text = raw[:idx + 4], raw[idx + 4:]
+        self.headers = HeaderParser().parsestr(self.header.decode('latin-1'))
+        self.maintype = self.headers.get_content_maintype()
+        self.subtype = self.headers.get_content_subtype()
+        self.parts = []
+        if self.maintype == 'multipart':
+            boundary = self.headers.get_param('boundary')
+            if boundary:
+                self.parts = self._split(self.text, boundary.encode('latin-1'))
+
+    @staticmethod
+    def _split(text, boundary):
+        parts = []
+        chunks = (CRLF + text).split(CRLF + b'--' + boundary)
+        for chunk in chunks[1:]:
+            if chunk.startswith(b'--'):
+                break
+            idx = chunk.find(CRLF)
+            parts.append(MimePart(chunk[idx + 2:] if idx >= 0 else b''))
+        return parts
+
+    def part(self, numbers):
+        part = self
+        for number in numbers:
+            if part.parts:
+                part = part.parts[number - 1]
+            elif number != 1:
+                raise IndexError('no such part')
+        return part
+
+    def structure(self, extensible=True):
+        if self.parts:
+            out = [part.structure(extensible) for part in self.parts]
+            out.append(self.subtype.upper())
+            if extensible:
+                out.append(self._params())
+            return tuple(out)
+        out = [self.maintype.upper(), self.subtype.upper(), self._params(),
+               self.headers.get('Content-ID'),
+               self.headers.get('Content-Description'),
+               (self.headers.get('Content-Transfer-Encoding') or '7BIT').upper(),
+               len(self.text)]
+        if self.maintype == 'text':
+            out.append(self.text.count(CRLF))
+        return tuple(out)
+
+    def _params(self):
+        params = []
+        for key, value in (self.headers.get_params() or [])[1:]:
+            params.extend([key.upper(), value])
+        return tuple(params) or None
+
+
+class CommandError(Exception):
+
+    def __init__(self, status, text):
+        Exception.__init__(self, text)
+        self.status = status
+        self.text = text
+
+
+class FakeIMAPServer(object):
+    """
+    A fake IMAP server running in a background thread.
+
+    *users* is an optional dictionary of usernames to passwords. If
+    not given, any credentials are accepted.
+
+    *latency* is the number of seconds to wait before processing
+    each command. *command_latency* can be used to override this for
+    specific commands (eg. ``{'FETCH': 0.2}``). *bandwidth* limits the
+    rate (in bytes per second) at which responses are sent.
+    """
+
+    capabilities = ('IMAP4rev1', 'IDLE', 'UIDPLUS', 'LITERAL+', 'UNSELECT',
+                    'NAMESPACE', 'AUTH=PLAIN')
+
+    def __init__(self, users=None, latency=0, command_latency=None,
+                 bandwidth=None, host='127.0.0.1', port=0):
+        self.users = users
+        self.latency = latency
+        self.command_latency = dict(command_latency or {})
+        self.bandwidth = bandwidth
+        self.lock = threading.RLock()
+        self.mailboxes = {}
+        self._uidvalidity = int(time.time())
+        self.create_folder('INBOX')
+        self._address = (host, port)
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        server = socketserver.ThreadingTCPServer(self._address, IMAPSession, bind_and_activate=False)
+        server.allow_reuse_address = True
+        server.daemon_threads = True
+        server.server_bind()
+        server.server_activate()
+        server.fake = self
+        self._server = server
+        self._thread = threading.Thread(target=server.serve_forever,
+                                        kwargs=dict(poll_interval=0.05))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    @property
+    def address(self):
+        """The ``(host, port)`` the server is listening on."""
+        return self._server.server_address
+
+    def connect(self, username='user', password='pass', **kwargs):
+        """Return an IMAPClient instance logged in to the server."""
+        from imapclient import IMAPClient
+        host, port = self.address
+        client = IMAPClient(host, port=port, **kwargs)
+        client.login(username, password)
+        return client
+
+    def create_folder(self, name):
+        with self.lock:
+            if self.get_mailbox(name) is None:
+                self._uidvalidity += 1
+                self.mailboxes[name] = Mailbox(name, self._uidvalidity)
+            return self.get_mailbox(name)
+
+    def get_mailbox(self, name):
+        if name.upper() == 'INBOX':
+            name = 'INBOX'
+        return self.mailboxes.get(name)
+
+    def add_message(self, folder, body, flags=(), internaldate=None):
+        """Add a message to *folder* (which is created if necessary),
+        returning the Message instance.
+        """
+        with self.lock:
+            return self.create_folder(folder).add(body, flags, internaldate)
+
+
+class IMAPSession(socketserver.StreamRequestHandler):
+    """Handles a single client connection."""
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.fake = self.server.fake
+        self.authenticated = False
+        self.mailbox = None
+        self.readonly = False
+        self.utf8 = False
+        self._out = []
+
+    def handle(self):
+        self.untagged('OK [CAPABILITY %s] Fake IMAP server ready' % ' '.join(self.fake.capabilities))
+        self.flush()
+        while True:
+            records = self.read_command()
+            if records is None:
+                break
+            if not self.run_command(records):
+                break
+            self.flush()
+        self.flush()
+
+    # -- I/O --
+
+    def send(self, data):
+        self._out.append(data)
+        if len(self._out) > 256:
+            self.flush()
+
+    def flush(self):
+        if not self._out:
+            return
+        data = b''.join(self._out)
+        del self._out[:]
+        if self.fake.bandwidth:
+            time.sleep(len(data) / float(self.fake.bandwidth))
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def untagged(self, text):
+        self.send(b'* ' + _to_bytes(text) + CRLF)
+
+    def read_command(self):
+        """Read a command, returning records in the same form as
+        imaplib returns responses (strings and (text, literal) tuples).
+        """
+        records = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            line = line.rstrip(CRLF)
+            encoding = 'utf-8' if self.utf8 else 'latin-1'
+            match = _literal_re.search(line)
+            if not match:
+                records.append(line.decode(encoding))
+                return records
+            size = int(match.group(1))
+            if not match.group(2):
+                self.send(b'+ Ready for literal data' + CRLF)
+                self.flush()
+            literal = self.rfile.read(size)
+            text = line[:match.start()].decode(encoding) + '{%d}' % size
+            records.append((text, literal))
+
+    def run_command(self, records):
+        first = records[0]
+        text = first[0] if isinstance(first, tuple) else first
+        tag, _, rest = text.partition(' ')
+        if isinstance(first, tuple):
+            records[0] = (rest, first[1])
+        else:
+            records[0] = rest
+        try:
+            args = list(parse_response(records))
+        except ValueError as err:
+            self.send(_to_bytes('%s BAD %s' % (tag, err)) + CRLF)
+            return True
+        if not args or not isinstance(args[0], text_type):
+            self.send(_to_bytes('%s BAD Missing command' % tag) + CRLF)
+            return True
+
+        name = args.pop(0).upper()
+        uid = False
+        if name == 'UID' and args:
+            uid = True
+            name = text_type(args.pop(0)).upper()
+
+        delay = self.fake.command_latency.get(name, self.fake.latency)
+        if delay:
+            time.sleep(delay)
+
+        handler = getattr(self, 'do_' + name.replace('-', '_'), None)
+        if handler is None:
+            status, text = 'BAD', 'Unknown command %s' % name
+        elif not self.authenticated and name not in ('CAPABILITY', 'NOOP', 'LOGOUT',
+                                                     'LOGIN', 'AUTHENTICATE'):
+            status, text = 'BAD', 'Not authenticated'
+        else:
+            if name == 'IDLE':
+                # IDLE doesn't hold the lock while waiting
+                return self.do_IDLE(tag)
+            try:
+                with self.fake.lock:
+                    if uid:
+                        text = handler(args, uid=True)
+                    else:
+                        text = handler(args)
+                status = 'OK'
+            except CommandError as err:
+                status, text = err.status, err.text
+            except (IndexError, KeyError, TypeError, ValueError, AttributeError) as err:
+                status, text = 'BAD', 'Invalid arguments: %s' % err
+            text = text or '%s completed' % name
+        self.send(_to_bytes('%s %s %s' % (tag, status, text)) + CRLF)
+        return name != 'LOGOUT'
+
+    # -- helpers --
+
+    def require_selected(self):
+        if self.mailbox is None:
+            raise CommandError('BAD', 'No mailbox selected')
+        return self.mailbox
+
+    def get_mailbox(self, name):
+        mailbox = self.fake.get_mailbox(_to_text(name))
+        if mailbox is None:
+            raise CommandError('NO', '[TRYCREATE] No such mailbox')
+        return mailbox
+
+    def messages_for(self, msg_set, uid):
+        """Return (seq, Message) pairs for a message set."""
+        messages = self.require_selected().messages
+        if not messages:
+            return []
+        if uid:
+            wanted = _parse_seq_set(msg_set, messages[-1].uid)
+            return [(i + 1, msg) for i, msg in enumerate(messages) if msg.uid in wanted]
+        wanted = _parse_seq_set(msg_set, len(messages))
+        return [(i + 1, msg) for i, msg in enumerate(messages) if i + 1 in wanted]
+
+    # -- commands in any state --
+
+    def do_CAPABILITY(self, args):
+        self.untagged('CAPABILITY ' + ' '.join(self.fake.capabilities))
+
+    def do_NOOP(self, args):
+        pass
+
+    def do_LOGOUT(self, args):
+        self.untagged('BYE Fake IMAP server logging out')
+
+    def do_LOGIN(self, args):
+        username, password = _to_text(args[0]), _to_text(args[1])
+        users = self.fake.users
+        if users is not None and users.get(username) != password:
+            raise CommandError('NO', '[AUTHENTICATIONFAILED] Invalid credentials')
+        self.authenticated = True
+        return '[CAPABILITY %s] Logged in' % ' '.join(self.fake.capabilities)
+
+    def do_AUTHENTICATE(self, args):
+        # Any mechanism and credentials are accepted
+        if len(args) < 2:
+            self.send(b'+ ' + CRLF)
+            self.flush()
+            self.rfile.readline()
+        self.authenticated = True
+
+    # -- commands in the authenticated state --
+
+    def do_ENABLE(self, args):
+        enabled = [cap for cap in (text_type(arg).upper() for arg in args)
+                   if cap in self.fake.capabilities]
+        if 'UTF8=ACCEPT' in enabled:
+            # Mailbox names are sent and received as UTF-8 from now on
+            self.utf8 = True
+        self.untagged(' '.join(['ENABLED'] + enabled))
+
+    def do_SELECT(self, args, readonly=False):
+        self.mailbox = None
+        mailbox = self.get_mailbox(args[0])
+        self.mailbox = mailbox
+        self.readonly = readonly
+        self.untagged('FLAGS (%s)' % ' '.join(SYSTEM_FLAGS))
+        self.untagged('OK [PERMANENTFLAGS (%s \\*)] Flags permitted' % ' '.join(SYSTEM_FLAGS))
+        self.untagged('%d EXISTS' % len(mailbox.messages))
+        self.untagged('0 RECENT')
+        self.untagged('OK [UIDVALIDITY %d] UIDs valid' % mailbox.uidvalidity)
+        self.untagged('OK [UIDNEXT %d] Predicted next UID' % mailbox.uidnext)
+        if readonly:
+            return '[READ-ONLY] EXAMINE completed'
+        return '[READ-WRITE] SELECT completed'
+
+    def do_EXAMINE(self, args):
+        return self.do_SELECT(args, readonly=True)
+
+    def do_CREATE(self, args):
+        name = _to_text(args[0])
+        if self.fake.get_mailbox(name) is not None:
+            raise CommandError('NO', '[ALREADYEXISTS] Mailbox exists')
+        self.fake.create_folder(name)
+
+    def do_DELETE(self, args):
+        mailbox = self.get_mailbox(args[0])
+        if mailbox.name == 'INBOX':
+            raise CommandError('NO', "Can't delete INBOX")
+        del self.fake.mailboxes[mailbox.name]
+
+    def do_RENAME(self, args):
+        mailbox = self.get_mailbox(args[0])
+        new_name = _to_text(args[1])
+        if self.fake.get_mailbox(new_name) is not None:
+            raise CommandError('NO', '[ALREADYEXISTS] Mailbox exists')
+        del self.fake.mailboxes[mailbox.name]
+        mailbox.name = new_name
+        self.fake.mailboxes[new_name] = mailbox
+
+    def do_SUBSCRIBE(self, args, subscribe=True):
+        self.get_mailbox(args[0]).subscribed = subscribe
+
+    def do_UNSUBSCRIBE(self, args):
+        self.do_SUBSCRIBE(args, subscribe=False)
+
+    def do_LIST(self, args, command='LIST'):
+        # The list wildcards split patterns in to several tokens
+        reference, pattern = _to_text(args[0]), ''.join(_to_text(arg) for arg in args[1:])
+        if not pattern:
+            self.untagged('%s (\\Noselect) "/" ""' % command)
+            return
+        regex = re.compile('^%s$' % ''.join(
+            {'*': '.*', '%': '[^/]*'}.get(char, re.escape(char))
+            for char in reference + pattern))
+        names = sorted(self.fake.mailboxes)
+        for name in names:
+            mailbox = self.fake.mailboxes[name]
+            if command == 'LSUB' and not mailbox.subscribed:
+                continue
+            if regex.match(name):
+                has_children = any(other.startswith(name + '/') for other in names)
+                flags = '\\HasChildren' if has_children else '\\HasNoChildren'
+                self.untagged('%s (%s) "/" %s' % (command, flags, _quote(name)))
+
+    def do_LSUB(self, args):
+        self.do_LIST(args, 'LSUB')
+
+    def do_NAMESPACE(self, args):
+        self.untagged('NAMESPACE (("" "/")) NIL NIL')
+
+    def do_STATUS(self, args):
+        mailbox = self.get_mailbox(args[0])
+        items = args[1] if isinstance(args[1], tuple) else (args[1],)
+        values = {
+            'MESSAGES': len(mailbox.messages),
+            'RECENT': 0,
+            'UIDNEXT': mailbox.uidnext,
+            'UIDVALIDITY': mailbox.uidvalidity,
+            'UNSEEN': sum(1 for msg in mailbox.messages if '\\Seen' not in msg.flags),
+        }
+        out = []
+        for item in items:
+            item = item.upper()
+            out.extend([item, text_type(values[item])])
+        self.untagged('STATUS %s (%s)' % (_quote(mailbox.name), ' '.join(out)))
+
+    def do_APPEND(self, args):
+        mailbox = self.get_mailbox(args[0])
+        body = args[-1]
+        if isinstance(body, text_type):
+            body = body.encode('latin-1')
+        flags = ()
+        internaldate = None
+        for arg in args[1:-1]:
+            if isinstance(arg, tuple):
+                flags = [_to_text(flag) for flag in arg]
+            elif arg:
+                internaldate = _parse_internaldate(_to_text(arg))
+        msg = mailbox.add(body, flags, internaldate)
+        if mailbox is self.mailbox:
+            self.untagged('%d EXISTS' % len(mailbox.messages))
+        return '[APPENDUID %d %d] APPEND completed' % (mailbox.uidvalidity, msg.uid)
+
+    def do_IDLE(self, tag):
+        mailbox = self.mailbox
+        exists = len(mailbox.messages) if mailbox else 0
+        self.send(b'+ idling' + CRLF)
+        self.flush()
+        sock = self.connection
+        while True:
+            readable, _, _ = select.select([sock], [], [], 0.05)
+            if readable:
+                line = self.rfile.readline()
+                if not line:
+                    return False
+                if line.strip().upper() == b'DONE':
+                    break
+                self.send(_to_bytes('%s BAD Expected DONE' % tag) + CRLF)
+                return True
+            if mailbox:
+                with self.fake.lock:
+                    current = len(mailbox.messages)
+                if current != exists:
+                    exists = current
+                    self.untagged('%d EXISTS' % exists)
+                    self.flush()
+        self.send(_to_bytes('%s OK IDLE terminated' % tag) + CRLF)
+        return True
+
+    # -- commands in the selected state --
+
+    def do_CLOSE(self, args):
+        self.require_selected()
+        if not self.readonly:
+            self._expunge(silent=True)
+        self.mailbox = None
+
+    def do_UNSELECT(self, args):
+        self.require_selected()
+        self.mailbox = None
+
+    def do_EXPUNGE(self, args):
+        self.require_selected()
+        if self.readonly:
+            raise CommandError('NO', 'Mailbox is read-only')
+        self._expunge()
+
+    def _expunge(self, silent=False):
+        messages = self.mailbox.messages
+        seq = 1
+        for msg in list(messages):
+            if '\\Deleted' in msg.flags:
+                messages.remove(msg)
+                if not silent:
+                    self.untagged('%d EXPUNGE' % seq)
+            else:
+                seq += 1
+
+    def do_SEARCH(self, args, uid=False):
+        if args and text_type(args[0]).upper() == 'CHARSET':
+            args = args[2:]
+        messages = self.require_selected().messages
+        matcher = _SearchMatcher(args, messages)
+        if uid:
+            ids = [msg.uid for i, msg in enumerate(messages) if matcher.match(i + 1, msg)]
+        else:
+            ids = [i + 1 for i, msg in enumerate(messages) if matcher.match(i + 1, msg)]
+        self.untagged(' '.join(['SEARCH'] + [text_type(i) for i in ids]))
+
+    def do_COPY(self, args, uid=False):
+        source = self.require_selected()
+        dest = self.get_mailbox(args[1])
+        src_uids, dest_uids = [], []
+        for _, msg in self.messages_for(args[0], uid):
+            new = dest.add(msg.body, msg.flags, msg.internaldate)
+            src_uids.append(text_type(msg.uid))
+            dest_uids.append(text_type(new.uid))
+        if not src_uids:
+            return
+        return '[COPYUID %d %s %s] COPY completed' % (
+            dest.uidvalidity, ','.join(src_uids), ','.join(dest_uids))
+
+    def do_STORE(self, args, uid=False):
+        self.require_selected()
+        if self.readonly:
+            raise CommandError('NO', 'Mailbox is read-only')
+        action = text_type(args[1]).upper()
+        silent = action.endswith('.SILENT')
+        action = action.replace('.SILENT', '')
+        flags = args[2] if isinstance(args[2], tuple) else (args[2],)
+        flags = [_to_text(flag) for flag in flags]
+        for seq, msg in self.messages_for(args[0], uid):
+            if action == 'FLAGS':
+                msg.flags = list(flags)
+            elif action == '+FLAGS':
+                msg.flags.extend(flag for flag in flags if flag not in msg.flags)
+            elif action == '-FLAGS':
+                msg.flags = [flag for flag in msg.flags if flag not in flags]
+            else:
+                raise CommandError('BAD', 'Unsupported STORE action %s' % action)
+            if not silent:
+                items = []
+                if uid:
+                    items.extend([Atom('UID'), msg.uid])
+                items.extend([Atom('FLAGS'), tuple(Atom(flag) for flag in msg.flags)])
+                self.send(b'* ' + _to_bytes('%d FETCH ' % seq) + format_value(tuple(items)) + CRLF)
+
+    def do_FETCH(self, args, uid=False):
+        self.require_selected()
+        items = args[1]
+        if not isinstance(items, tuple):
+            items = _FETCH_MACROS.get(text_type(items).upper(), (items,))
+        items = [text_type(item) for item in items]
+        if uid and 'UID' not in (item.upper() for item in items):
+            items.insert(0, 'UID')
+        for seq, msg in self.messages_for(args[0], uid):
+            out = []
+            for item in items:
+                out.extend(self._fetch_item(msg, item))
+            self.send(b'* ' + _to_bytes('%d FETCH ' % seq) + format_value(tuple(out)) + CRLF)
+
+    def _fetch_item(self, msg, item):
+        name = item.upper()
+        if name == 'UID':
+            return [Atom(name), msg.uid]
+        if name == 'FLAGS':
+            return [Atom(name), tuple(Atom(flag) for flag in msg.flags)]
+        if name == 'INTERNALDATE':
+            return [Atom(name), _format_internaldate(msg.internaldate)]
+        if name == 'RFC822.SIZE':
+            return [Atom(name), msg.size]
+        if name == 'ENVELOPE':
+            return [Atom(name), _envelope(msg.mime.headers)]
+        if name in ('BODY', 'BODYSTRUCTURE'):
+            return [Atom(name), msg.mime.structure(extensible=name == 'BODYSTRUCTURE')]
+        if name in ('RFC822', 'RFC822.HEADER', 'RFC822.TEXT'):
+            data = {'RFC822': msg.body,
+                    'RFC822.HEADER': msg.mime.header,
+                    'RFC822.TEXT': msg.mime.text}[name]
+            if name != 'RFC822.HEADER':
+                self._mark_seen(msg)
+            return [Atom(name), data]
+
+        match = _partial_re.match(item)
+        if not match:
+            raise CommandError('BAD', 'Unsupported FETCH item %s' % item)
+        whole, section, start, length = match.groups()
+        data = _section(msg, section)
+        key = whole.replace('.PEEK', '').replace('.peek', '')
+        if start is not None:
+            start, length = int(start), int(length)
+            data = data[start:start + length]
+            key += '<%d>' % start
+        if '.PEEK' not in whole.upper():
+            self._mark_seen(msg)
+        return [Atom(key), data]
+
+    def _mark_seen(self, msg):
+        if not self.readonly and '\\Seen' not in msg.flags:
+            msg.flags.append('\\Seen')
+
+
+_FETCH_MACROS = {
+    'ALL': ('FLAGS', 'INTERNALDATE', 'RFC822.SIZE', 'ENVELOPE'),
+    'FAST': ('FLAGS', 'INTERNALDATE', 'RFC822.SIZE'),
+    'FULL': ('FLAGS', 'INTERNALDATE', 'RFC822.SIZE', 'ENVELOPE', 'BODY'),
+}
+
+
+class _SearchMatcher(object):
+    """Evaluates (a useful subset of) SEARCH criteria."""
+
+    flag_keys = {
+        'ANSWERED': ('\\Answered', True), 'UNANSWERED': ('\\Answered', False),
+        'DELETED': ('\\Deleted', True), 'UNDELETED': ('\\Deleted', False),
+        'DRAFT': ('\\Draft', True), 'UNDRAFT': ('\\Draft', False),
+        'FLAGGED': ('\\Flagged', True), 'UNFLAGGED': ('\\Flagged', False),
+        'SEEN': ('\\Seen', True), 'UNSEEN': ('\\Seen', False),
+    }
+
+    def __init__(self, criteria, messages):
+        self.criteria = list(criteria)
+        self.max_seq = len(messages)
+        self.max_uid = messages[-1].uid if messages else 0
+
+    def match(self, seq, msg):
+        tokens = list(self.criteria)
+        while tokens:
+            if not self._match_one(tokens, seq, msg):
+                return False
+        return True
+
+    def _match_one(self, tokens, seq, msg):
+        token = tokens.pop(0)
+        if isinstance(token, tuple):
+            sub = list(token)
+            while sub:
+                if not self._match_one(sub, seq, msg):
+                    return False
+            return True
+        if isinstance(token, integer_types):
+            return seq in _parse_seq_set(token, self.max_seq)
+        key = token.upper()
+        if key == 'ALL':
+            return True
+        if key == 'NOT':
+            return not self._match_one(tokens, seq, msg)
+        if key == 'OR':
+            first = self._match_one(tokens, seq, msg)
+            second = self._match_one(tokens, seq, msg)
+            return first or second
+        if key in self.flag_keys:
+            flag, wanted = self.flag_keys[key]
+            return (flag in msg.flags) == wanted
+        if key in ('KEYWORD', 'UNKEYWORD'):
+            flag = _to_text(tokens.pop(0))
+            return (flag in msg.flags) == (key == 'KEYWORD')
+        if key == 'UID':
+            return msg.uid in _parse_seq_set(tokens.pop(0), self.max_uid)
+        if key == 'LARGER':
+            return msg.size > int(tokens.pop(0))
+        if key == 'SMALLER':
+            return msg.size < int(tokens.pop(0))
+        if key in ('SUBJECT', 'FROM', 'TO', 'CC', 'BCC'):
+            value = msg.mime.headers.get(key, '') or ''
+            return _to_text(tokens.pop(0)).lower() in value.lower()
+        if key in ('BODY', 'TEXT'):
+            needle = _to_bytes(tokens.pop(0)).lower()
+            haystack = msg.mime.text if key == 'BODY' else msg.body
+            return needle in haystack.lower()
+        if key in ('SINCE', 'BEFORE', 'ON'):
+            day = _parse_date(_to_text(tokens.pop(0)))
+            msg_day = msg.internaldate.date()
+            return {'SINCE': msg_day >= day, 'BEFORE': msg_day < day, 'ON': msg_day == day}[key]
+        if re.match(r'^[\d:,*]+$', key):
+            return seq in _parse_seq_set(key, self.max_seq)
+        raise CommandError('BAD', 'Unsupported search key %s' % key)
+
+
+def _parse_seq_set(msg_set, max_id):
+    """Return the set of ids in an IMAP sequence set."""
+    ids = set()
+    for part in text_type(msg_set).split(','):
+        if ':' in part:
+            start, end = part.split(':')
+            start = max_id if start == '*' else int(start)
+            end = max_id if end == '*' else int(end)
+            if start > end:
+                start, end = end, start
+            ids.update(range(start, end + 1))
+        else:
+            ids.add(max_id if part == '*' else int(part))
+    return ids
+
+
+def _section(msg, section):
+    section = section.upper()
+    if not section:
+        return msg.body
+    numbers = []
+    parts = section.split('.')
+    while parts and parts[0].isdigit():
+        numbers.append(int(parts.pop(0)))
+    part = msg.mime.part(numbers)
+    rest = '.'.join(parts)
+    if not rest:
+        return part.text if numbers else msg.body
+    if rest in ('HEADER', 'MIME'):
+        return part.header
+    if rest == 'TEXT':
+        return part.text
+    if rest.startswith('HEADER.FIELDS'):
+        fields = set(re.findall(r'[^\s()]+', rest[len('HEADER.FIELDS'):].replace('.NOT', '')))
+        exclude = rest.startswith('HEADER.FIELDS.NOT')
+        lines = []
+        keep = False
+        for line in part.header.split(CRLF):
+            if line[:1] in (b' ', b'\t'):
+                if keep:
+                    lines.append(line)
+                continue
+            name = line.split(b':', 1)[0].decode('latin-1').strip().upper()
+            keep = bool(line) and ((name in fields) != exclude)
+            if keep:
+                lines.append(line)
+        return CRLF.join(lines) + CRLF + CRLF
+    raise CommandError('BAD', 'Unsupported section %s' % section)
+
+
+def _envelope(headers):
+    def addresses(name):
+        values = headers.get_all(name)
+        if not values:
+            return None
+        out = []
+        for display_name, address in getaddresses(values):
+            mailbox, _, host = address.partition('@')
+            out.append((display_name or None, None, mailbox or None, host or None))
+        return tuple(out) or None
+
+    from_ = addresses('From')
+    return (headers.get('Date'), headers.get('Subject'), from_,
+            addresses('Sender') or from_, addresses('Reply-To') or from_,
+            addresses('To'), addresses('Cc'), addresses('Bcc'),
+            headers.get('In-Reply-To'), headers.get('Message-ID'))
+
+
+def format_value(value):
+    """Convert a Python value to its IMAP representation as bytes."""
+    if value is None:
+        return b'NIL'
+    if isinstance(value, Atom):
+        return value.encode('latin-1')
+    if isinstance(value, integer_types):
+        return text_type(value).encode('ascii')
+    if isinstance(value, (tuple, list)):
+        return b'(' + b' '.join(format_value(item) for item in value) + b')'
+    if isinstance(value, text_type):
+        if _safe_quoted_re.match(value):
+            return _quote(value).encode('latin-1')
+        value = value.encode('utf-8')
+    return ('{%d}' % len(value)).encode('ascii') + CRLF + value
+
+
+def _quote(text):
+    return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _format_internaldate(dt):
+    offset = dt.utcoffset()
+    minutes = offset.days * 24 * 60 + offset.seconds // 60
+    sign = '-' if minutes < 0 else '+'
+    hours, minutes = divmod(abs(minutes), 60)
+    return '%02d-%s-%04d %02d:%02d:%02d %s%02d%02d' % (
+        dt.day, MONTHS[dt.month - 1], dt.year, dt.hour, dt.minute, dt.second,
+        sign, hours, minutes)
+
+
+def _parse_internaldate(text):
+    match = re.match(r'^\s*(\d+)-(\w{3})-(\d{4}) (\d\d):(\d\d):(\d\d) ([-+])(\d\d)(\d\d)$', text)
+    if not match:
+        raise CommandError('BAD', 'Invalid date %s' % text)
+    day, mon, year, hour, minute, sec, sign, tzh, tzm = match.groups()
+    offset = int(tzh) * 60 + int(tzm)
+    if sign == '-':
+        offset = -offset
+    return datetime(int(year), MONTHS.index(mon.capitalize()) + 1, int(day),
+                    int(hour), int(minute), int(sec), 0, FixedOffset(offset))
+
+
+def _parse_date(text):
+    day, mon, year = text.split('-')
+    return datetime(int(year), MONTHS.index(mon.capitalize()) + 1, int(day)).date()
+
+
+def _to_text(value):
+    if isinstance(value, binary_type):
+        return value.decode('utf-8')
+    return text_type(value)
+
+
+def _to_bytes(value):
+    if isinstance(value, text_type):
+        return value.encode('utf-8')
+    return value
@@ -6,7 +6,6 @@ from __future__ import unicode_literals
 
 import itertools
 import socket
-import sys
 from datetime import datetime
 from mock import patch, sentinel, Mock
 
@@ -361,8 +360,10 @@ class TestIdleAndNoop(IMAPClientTest):
                          
 class TestDebugLogging(IMAPClientTest):
 
-    def test_default_is_stderr(self):
-        self.assertIs(self.client.log_file, sys.stderr)
+    def test_default_is_logging(self):
+        self.assertIsNone(self.client.log_file)
+        self.assertEqual(self.client.logger.logger.name, 'imapclient.imapclient')
+        self.assertEqual(self.client.logger.extra, {'host': 'somehost'})
 
     def test_IMAP_is_patched(self):
         log = six.StringIO()
@@ -390,7 +391,8 @@ class TestTimeNormalisation(IMAPClientTest):
             self.client.fetch(22, ['SOMETHING'])
             parse_fetch_response.assert_called_with(sentinel.fetch_data,
                                                     expected,
-                                                    sentinel.use_uid)
+                                                    sentinel.use_uid,
+                                                    'dict', None)
 
         self.client.normalise_times = True
         check(True)
@@ -0,0 +1,62 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from imapclient import bench
+from imapclient.six import StringIO
+from .util import unittest
+
+
+class TestBench(unittest.TestCase):
+
+    def test_corpora_parse(self):
+        for corpus_func in (bench.flags_corpus, bench.envelope_corpus,
+                            bench.bodystructure_corpus, bench.literal_corpus):
+            parsed = bench.parse_fetch_response(corpus_func(3))
+            self.assertEqual(sorted(parsed), [1001, 1002, 1003])
+
+    def test_run_benchmark(self):
+        result = bench.run_benchmark('parse_flags', size=10, min_time=0)
+        self.assertEqual(result['name'], 'parse_flags')
+        self.assertEqual(result['calls'], 1)
+        self.assertGreater(result['ops_per_sec'], 0)
+        if bench.tracemalloc:
+            self.assertGreater(result['peak_traced_bytes'], 0)
+        else:
+            self.assertIsNone(result['peak_traced_bytes'])
+
+    def test_json_output(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'results.json')
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            bench.main(['-s', '5', '-t', '0', '--json', path,
+                        'messages_to_str', 'utf7_encode'])
+        finally:
+            sys.stdout = stdout
+
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual([r['name'] for r in report['results']],
+                         ['messages_to_str', 'utf7_encode'])
+        self.assertEqual(report['size'], 5)
+
+    def test_unknown_benchmark(self):
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            self.assertRaises(SystemExit, bench.main, ['nope'])
+        finally:
+            sys.stderr = stderr
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+from __future__ import unicode_literals
+
+import subprocess
+import sys
+
+from mock import patch, sentinel
+
+from imapclient import columns
+from imapclient.columns import fill_columns, parse_fetch_columns
+from .imapclient_test import IMAPClientTest
+from .util import unittest
+
+
+LINES = ['1 (UID 10 RFC822.SIZE 1234 FLAGS (\\Seen \\Flagged foo) '
+         'INTERNALDATE " 9-Feb-2007 17:08:08 +0100" MODSEQ (55))',
+         '2 (UID 11 RFC822.SIZE 99 FLAGS () INTERNALDATE "01-Jan-1970 00:00:10 +0000" MODSEQ (56))']
+
+
+def empty_columns(count, names):
+    return dict((name, [0] * count) for name in names)
+
+
+class TestFillColumns(unittest.TestCase):
+
+    names = ('seq', 'uid', 'size', 'internaldate', 'flags', 'modseq')
+
+    def check(self, lines):
+        cols = empty_columns(len(lines), self.names)
+        self.assertEqual(fill_columns(lines, cols), 2)
+        self.assertEqual(cols['seq'], [1, 2])
+        self.assertEqual(cols['uid'], [10, 11])
+        self.assertEqual(cols['size'], [1234, 99])
+        self.assertEqual(cols['internaldate'], [1171037288, 10])
+        self.assertEqual(cols['flags'], [1 | 4, 0])
+        self.assertEqual(cols['modseq'], [55, 56])
+
+    def test_fast(self):
+        self.check(LINES)
+
+    def test_bytes(self):
+        self.check([columns._decode(line.encode('ascii')) for line in LINES])
+
+    def test_fallback(self):
+        lines = [(LINES[0][:-1] + ' BODY[] {3}', 'abc'), ')', LINES[1]]
+        cols = empty_columns(3, self.names)
+        self.assertEqual(fill_columns(lines, cols), 2)
+        self.assertEqual(cols['uid'][:2], [10, 11])
+        self.assertEqual(cols['internaldate'][:2], [1171037288, 10])
+        self.assertEqual(cols['flags'][:2], [5, 0])
+
+    def test_unsolicited_flags_merged(self):
+        lines = [LINES[1], LINES[0], '2 (FLAGS (\\Deleted))']
+        cols = empty_columns(3, self.names)
+        self.assertEqual(fill_columns(lines, cols), 2)
+        self.assertEqual(cols['seq'][:2], [1, 2])
+        self.assertEqual(cols['uid'][:2], [10, 11])
+        self.assertEqual(cols['size'][:2], [1234, 99])
+        self.assertEqual(cols['flags'][:2], [1 | 4, 8])
+
+        # Same result as the general parser
+        slow = empty_columns(3, self.names)
+        columns._fill_columns_slow(lines, slow)
+        self.assertEqual(slow, cols)
+
+    def test_only_requested_columns(self):
+        cols = empty_columns(2, ('seq', 'size'))
+        fill_columns(LINES, cols)
+        self.assertEqual(cols, {'seq': [1, 2], 'size': [1234, 99]})
+
+
+class TestParseFetchColumns(unittest.TestCase):
+
+    def test_numpy_required(self):
+        with patch.object(columns, 'numpy', None):
+            self.assertRaises(ImportError, parse_fetch_columns, LINES, ['UID'])
+
+    @unittest.skipIf(columns.numpy is None, 'NumPy not installed')
+    def test_arrays(self):
+        numpy = columns.numpy
+        out = parse_fetch_columns(LINES, ['UID', 'RFC822.SIZE', 'INTERNALDATE', 'FLAGS'])
+        self.assertEqual(sorted(out), ['flags', 'internaldate', 'seq', 'size', 'uid'])
+        self.assertEqual(out['uid'].dtype, numpy.uint32)
+        self.assertEqual(out['size'].tolist(), [1234, 99])
+        self.assertEqual(out['internaldate'][1], numpy.datetime64(10, 's'))
+
+    @unittest.skipIf(columns.numpy is None, 'NumPy not installed')
+    def test_unsupported_item(self):
+        self.assertRaises(ValueError, parse_fetch_columns, LINES, ['ENVELOPE'])
+
+
+class TestFetchColumns(IMAPClientTest):
+
+    @patch('imapclient.columns.parse_fetch_columns')
+    def test_fetch_columns(self, parse_fetch_columns):
+        self.client._imap._command_complete.return_value = ('OK', sentinel.data)
+        self.client._imap._untagged_response.return_value = ('OK', sentinel.fetch_data)
+        parse_fetch_columns.return_value = sentinel.columns
+
+        out = self.client.fetch_columns([1, 2], ['rfc822.size', 'FLAGS'])
+
+        self.assertIs(out, sentinel.columns)
+        self.client._imap._command.assert_called_once_with(
+            'UID', 'FETCH', '1,2', '(UID RFC822.SIZE FLAGS)', None)
+        parse_fetch_columns.assert_called_once_with(sentinel.fetch_data,
+                                                    ['UID', 'RFC822.SIZE', 'FLAGS'])
+
+
+class TestImport(unittest.TestCase):
+
+    def test_columns_not_imported_by_imapclient(self):
+        # Importing imapclient shouldn't import NumPy
+        code = ('import sys, imapclient; '
+                'sys.exit("imapclient.columns" in sys.modules)')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@
 from __future__ import unicode_literals
 
 from datetime import datetime
+from email.utils import parsedate_tz
 
 from ..datetime_util import parse_to_datetime, datetime_to_native
 from ..fixed_offset import FixedOffset
@@ -35,5 +36,42 @@ class TestParsing(unittest.TestCase):
             datetime(2007, 2, 9, 17, 8, 8, 0, FixedOffset(-4*60 - 30))
         )
 
+    def test_rfc822_variants(self):
+        expected = datetime(2014, 4, 5, 9, 10, 0, 0, FixedOffset(-4*60 - 30))
+        for in_string in ('Sat, 5 Apr 2014 09:10:00 -0430',
+                          '5 Apr 2014 09:10:00 -0430',
+                          'Sat,05 apr 2014 9:10 -0430',
+                          'Sat, 5 Apr 14 09:10:00 -0430',
+                          'Sat, 5 Apr 2014 09:10:00  -0430 (AMT)'):
+            self.check_normalised_and_not(in_string, expected)
+
+    def test_named_UTC_zones(self):
+        for zone in ('UT', 'UTC', 'GMT', 'Z'):
+            self.check_normalised_and_not(
+                'Sun, 1 Jan 2006 10:00:00 ' + zone,
+                datetime(2006, 1, 1, 10, 0, 0, 0, FixedOffset(0))
+            )
+
+    def test_two_digit_years(self):
+        self.assertEqual(parse_to_datetime('1 Jan 99 10:00:00 +0000').year, 1999)
+        self.assertEqual(parse_to_datetime('1 Jan 68 10:00:00 +0000').year, 2068)
+
+    def test_shared_tzinfo(self):
+        dt = parse_to_datetime('Sun, 24 Mar 2013 22:06:10 +0200', normalise=False)
+        self.assertIs(dt.tzinfo, FixedOffset.for_minutes(120))
+
+    def test_fallback(self):
+        # Formats not handled by the fast path are given to parsedate_tz
+        for in_string in ('Sun, 24 Mar 2013 22:06:10 EST',
+                          'Sun, 24 Mar 2013 22:06:10',
+                          'Sun, 24 Mar 2013 22:06:10 -0000'):
+            time_tuple = parsedate_tz(in_string)
+            dt = parse_to_datetime(in_string, normalise=False)
+            self.assertEqual(dt.timetuple()[:6], time_tuple[:6])
+            if time_tuple[-1] is None:
+                self.assertIsNone(dt.tzinfo)
+            else:
+                self.assertEqual(dt.utcoffset().total_seconds(), time_tuple[-1])
+
     def test_invalid(self):
         self.assertRaises(ValueError, parse_to_datetime, 'ABC')
@@ -0,0 +1,253 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+from __future__ import unicode_literals
+
+import imaplib
+import time
+from datetime import datetime
+
+from imapclient import six
+from imapclient.fixed_offset import FixedOffset
+from imapclient.response_parser import parse_fetch_response
+from .fake_imap_server import FakeIMAPServer
+from .util import unittest
+
+
+MULTIPART = (b'Subject: parts\r\n'
+             b'Date: Sat, 1 Mar 2014 11:00:00 +0000\r\n'
+             b'From: Alice <alice@example.com>\r\n'
+             b'To: bob@example.com\r\n'
+             b'Content-Type: multipart/mixed; boundary="XX"\r\n'
+             b'\r\n'
+             b'--XX\r\n'
+             b'Content-Type: text/plain; charset="us-ascii"\r\n'
+             b'\r\n'
+             b'first part\r\n'
+             b'--XX\r\n'
+             b'Content-Type: text/html\r\n'
+             b'\r\n'
+             b'<p>second</p>\r\n'
+             b'--XX--\r\n')
+
+
+class FakeServerTestBase(unittest.TestCase):
+
+    server_kwargs = {}
+
+    def setUp(self):
+        self.server = FakeIMAPServer(**self.server_kwargs).start()
+        self.addCleanup(self.server.stop)
+        self.server.add_message('INBOX', b'Subject: one\nFrom: a@b.com\n\nHello\n',
+                                flags=['\\Seen'],
+                                internaldate=datetime(2014, 3, 1, 10, 20, 30, 0, FixedOffset(60)))
+        self.server.add_message('INBOX', MULTIPART)
+        self.imap = imaplib.IMAP4(*self.server.address)
+        self.addCleanup(self.imap.shutdown)
+        self.imap.login('user', 'pass')
+
+    def fetch(self, msg_set, items, uid=False):
+        if uid:
+            typ, data = self.imap.uid('FETCH', msg_set, items)
+        else:
+            typ, data = self.imap.fetch(msg_set, items)
+        self.assertEqual(typ, 'OK')
+        decoded = []
+        for item in data:
+            if isinstance(item, tuple):
+                decoded.append(tuple(part.decode('latin-1') for part in item))
+            else:
+                decoded.append(item.decode('latin-1'))
+        return parse_fetch_response(decoded)
+
+
+class TestFakeIMAPServer(FakeServerTestBase):
+
+    def test_login_checked(self):
+        server = FakeIMAPServer(users={'user': 'secret'}).start()
+        self.addCleanup(server.stop)
+        imap = imaplib.IMAP4(*server.address)
+        self.addCleanup(imap.shutdown)
+        self.assertRaises(imap.error, imap.login, 'user', 'wrong')
+        self.assertEqual(imap.login('user', 'secret')[0], 'OK')
+
+    def test_capabilities(self):
+        self.assertIn('IDLE', self.imap.capabilities)
+        self.assertIn('UIDPLUS', self.imap.capabilities)
+
+    def test_select(self):
+        typ, data = self.imap.select('INBOX')
+        self.assertEqual((typ, data), ('OK', [b'2']))
+        uidvalidity = self.imap.untagged_responses['UIDVALIDITY'][0]
+        self.assertEqual(int(uidvalidity), self.server.get_mailbox('INBOX').uidvalidity)
+
+    def test_select_missing(self):
+        typ, data = self.imap.select('Nope')
+        self.assertEqual(typ, 'NO')
+
+    def test_fetch_simple_items(self):
+        self.imap.select('INBOX')
+        response = self.fetch('1:*', '(UID FLAGS RFC822.SIZE INTERNALDATE)')
+        self.assertEqual(sorted(response), [1, 2])
+        self.assertEqual(response[1]['FLAGS'], ('\\Seen',))
+        self.assertEqual(response[1]['RFC822.SIZE'], 38)
+        self.assertEqual(response[1]['INTERNALDATE'], datetime(2014, 3, 1, 9, 20, 30))
+        self.assertEqual(response[2]['FLAGS'], ())
+
+    def test_fetch_envelope_and_bodystructure(self):
+        self.imap.select('INBOX')
+        response = self.fetch('2', '(ENVELOPE BODYSTRUCTURE)')[2]
+        envelope = response['ENVELOPE']
+        self.assertEqual(envelope.subject, 'parts')
+        self.assertEqual(envelope.from_[0].name, 'Alice')
+        self.assertEqual(envelope.to[0].host, 'example.com')
+        structure = response['BODYSTRUCTURE']
+        self.assertTrue(structure.is_multipart)
+        self.assertEqual(structure[0][0][:2], ('TEXT', 'PLAIN'))
+        self.assertEqual(structure[0][1][:2], ('TEXT', 'HTML'))
+        self.assertEqual(structure[1], 'MIXED')
+
+    def test_fetch_sections(self):
+        self.imap.select('INBOX')
+        response = self.fetch('2', '(BODY.PEEK[1] BODY.PEEK[2]<3.6> BODY.PEEK[HEADER.FIELDS (SUBJECT)])')[2]
+        self.assertEqual(response['BODY[1]'], 'first part')
+        self.assertEqual(response['BODY[2]<3>'], 'second')
+        self.assertEqual(response['BODY[HEADER.FIELDS (SUBJECT)]'], 'Subject: parts\r\n\r\n')
+        self.assertEqual(self.server.get_mailbox('INBOX').messages[1].flags, [])
+
+    def test_fetch_marks_seen(self):
+        self.imap.select('INBOX')
+        self.fetch('2', '(BODY[TEXT])')
+        self.assertEqual(self.server.get_mailbox('INBOX').messages[1].flags, ['\\Seen'])
+
+    def test_uid_fetch_includes_uid(self):
+        self.imap.select('INBOX')
+        response = self.fetch('2', '(FLAGS)', uid=True)
+        self.assertEqual(response[2]['SEQ'], 2)
+
+    def test_search(self):
+        self.imap.select('INBOX')
+        self.assertEqual(self.imap.search(None, 'ALL'), ('OK', [b'1 2']))
+        self.assertEqual(self.imap.search(None, 'UNSEEN'), ('OK', [b'2']))
+        self.assertEqual(self.imap.search(None, 'NOT', 'SUBJECT', 'parts'), ('OK', [b'1']))
+        self.assertEqual(self.imap.search(None, 'OR', 'SEEN', 'LARGER', '100'), ('OK', [b'1 2']))
+        self.assertEqual(self.imap.uid('SEARCH', '2:*'), ('OK', [b'2']))
+
+    def test_store(self):
+        self.imap.select('INBOX')
+        typ, data = self.imap.store('1:2', '+FLAGS', '(\\Flagged)')
+        self.assertEqual(typ, 'OK')
+        self.assertEqual(len(data), 2)
+        self.imap.store('1', '-FLAGS.SILENT', '(\\Seen)')
+        messages = self.server.get_mailbox('INBOX').messages
+        self.assertEqual(messages[0].flags, ['\\Flagged'])
+        self.assertEqual(messages[1].flags, ['\\Flagged'])
+
+    def test_append(self):
+        typ, data = self.imap.append('Archive', None, None, b'x')
+        self.assertEqual(typ, 'NO')
+
+        self.imap.create('Archive')
+        # imaplib only accepts a native str for a preformatted date
+        typ, data = self.imap.append('Archive', '(\\Seen)', str('"01-Mar-2014 10:00:00 +0000"'),
+                                     b'Subject: new\r\n\r\nbody\r\n')
+        self.assertEqual(typ, 'OK')
+        mailbox = self.server.get_mailbox('Archive')
+        self.assertIn(('APPENDUID %d 1' % mailbox.uidvalidity).encode('ascii'), data[0])
+        message = mailbox.messages[0]
+        self.assertEqual(message.flags, ['\\Seen'])
+        self.assertEqual(message.internaldate.utcoffset().seconds, 0)
+
+    def test_copy_and_expunge(self):
+        self.imap.create('Archive')
+        self.imap.select('INBOX')
+        typ, data = self.imap.copy('1:2', 'Archive')
+        self.assertEqual(typ, 'OK')
+        self.assertEqual(len(self.server.get_mailbox('Archive').messages), 2)
+
+        self.imap.store('1', '+FLAGS', '(\\Deleted)')
+        typ, data = self.imap.expunge()
+        self.assertEqual(data, [b'1'])
+        self.assertEqual(len(self.server.get_mailbox('INBOX').messages), 1)
+
+    def test_list(self):
+        self.imap.create('Archive')
+        self.imap.create('Archive/2014')
+        typ, data = self.imap.list()
+        self.assertEqual(data, [b'(\\HasChildren) "/" "Archive"',
+                                b'(\\HasNoChildren) "/" "Archive/2014"',
+                                b'(\\HasNoChildren) "/" "INBOX"'])
+        typ, data = self.imap.list('', 'Archive/%')
+        self.assertEqual(data, [b'(\\HasNoChildren) "/" "Archive/2014"'])
+
+    def test_idle(self):
+        self.imap.select('INBOX')
+        tag = self.imap._command('IDLE')
+        self.assertTrue(self.imap.readline().startswith(b'+ '))
+        self.server.add_message('INBOX', b'Subject: pushed\r\n\r\n')
+        self.assertEqual(self.imap.readline(), b'* 3 EXISTS\r\n')
+        self.imap.send(b'DONE\r\n')
+        self.assertEqual(self.imap.readline(), tag + b' OK IDLE terminated\r\n')
+
+    def test_literal_plus(self):
+        self.imap.send(b'X1 CREATE {3+}\r\nFoo\r\n')
+        self.assertEqual(self.imap.readline(), b'X1 OK CREATE completed\r\n')
+        self.assertIsNotNone(self.server.get_mailbox('Foo'))
+
+    def test_imapclient(self):
+        client = self.server.connect()
+        self.addCleanup(client.logout)
+        client.create_folder('Sent')
+        self.assertTrue(client.append('Sent', b'Subject: hi\r\n\r\nthere\r\n', ['\\Seen']))
+        self.assertEqual(self.server.get_mailbox('Sent').messages[0].flags, ['\\Seen'])
+
+
+class TestUTF8Accept(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeIMAPServer()
+        self.server.capabilities = FakeIMAPServer.capabilities + ('ENABLE', 'UTF8=ACCEPT')
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.client = self.server.connect()
+        self.addCleanup(self.client.logout)
+        self.assertEqual(self.client.enable('UTF8=ACCEPT'), ['UTF8=ACCEPT'])
+
+    def test_folder_names_sent_as_utf8(self):
+        name = '\u0412\u0445\u043e\u0434\u044f\u0449\u0438\u0435'
+        self.client.create_folder(name)
+        self.assertIsNotNone(self.server.get_mailbox(name))
+
+    # IMAPClient doesn't decode server responses under Python 3 yet
+    @unittest.skipIf(six.PY3, 'responses are not decoded under Python 3')
+    def test_folder_round_trip(self):
+        name = '\u0412\u0445\u043e\u0434\u044f\u0449\u0438\u0435'
+        self.client.create_folder(name)
+        self.server.add_message(name, b'Subject: hi\r\n\r\nthere\r\n')
+
+        self.assertEqual(self.client.list_folders('', '\u0412\u0445*'),
+                         [(('\\HasNoChildren',), '/', name)])
+        self.assertEqual(self.client.folder_status(name, ['MESSAGES']), {'MESSAGES': 1})
+        self.assertEqual(self.client.select_folder(name)['EXISTS'], 1)
+
+
+class TestThrottling(FakeServerTestBase):
+
+    server_kwargs = dict(command_latency={'NOOP': 0.1}, bandwidth=20000)
+
+    def test_command_latency(self):
+        start = time.time()
+        self.imap.noop()
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_bandwidth(self):
+        self.server.add_message('INBOX', b'Subject: big\r\n\r\n' + b'x' * 4000)
+        self.imap.select('INBOX')
+        start = time.time()
+        self.fetch('3', '(BODY.PEEK[])')
+        self.assertGreaterEqual(time.time() - start, 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
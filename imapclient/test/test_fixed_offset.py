@@ -36,6 +36,12 @@ class TestFixedOffset(unittest.TestCase):
         self._check(FixedOffset(-11*60 - 30),
                     timedelta(minutes=(-11*60) - 30), '-1130')
 
+    def test_for_minutes_shared(self):
+        offset = FixedOffset.for_minutes(-90)
+        self._check(offset, timedelta(minutes=-90), '-0130')
+        self.assertIs(FixedOffset.for_minutes(-90), offset)
+        self.assertIsNot(FixedOffset.for_minutes(90), offset)
+
     @patch.multiple('imapclient.fixed_offset.time',
                     daylight=True, timezone=15*60*60, localtime=DEFAULT)
     def test_for_system_DST_not_active(self, localtime):
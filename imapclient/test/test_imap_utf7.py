@@ -51,5 +51,27 @@ class IMAP4UTF7TestCase(unittest.TestCase):
         self.assertEqual(encode('&'), '&-')
         self.assertEqual(decode(b'&-'), '&')
 
+    def test_ascii_returned_unchanged(self):
+        name = 'INBOX/Some Folder'
+        self.assertIs(encode(name), name)
+        self.assertIs(decode(name), name)
+
+    def test_unterminated(self):
+        self.assertEqual(decode('Hello&AP8'), 'Hello\xff')
+
+    def test_ampersands(self):
+        for name, encoded in [('&&', '&-&-'),
+                              ('a&&b', 'a&-&-b'),
+                              ('&\xe4', '&-&AOQ-'),
+                              ('\xe4&', '&AOQ-&-')]:
+            self.assertEqual(encode(name), encoded)
+            self.assertEqual(decode(encoded), name)
+
+    def test_repeated_conversions(self):
+        for _ in range(3):
+            self.test_encode()
+            self.test_decode()
+
+
 if __name__ == '__main__':
     unittest.main()
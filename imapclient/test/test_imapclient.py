@@ -4,16 +4,25 @@
 
 from __future__ import unicode_literals
 
+import io
 import itertools
+import logging
+import os
+import re
+import shutil
 import socket
-import sys
+import tempfile
+import warnings
 from datetime import datetime
-from mock import patch, sentinel, Mock
+from mock import patch, sentinel, Mock, call
 
 from imapclient import six
 from imapclient.fixed_offset import FixedOffset
+from imapclient.imapclient import _RedactedText
+from imapclient.response_parser import BodyData
 from .testable_imapclient import TestableIMAPClient as IMAPClient
 from .imapclient_test import IMAPClientTest
+from .util import unittest
 
 class TestListFolders(IMAPClientTest):
 
@@ -42,6 +51,18 @@ class TestListFolders(IMAPClientTest):
         self.assertTrue(folders is sentinel.folder_list)
 
 
+    def test_list_folders_extended(self):
+        self.client._imap._simple_command.return_value = ('OK', [b'something'])
+        self.client._imap._untagged_response.return_value = ('LIST', sentinel.folder_data)
+        self.client._proc_folder_list = Mock(return_value=sentinel.folder_list)
+
+        folders = self.client.list_folders(selection=['subscribed'],
+                                           return_options=['SPECIAL-USE', 'CHILDREN'])
+
+        self.client._imap._simple_command.assert_called_once_with(
+            'LIST', '(SUBSCRIBED)', '""', '"*"', 'RETURN', '(SPECIAL-USE CHILDREN)')
+        self.assertTrue(folders is sentinel.folder_list)
+
     def test_list_folders_NO(self):
         self.client._imap._simple_command.return_value = ('NO', [b'badness'])
         self.assertRaises(IMAPClient.Error, self.client.list_folders)
@@ -142,6 +163,101 @@ class TestListFolders(IMAPClientTest):
         folders = self.client._proc_folder_list(['', None, r'(\HasNoChildren) "/" "last"'])
         self.assertEqual(folders, [((r'\HasNoChildren',), '/', 'last')])
 
+    def test_extended_data_items(self):
+        folders = self.client._proc_folder_list([
+            r'(\Subscribed) "/" "Foo" ("CHILDINFO" ("SUBSCRIBED"))',
+            ('(\\HasNoChildren) "/" {5}', 'bang\xff'),
+            ' ("OLDNAME" ("Bar"))',
+            r'(\Sent) "/" "Sent"',
+            ])
+        self.assertEqual(folders, [((r'\Subscribed',), '/', 'Foo'),
+                                   ((r'\HasNoChildren',), '/', 'bang\xff'),
+                                   ((r'\Sent',), '/', 'Sent')])
+
+
+class TestFolderCache(IMAPClientTest):
+
+    def setUp(self):
+        super(TestFolderCache, self).setUp()
+        self.client.folder_cache_ttl = 60
+        self.client._do_list = Mock(return_value=[
+            ((r'\HasNoChildren',), '/', 'INBOX'),
+            ((r'\HasNoChildren',), '/', 'Foo'),
+            ])
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(IMAPClient().folder_cache_ttl)
+
+    def test_list_folders_cached(self):
+        expected = [((r'\HasNoChildren',), '/', 'INBOX'),
+                    ((r'\HasNoChildren',), '/', 'Foo')]
+        self.assertEqual(self.client.list_folders(), expected)
+        self.assertEqual(self.client.list_folders(), expected)
+        self.assertEqual(self.client._do_list.call_count, 1)
+
+    def test_list_folders_with_args_not_cached(self):
+        self.client.list_folders('Foo')
+        self.client._do_list.assert_called_once_with('LIST', 'Foo', '*', None, None)
+
+    def test_folder_exists(self):
+        self.assertTrue(self.client.folder_exists('Foo'))
+        self.assertTrue(self.client.folder_exists(b'inbox'))
+        self.assertFalse(self.client.folder_exists('Bar'))
+        self.assertEqual(self.client._do_list.call_count, 1)
+        self.assertFalse(self.client._imap.list.called)
+
+    @patch('imapclient.imapclient.time.time')
+    def test_ttl(self, time):
+        time.return_value = 1000
+        self.client.folder_exists('Foo')
+        time.return_value = 1060
+        self.client.folder_exists('Foo')
+        self.assertEqual(self.client._do_list.call_count, 1)
+        time.return_value = 1061
+        self.client.folder_exists('Foo')
+        self.assertEqual(self.client._do_list.call_count, 2)
+
+    def test_invalidation(self):
+        self.client._command_and_check = Mock()
+        for meth, args in [('create_folder', ('Bar',)),
+                           ('rename_folder', ('Foo', 'Bar')),
+                           ('delete_folder', ('Foo',)),
+                           ('subscribe_folder', ('Foo',)),
+                           ('unsubscribe_folder', ('Foo',))]:
+            self.client.invalidate_folder_cache()
+            self.client._do_list.reset_mock()
+            self.client.folder_exists('Foo')
+            getattr(self.client, meth)(*args)
+            self.client.folder_exists('Foo')
+            self.assertEqual(self.client._do_list.call_count, 2, meth)
+
+
+class TestFindSpecialFolder(IMAPClientTest):
+
+    def setUp(self):
+        super(TestFindSpecialFolder, self).setUp()
+        self.client.list_folders = Mock(return_value=[
+            ((r'\HasNoChildren',), '/', 'INBOX'),
+            ((r'\HasNoChildren', r'\Sent'), '/', 'Sent Items'),
+            ((r'\HasNoChildren', r'\Trash'), '/', 'Deleted'),
+            ])
+
+    def test_with_special_use(self):
+        self.client._cached_capabilities = ('SPECIAL-USE',)
+
+        self.assertEqual(self.client.find_special_folder(r'\Sent'), 'Sent Items')
+        self.client.list_folders.assert_called_once_with(selection=['SPECIAL-USE'])
+
+    def test_without_special_use(self):
+        self.client._cached_capabilities = ('IMAP4REV1',)
+
+        self.assertEqual(self.client.find_special_folder(r'\trash'), 'Deleted')
+        self.client.list_folders.assert_called_once_with()
+
+    def test_not_found(self):
+        self.client._cached_capabilities = ('SPECIAL-USE',)
+        self.assertIsNone(self.client.find_special_folder(r'\Junk'))
+
 
 class TestSelectFolder(IMAPClientTest):
 
@@ -182,6 +298,144 @@ class TestSelectFolder(IMAPClientTest):
         })
 
 
+class TestEnsureSelected(IMAPClientTest):
+
+    def setUp(self):
+        super(TestEnsureSelected, self).setUp()
+        self.client._command_and_check = Mock()
+        self.client._imap.untagged_responses = {'EXISTS': ['3'], 'RECENT': ['1']}
+        self.client.noop = Mock(return_value=('NOOP done', []))
+
+    def test_selects_when_nothing_selected(self):
+        result = self.client.ensure_selected('foo')
+
+        self.client._command_and_check.assert_called_once_with('select', '"foo"', False)
+        self.assertEqual(result, {'EXISTS': 3, 'RECENT': 1})
+        self.assertFalse(self.client.noop.called)
+
+    def test_already_selected(self):
+        self.client.select_folder('foo')
+        result = self.client.ensure_selected('foo')
+
+        self.assertEqual(self.client._command_and_check.call_count, 1)
+        self.client.noop.assert_called_once_with()
+        self.assertEqual(result, {'EXISTS': 3, 'RECENT': 1})
+
+    def test_no_refresh(self):
+        self.client.select_folder('foo')
+        self.client.ensure_selected('foo', refresh=False)
+        self.assertFalse(self.client.noop.called)
+
+    def test_inbox_case_insensitive(self):
+        self.client.select_folder('INBOX')
+        self.client.ensure_selected('Inbox')
+        self.assertEqual(self.client._command_and_check.call_count, 1)
+
+    def test_different_folder_or_mode(self):
+        self.client.select_folder('foo')
+        self.client.ensure_selected('foo', readonly=True)
+        self.client.ensure_selected('bar', readonly=True)
+        self.assertEqual(self.client._command_and_check.call_args_list, [
+            (('select', '"foo"', False),),
+            (('select', '"foo"', True),),
+            (('select', '"bar"', True),),
+            ])
+
+    def test_reselect_after_close(self):
+        self.client.select_folder('foo')
+        self.client.close_folder()
+        self.client.ensure_selected('foo')
+        self.assertEqual(self.client._command_and_check.call_count, 3)
+
+    def test_noop_updates_response(self):
+        del self.client.noop
+        self.client.select_folder('foo')
+        self.client._imap._command.return_value = sentinel.tag
+        self.client._consume_until_tagged_response = Mock(
+            return_value=('NOOP done', [(5, 'EXISTS'), (2, 'RECENT'), (3, 'EXPUNGE')]))
+
+        result = self.client.ensure_selected('foo')
+
+        self.assertEqual(result, {'EXISTS': 4, 'RECENT': 2})
+
+    def test_collected_responses_applied(self):
+        # Unsolicited responses collected by imaplib during other
+        # commands (eg. FETCH)
+        self.client.select_folder('foo')
+        self.client._imap.untagged_responses = {'EXISTS': [b'7', b'9'], 'EXPUNGE': [b'2'],
+                                                'UIDNEXT': [b'20'], 'FETCH': [sentinel.fetch]}
+
+        result = self.client.ensure_selected('foo', refresh=False)
+
+        self.assertEqual(result, {'EXISTS': 9, 'RECENT': 1, 'UIDNEXT': 20})
+        # Left for other users of imaplib's responses
+        self.assertEqual(self.client._imap.untagged_responses['EXPUNGE'], [b'2'])
+
+    def test_collected_responses_applied_once(self):
+        self.client.select_folder('foo')
+        untagged = self.client._imap.untagged_responses
+        untagged['EXPUNGE'] = [b'2']
+        self.assertEqual(self.client.ensure_selected('foo', refresh=False)['EXISTS'], 2)
+        self.assertEqual(self.client.ensure_selected('foo', refresh=False)['EXISTS'], 2)
+
+        untagged['EXPUNGE'].append(b'1')
+        self.assertEqual(self.client.ensure_selected('foo', refresh=False)['EXISTS'], 1)
+
+        # Popped by imaplib (eg. for response()) and collected again
+        untagged['EXPUNGE'] = [b'1']
+        self.assertEqual(self.client.ensure_selected('foo', refresh=False)['EXISTS'], 0)
+
+    def test_collected_applied_before_noop_responses(self):
+        del self.client.noop
+        self.client.select_folder('foo')
+        self.client._imap.untagged_responses = {'EXISTS': [b'10']}
+
+        def consume(tag, command):
+            # imaplib collects the responses to the NOOP too
+            self.client._imap.untagged_responses['EXPUNGE'] = [b'3']
+            return 'NOOP done', [(3, 'EXPUNGE')]
+        self.client._consume_until_tagged_response = Mock(side_effect=consume)
+
+        result = self.client.ensure_selected('foo')
+
+        self.assertEqual(result['EXISTS'], 9)
+
+    @patch('imapclient.imapclient.select.select')
+    def test_idle_responses_applied(self, mock_select):
+        self.client.select_folder('foo')
+        self.client._imap.sock = Mock()
+        mock_select.return_value = ([True], [], [])
+        lines = ['* 5 EXISTS', '* 1 RECENT']
+        def fake_get_line():
+            if lines:
+                return lines.pop(0)
+            raise socket.timeout
+        self.client._imap._get_line = fake_get_line
+        self.client._consume_until_tagged_response = Mock(
+            return_value=('Idle terminated', [(2, 'EXPUNGE')]))
+
+        self.client.idle_check()
+        self.assertEqual(self.client.ensure_selected('foo', refresh=False),
+                         {'EXISTS': 5, 'RECENT': 1})
+        self.client.idle_done()
+        self.assertEqual(self.client.ensure_selected('foo', refresh=False),
+                         {'EXISTS': 4, 'RECENT': 1})
+
+
+class TestUnselectFolder(IMAPClientTest):
+
+    def test_unselect(self):
+        self.client._imap._simple_command.return_value = ('OK', ['Unselect completed'])
+
+        self.assertEqual(self.client.unselect_folder(), 'Unselect completed')
+        self.client._imap._simple_command.assert_called_once_with('UNSELECT')
+        self.assertEqual(self.client._imap.state, 'AUTH')
+
+    def test_unselect_NO(self):
+        self.client._imap._simple_command.return_value = ('NO', ['badness'])
+        self.assertRaises(IMAPClient.Error, self.client.unselect_folder)
+
+
 class TestAppend(IMAPClientTest):
 
     def test_without_msg_time(self):
@@ -207,6 +461,94 @@ class TestAppend(IMAPClientTest):
             '"foobar"', '(FLAG WAVE)', '"somedate"', msg)
 
 
+class TestAppendFile(IMAPClientTest):
+
+    def setUp(self):
+        super(TestAppendFile, self).setUp()
+        self.client._cached_capabilities = ('IMAP4REV1',)
+        imap = self.client._imap
+        imap._command.return_value = 'tag1'
+        imap.tagged_commands = {'tag1': None}
+        imap._get_response.return_value = None     # continuation response
+        imap._command_complete.return_value = ('OK', [b'[APPENDUID 1 2] APPEND completed'])
+
+    def sent(self):
+        return b''.join(args[0] for args, _ in self.client._imap.send.call_args_list)
+
+    def test_file_object(self):
+        msg_file = io.BytesIO(b'junkSubject: hi\n\nline 1\nline 2\n')
+        msg_file.seek(4)
+
+        result = self.client.append('foobar', msg_file, ['FLAG'])
+
+        self.assertEqual(result, b'[APPENDUID 1 2] APPEND completed')
+        imap = self.client._imap
+        imap._command.assert_called_once_with('APPEND', '"foobar"', '(FLAG)', None, '{31}')
+        self.assertTrue(imap._get_response.called)
+        self.assertEqual(self.sent(), b'Subject: hi\r\n\r\nline 1\r\nline 2\r\n\r\n')
+        imap._command_complete.assert_called_once_with('APPEND', 'tag1')
+
+    def test_streamed_in_chunks(self):
+        msg_file = io.BytesIO(b'ab\r\ncd\ref\n')
+        with patch('imapclient.imapclient._APPEND_CHUNK_SIZE', 3):
+            self.client.append('foobar', msg_file)
+
+        self.client._imap._command.assert_called_once_with('APPEND', '"foobar"', '()', None,
+                                                           '{12}')
+        self.assertGreater(self.client._imap.send.call_count, 2)
+        self.assertEqual(self.sent(), b'ab\r\ncd\r\nef\r\n\r\n')
+
+    def test_literal_plus(self):
+        self.client._cached_capabilities = ('IMAP4REV1', 'LITERAL+')
+
+        self.client.append('foobar', io.BytesIO(b'hi\r\n'))
+
+        self.client._imap._command.assert_called_once_with('APPEND', '"foobar"', '()', None,
+                                                           '{4+}')
+        self.assertFalse(self.client._imap._get_response.called)
+        self.assertEqual(self.sent(), b'hi\r\n\r\n')
+
+    def test_literal_minus(self):
+        self.client._cached_capabilities = ('IMAP4REV1', 'LITERAL-')
+        self.client.append('foobar', io.BytesIO(b'hi\r\n'))
+        self.client._imap._command.assert_called_once_with('APPEND', '"foobar"', '()', None,
+                                                           '{4+}')
+
+        # Too big for a non-synchronising literal
+        self.client._imap._command.reset_mock()
+        with patch('imapclient.imapclient._LITERAL_MINUS_MAX', 3):
+            self.client.append('foobar', io.BytesIO(b'hi\r\n'))
+        self.client._imap._command.assert_called_once_with('APPEND', '"foobar"', '()', None,
+                                                           '{4}')
+
+    def test_rejected_before_literal(self):
+        imap = self.client._imap
+
+        def reject():
+            imap.tagged_commands['tag1'] = ('NO', [b'Message too big'])
+            return b'tag1 NO Message too big'
+        imap._get_response.side_effect = reject
+        imap._command_complete.return_value = ('NO', [b'Message too big'])
+
+        self.assertRaises(IMAPClient.Error, self.client.append, 'foobar', io.BytesIO(b'hi'))
+        self.assertFalse(imap.send.called)
+
+    @unittest.skipUnless(hasattr(os, 'PathLike'), 'os.PathLike not available')
+    def test_path(self):
+        import pathlib
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = pathlib.Path(tmp_dir) / 'message.eml'
+        with open(str(path), 'wb') as f:
+            f.write(b'Subject: hi\r\n\r\nbody\r\n')
+
+        self.client.append('foobar', path)
+
+        self.client._imap._command.assert_called_once_with('APPEND', '"foobar"', '()', None,
+                                                           '{21}')
+        self.assertEqual(self.sent(), b'Subject: hi\r\n\r\nbody\r\n\r\n')
+
+
 class TestAclMethods(IMAPClientTest):
 
     def test_getacl(self):
@@ -344,8 +686,10 @@ class TestIdleAndNoop(IMAPClientTest):
                          
 class TestDebugLogging(IMAPClientTest):
 
-    def test_default_is_stderr(self):
-        self.assertIs(self.client.log_file, sys.stderr)
+    def test_default_is_logging(self):
+        self.assertIsNone(self.client.log_file)
+        self.assertEqual(self.client.logger.logger.name, 'imapclient.imapclient')
+        self.assertEqual(self.client.logger.extra, {'host': 'somehost'})
 
     def test_IMAP_is_patched(self):
         log = six.StringIO()
@@ -358,6 +702,56 @@ class TestDebugLogging(IMAPClientTest):
         self.assertIn('one', output)
         self.assertIn('two', output)
 
+    def test_logging(self):
+        self.client.logger = Mock()
+        self.client.logger.isEnabledFor.return_value = True
+
+        self.client._imap._mesg("> b'A001 LOGIN fred \"secret\"'")
+
+        self.client.logger.isEnabledFor.assert_called_once_with(logging.DEBUG)
+        fmt, text = self.client.logger.debug.call_args[0]
+        self.assertEqual(fmt % text, "> b'A001 LOGIN **REDACTED**'")
+
+    def test_host_in_records(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('imapclient.imapclient')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.DEBUG)
+
+        self.client._log('one')
+
+        self.assertEqual([(r.host, r.getMessage()) for r in records], [('somehost', 'one')])
+
+    def test_logging_disabled(self):
+        self.client.logger = Mock()
+        self.client.logger.isEnabledFor.return_value = False
+
+        self.client._log('one')
+
+        self.assertFalse(self.client.logger.debug.called)
+
+    def test_redaction(self):
+        def check(text, expected):
+            self.assertEqual(six.text_type(_RedactedText(text)), expected)
+
+        check("> A001 LOGIN fred secret", "> A001 LOGIN **REDACTED**")
+        check("> b'A002 AUTHENTICATE XOAUTH2'", "> b'A002 AUTHENTICATE XOAUTH2'")
+        check("> b'A002 AUTHENTICATE PLAIN AGZyZWQ='", "> b'A002 AUTHENTICATE PLAIN **REDACTED**'")
+        check("> b'A003 SELECT LOGIN'", "> b'A003 SELECT LOGIN'")
+        check("< b'* OK LOGIN done'", "< b'* OK LOGIN done'")
+
+    def test_log_file_redacted(self):
+        log = six.StringIO()
+        self.client.log_file = log
+
+        self.client._log('> A001 LOGIN fred secret')
+
+        self.assertNotIn('secret', log.getvalue())
+
 class TestTimeNormalisation(IMAPClientTest):
 
     def test_default(self):
@@ -373,7 +767,8 @@ class TestTimeNormalisation(IMAPClientTest):
             self.client.fetch(22, ['SOMETHING'])
             parse_fetch_response.assert_called_with(sentinel.fetch_data,
                                                     expected,
-                                                    sentinel.use_uid)
+                                                    sentinel.use_uid,
+                                                    'dict', None)
 
         self.client.normalise_times = True
         check(True)
@@ -381,6 +776,26 @@ class TestTimeNormalisation(IMAPClientTest):
         self.client.normalise_times = False
         check(False)
 
+    @patch('imapclient.imapclient.parse_fetch_response')
+    def test_failures_passed_through(self, parse_fetch_response):
+        self.client._imap._command_complete.return_value = ('OK', sentinel.data)
+        self.client._imap._untagged_response.return_value = ('OK', sentinel.fetch_data)
+
+        self.client.fetch(22, ['ENVELOPE'], failures=sentinel.failures)
+
+        parse_fetch_response.assert_called_with(sentinel.fetch_data, True, True, 'dict',
+                                                sentinel.failures)
+
+    @patch('imapclient.imapclient.parse_simple_fetch_response')
+    def test_simple_items_use_fast_parser(self, parse_simple_fetch_response):
+        self.client._imap._command_complete.return_value = ('OK', sentinel.data)
+        self.client._imap._untagged_response.return_value = ('OK', sentinel.fetch_data)
+
+        self.client.fetch(22, ['uid', 'FLAGS', 'RFC822.SIZE'])
+
+        parse_simple_fetch_response.assert_called_with(sentinel.fetch_data, True, True, 'dict',
+                                                       None)
+
 
 class TestGmailLabels(IMAPClientTest):
 
@@ -412,6 +827,245 @@ class TestGmailLabels(IMAPClientTest):
         self.client._store.assert_called_with('X-GM-LABELS', sentinel.messages, sentinel.labels, 'X-GM-LABELS')
 
 
+class TestFetchHeaders(IMAPClientTest):
+
+    def test_fields(self):
+        with patch.object(self.client, 'fetch', autospec=True, return_value={
+                123: {'SEQ': 1, 'BODY[HEADER.FIELDS (FROM SUBJECT)]':
+                      'From: a@example.com\r\nSubject: hi\r\n there\r\n\r\n'},
+                444: {'SEQ': 2, 'BODY[HEADER.FIELDS ("FROM" "SUBJECT")]': '\r\n'}}):
+            out = self.client.fetch_headers(sentinel.messages, ['From', 'subject'])
+            self.client.fetch.assert_called_with(sentinel.messages,
+                                                 ['BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)]'])
+
+        self.assertEqual(sorted(out.keys()), [123, 444])
+        self.assertEqual(out[123]['FROM'], 'a@example.com')
+        self.assertEqual(out[123]['subject'], 'hi there')
+        self.assertEqual(len(out[444]), 0)
+
+    def test_all_headers(self):
+        with patch.object(self.client, 'fetch', autospec=True, return_value={
+                123: {'SEQ': 1, 'BODY[HEADER]': 'X-Foo: bar\r\n\r\n'}}):
+            out = self.client.fetch_headers(sentinel.messages)
+            self.client.fetch.assert_called_with(sentinel.messages, ['BODY.PEEK[HEADER]'])
+
+        self.assertEqual(out[123].items(), [('X-Foo', 'bar')])
+
+
+class TestFetchPreviews(IMAPClientTest):
+
+    def test_previews(self):
+        plain = ('text', 'plain', ('charset', 'utf-8'), None, None, '7bit', 100, 3)
+        html = ('text', 'html', ('charset', 'utf-8'), None, None, 'base64', 100, 3)
+        image = ('image', 'png', None, None, None, 'base64', 100)
+        structures = {
+            11: {'SEQ': 1, 'BODYSTRUCTURE': BodyData.create(plain)},
+            12: {'SEQ': 2, 'BODYSTRUCTURE': BodyData.create(((plain, image), 'mixed'))},
+            13: {'SEQ': 3, 'BODYSTRUCTURE': BodyData.create(image)},
+            14: {'SEQ': 4, 'BODYSTRUCTURE': BodyData.create(html)},
+        }
+        raw = [
+            ('1 (UID 11 BODY[1]<0> {62}', 'Hello\r\nthere' + 'x' * 50), ')',
+            ('4 (UID 14 BODY[1]<0> {12}', 'PGI+SGk8L2I+'), ')',
+            ('2 (UID 12 BODY[1.1]<0> {6}', 'Second'), ')',
+        ]
+
+        with patch.object(self.client, 'fetch', autospec=True, return_value=structures):
+            with patch.object(self.client, '_fetch_raw_pipelined', autospec=True,
+                              return_value=raw):
+                previews = self.client.fetch_previews(sentinel.messages, length=10)
+                self.client.fetch.assert_called_once_with(sentinel.messages,
+                                                          ['BODYSTRUCTURE'])
+                # One FETCH per section, for the largest size needed
+                self.client._fetch_raw_pipelined.assert_called_once_with([
+                    ([11, 14], 'BODY.PEEK[1]<0.240>'),
+                    ([12], 'BODY.PEEK[1.1]<0.40>'),
+                ])
+
+        self.assertEqual(previews, {11: 'Hello ther', 12: 'Second', 13: None, 14: 'Hi'})
+
+    def test_no_text_parts(self):
+        image = ('image', 'png', None, None, None, 'base64', 100)
+        structures = {11: {'SEQ': 1, 'BODYSTRUCTURE': BodyData.create(image)}}
+        with patch.object(self.client, 'fetch', autospec=True, return_value=structures):
+            with patch.object(self.client, '_fetch_raw_pipelined', autospec=True):
+                self.assertEqual(self.client.fetch_previews([11]), {11: None})
+                self.assertFalse(self.client._fetch_raw_pipelined.called)
+
+
+class TestDownload(IMAPClientTest):
+
+    MESSAGE = b''.join(b'line %03d\r\n' % i for i in range(100))
+
+    def setUp(self):
+        super(TestDownload, self).setUp()
+        self.requests = []
+        self.client.use_uid = True
+        patcher = patch.object(self.client, '_fetch_raw_pipelined', autospec=True,
+                               side_effect=self.fake_fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(self.client, 'fetch', autospec=True,
+                               return_value={5: {'SEQ': 1, 'RFC822.SIZE': len(self.MESSAGE)}})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fake_fetch(self, commands, message=None):
+        message = message or self.MESSAGE
+        self.requests.append([items for _, items in commands])
+        lines = []
+        for msg_id, items in commands:
+            section, offset, size = re.match(r'\(BODY.PEEK\[(.*)\]<(\d+)\.(\d+)>\)$',
+                                             items).groups()
+            data = message[int(offset):int(offset) + int(size)].decode('ascii')
+            lines.append(('1 (UID %d BODY[%s]<%s> {%d}' % (msg_id, section, offset, len(data)),
+                          data))
+            lines.append(')')
+        return lines
+
+    def test_to_file_object(self):
+        out = io.BytesIO()
+        self.assertEqual(self.client.download(5, '', out, chunk_size=400), len(self.MESSAGE))
+        self.assertEqual(out.getvalue(), self.MESSAGE)
+        self.client.fetch.assert_called_once_with(5, ['RFC822.SIZE'])
+        self.assertEqual(self.requests, [['(BODY.PEEK[]<0.400>)'],
+                                         ['(BODY.PEEK[]<400.400>)'],
+                                         ['(BODY.PEEK[]<800.400>)']])
+
+    def test_in_flight(self):
+        out = io.BytesIO()
+        self.client.download(5, '', out, chunk_size=300, in_flight=2)
+        self.assertEqual(out.getvalue(), self.MESSAGE)
+        self.assertEqual(self.requests, [['(BODY.PEEK[]<0.300>)', '(BODY.PEEK[]<300.300>)'],
+                                         ['(BODY.PEEK[]<600.300>)', '(BODY.PEEK[]<900.300>)']])
+
+    def test_resume(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        dest = os.path.join(tmpdir, 'message.eml')
+        with open(dest + '.part', 'wb') as f:
+            f.write(self.MESSAGE[:700])
+
+        self.client.download(5, '', dest, chunk_size=400)
+
+        # The last chunk downloaded is checked before continuing
+        self.assertEqual(self.requests, [['(BODY.PEEK[]<300.400>)'],
+                                         ['(BODY.PEEK[]<700.400>)']])
+        self.assertFalse(os.path.exists(dest + '.part'))
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), self.MESSAGE)
+
+    def test_resume_complete(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        dest = os.path.join(tmpdir, 'message.eml')
+        with open(dest + '.part', 'wb') as f:
+            f.write(self.MESSAGE)
+
+        self.client.download(5, '', dest, chunk_size=400)
+
+        # Only the last chunk is fetched, to check it
+        self.assertEqual(self.requests, [['(BODY.PEEK[]<600.400>)']])
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), self.MESSAGE)
+
+    def check_restarted(self, stale):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        dest = os.path.join(tmpdir, 'message.eml')
+        with open(dest + '.part', 'wb') as f:
+            f.write(stale)
+
+        self.client.download(5, '', dest, chunk_size=400)
+
+        self.assertEqual(self.requests[-3:], [['(BODY.PEEK[]<0.400>)'],
+                                              ['(BODY.PEEK[]<400.400>)'],
+                                              ['(BODY.PEEK[]<800.400>)']])
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), self.MESSAGE)
+
+    def test_resume_stale_larger(self):
+        self.check_restarted(self.MESSAGE + b'more')
+
+    def test_resume_stale_same_size(self):
+        self.check_restarted(self.MESSAGE.replace(b'line 099', b'LINE 099'))
+
+    def test_resume_stale_smaller(self):
+        self.check_restarted(self.MESSAGE[:700].replace(b'line 060', b'LINE 060'))
+
+    def test_resume_section(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        dest = os.path.join(tmpdir, 'part.txt')
+        with open(dest + '.part', 'wb') as f:
+            f.write(b'stale')
+
+        self.client.download(5, '1', dest, chunk_size=500)
+
+        self.assertEqual(self.requests[0], ['(BODY.PEEK[1]<0.5>)'])
+        with open(dest, 'rb') as f:
+            self.assertEqual(f.read(), self.MESSAGE)
+
+    def test_string_msg_id(self):
+        out = io.BytesIO()
+        self.assertEqual(self.client.download('5', '', out, chunk_size=400), len(self.MESSAGE))
+        self.assertEqual(out.getvalue(), self.MESSAGE)
+        self.client.fetch.assert_called_once_with(5, ['RFC822.SIZE'])
+
+    def test_size_mismatch(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        dest = os.path.join(tmpdir, 'message.eml')
+        self.client._fetch_raw_pipelined.side_effect = (
+            lambda commands: self.fake_fetch(commands, self.MESSAGE[:900]))
+
+        self.assertRaises(IMAPClient.Error, self.client.download, 5, '', dest, chunk_size=400)
+        self.assertFalse(os.path.exists(dest))
+        self.assertEqual(os.path.getsize(dest + '.part'), 900)
+
+    def test_section(self):
+        out = io.BytesIO()
+        self.assertEqual(self.client.download(5, '1', out, chunk_size=500), len(self.MESSAGE))
+        self.assertEqual(out.getvalue(), self.MESSAGE)
+        self.assertFalse(self.client.fetch.called)
+        self.assertEqual(len(self.requests), 3)
+
+
+class TestFetchRawPipelined(IMAPClientTest):
+
+    def test_commands_sent_before_responses_read(self):
+        imap = self.client._imap
+        imap._command.side_effect = ['tag1', 'tag2']
+        imap._command_complete.return_value = ('OK', ['done'])
+        imap._untagged_response.return_value = ('OK', sentinel.fetch_data)
+
+        out = self.client._fetch_raw_pipelined([(5, '(A)'), ([6, 7], '(B)')])
+
+        self.assertIs(out, sentinel.fetch_data)
+        self.assertEqual([call[0] for call in imap.method_calls], [
+            '_command', '_command', '_command_complete', '_command_complete',
+            '_untagged_response'])
+        imap._command.assert_any_call('UID', 'FETCH', '5', '(A)')
+        imap._command.assert_any_call('UID', 'FETCH', '6,7', '(B)')
+        imap._command_complete.assert_any_call('FETCH', 'tag1')
+        imap._command_complete.assert_any_call('FETCH', 'tag2')
+
+    def test_all_responses_read_after_failure(self):
+        imap = self.client._imap
+        imap._command.side_effect = ['tag1', 'tag2', 'tag3']
+        imap._command_complete.side_effect = [('NO', [b'gone']),
+                                              IMAPClient.Error('FETCH command error: BAD'),
+                                              ('OK', [b'done'])]
+        imap.untagged_responses = {'FETCH': [b'3 (FLAGS ())'], 'EXISTS': [b'3']}
+
+        self.assertRaisesRegex(IMAPClient.Error, 'gone', self.client._fetch_raw_pipelined,
+                               [(5, '(A)'), (6, '(B)'), (7, '(C)')])
+
+        self.assertEqual(imap._command_complete.call_args_list,
+                         [call('FETCH', 'tag1'), call('FETCH', 'tag2'), call('FETCH', 'tag3')])
+        self.assertEqual(imap.untagged_responses, {'EXISTS': [b'3']})
+
+
 class TestNamespace(IMAPClientTest):
 
     def set_return(self, value):
@@ -435,6 +1089,89 @@ class TestNamespace(IMAPClientTest):
             (("#shared/", "/"), ("#public/", "/"), ("#ftp/", "/"), ("#news.", ".")),
             ))
 
+class TestNamespaceCaching(IMAPClientTest):
+
+    def setUp(self):
+        super(TestNamespaceCaching, self).setUp()
+        self.client._imap.namespace.return_value = ('OK', ['NIL (("~" "/")) NIL'])
+        self.client._imap.logout.return_value = ('BYE', ['Logging out'])
+
+    def test_namespace_cached(self):
+        self.assertEqual(self.client.namespace(), (None, (("~", "/"),), None))
+        self.assertEqual(self.client.namespace(), (None, (("~", "/"),), None))
+        self.assertEqual(self.client._imap.namespace.call_count, 1)
+
+    def test_folder_delimiter_cached(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.assertEqual(self.client.get_folder_delimiter(), '/')
+            self.assertEqual(self.client.get_folder_delimiter(), '/')
+        self.assertEqual(self.client._imap.namespace.call_count, 1)
+
+    def test_folder_delimiter_from_list(self):
+        self.client._proc_folder_list([r'(\HasNoChildren) "." "A"'])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.assertEqual(self.client.get_folder_delimiter(), '.')
+        self.assertFalse(self.client._imap.namespace.called)
+
+    def test_cleared_on_logout(self):
+        self.client.namespace()
+        self.client.logout()
+        self.client.namespace()
+        self.assertEqual(self.client._imap.namespace.call_count, 2)
+
+
+class TestEnable(IMAPClientTest):
+
+    def setUp(self):
+        super(TestEnable, self).setUp()
+        self.client._imap._simple_command.return_value = ('OK', [b'Enabled'])
+
+    def test_enable(self):
+        self.client._imap._untagged_response.return_value = (
+            'OK', [b'CONDSTORE'])
+
+        enabled = self.client.enable('condstore', 'NOTSUPPORTED')
+
+        self.client._imap._simple_command.assert_called_once_with(
+            'ENABLE', 'condstore', 'NOTSUPPORTED')
+        self.client._imap._untagged_response.assert_called_once_with(
+            'OK', [b'Enabled'], 'ENABLED')
+        self.assertEqual(enabled, ['CONDSTORE'])
+        self.assertFalse(self.client._utf8_enabled)
+
+    def test_nothing_enabled(self):
+        self.client._imap._untagged_response.return_value = ('OK', [None])
+        self.assertEqual(self.client.enable('FOO'), [])
+
+    def test_no_capabilities(self):
+        self.assertRaises(ValueError, self.client.enable)
+
+    def test_NO(self):
+        self.client._imap._simple_command.return_value = ('NO', [b'badness'])
+        self.assertRaises(IMAPClient.Error, self.client.enable, 'FOO')
+
+    def test_utf8_accept(self):
+        self.client._imap._untagged_response.return_value = ('OK', [b'UTF8=ACCEPT'])
+
+        self.client.enable('UTF8=ACCEPT')
+
+        self.assertTrue(self.client._utf8_enabled)
+        self.client._imap._mode_utf8.assert_called_once_with()
+
+        folder = self.client._normalise_folder('Hello\xff "world"')
+        self.assertEqual(folder, '"Hello\xff \\"world\\""')
+
+        folders = self.client._proc_folder_list([
+            r'(\HasNoChildren) "/" "Hello&AP8-world"',
+            ('(\\HasNoChildren) "/" {12}', 'Hello\xc3\xbfworld'.encode('latin-1')),
+            '',
+            ])
+        self.assertEqual(folders, [((r'\HasNoChildren',), '/', 'Hello&AP8-world'),
+                                   ((r'\HasNoChildren',), '/', 'Hello\xffworld')])
+
+
 class TestCapabilities(IMAPClientTest):
 
     def test_preauth(self):
@@ -0,0 +1,224 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+from __future__ import unicode_literals
+
+import io
+import re
+
+from mock import Mock
+
+from imapclient.metrics import MetricsRecorder
+from .imapclient_test import IMAPClientTest
+from .util import unittest
+
+
+class FakeIMAP4(object):
+    """Just enough of imaplib.IMAP4 to drive MetricsRecorder."""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.sent = []
+
+    def _command(self, name, *args):
+        self.send(b'A001 ' + ' '.join((name,) + args).encode('ascii') + b'\r\n')
+        return b'A001'
+
+    def send(self, data):
+        self.sent.append(data)
+
+    def readline(self):
+        return self.lines.pop(0)
+
+    def read(self, size):
+        return b'x' * size
+
+
+class PartialFetchIMAP4(object):
+    """Answers pipelined partial FETCHes of *body* over a fake wire,
+    in the order the commands were sent, as a server would.
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.wire = []
+        self.tagged = {}
+        self.fetched = []
+        self.tag_num = 0
+
+    def _command(self, *args):
+        self.tag_num += 1
+        tag = ('A%03d' % self.tag_num).encode('ascii')
+        self.send(tag + b' ' + ' '.join(args).encode('ascii') + b'\r\n')
+        section, offset, size = re.search(r'\[(.*)\]<(\d+)\.(\d+)>', args[-1]).groups()
+        data = self.body[int(offset):int(offset) + int(size)]
+        self.wire.extend([
+            ('* 1 FETCH (UID 5 BODY[%s]<%s> {%d}\r\n' % (section, offset, len(data))).encode('ascii'),
+            data,
+            b')\r\n',
+            tag + b' OK FETCH completed\r\n',
+        ])
+        return tag
+
+    def send(self, data):
+        pass
+
+    def readline(self):
+        return self.wire.pop(0)
+
+    def read(self, size):
+        data = self.wire.pop(0)
+        assert len(data) == size
+        return data
+
+    def _command_complete(self, name, tag):
+        while tag not in self.tagged:
+            line = self.readline()
+            if line.startswith(b'* '):
+                text = line[2:-2].decode('ascii').replace(' FETCH', '', 1)
+                size = int(re.search(r'\{(\d+)\}$', text).group(1))
+                self.fetched.append((text, self.read(size).decode('latin-1')))
+                self.fetched.append(self.readline()[:-2].decode('ascii'))
+            else:
+                line_tag, typ, rest = line[:-2].split(b' ', 2)
+                self.tagged[line_tag] = (typ.decode('ascii'), [rest])
+        return self.tagged.pop(tag)
+
+    def _untagged_response(self, typ, data, name):
+        fetched, self.fetched = self.fetched, []
+        return name, fetched
+
+
+class TestMetricsRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.reported = []
+
+    def run_command(self, lines, name, *args):
+        imap = FakeIMAP4(lines)
+        recorder = MetricsRecorder(imap, self.reported.append)
+        imap._command(name, *args)
+        while imap.lines:
+            imap.readline()
+        return imap, recorder
+
+    def test_simple_command(self):
+        self.run_command([b'* OK still here\r\n', b'A001 OK NOOP done\r\n'], 'NOOP')
+
+        self.assertEqual(len(self.reported), 1)
+        stats = self.reported[0]
+        self.assertEqual(stats.name, 'NOOP')
+        self.assertEqual(stats.tag, 'A001')
+        self.assertEqual(stats.status, 'OK')
+        self.assertEqual(stats.bytes_sent, len(b'A001 NOOP\r\n'))
+        self.assertEqual(stats.bytes_received, 36)
+        self.assertEqual(stats.untagged_responses, 1)
+        self.assertIsNotNone(stats.first_byte_time)
+        self.assertGreaterEqual(stats.wire_time, stats.first_byte_time)
+        self.assertEqual(stats.parse_time, 0)
+        self.assertIsNone(stats.message_count)
+
+    def test_parsed_command_reported_after_parsing(self):
+        _, recorder = self.run_command([b'* 1 FETCH (FLAGS ())\r\n',
+                                        b'* 2 FETCH (FLAGS ())\r\n',
+                                        b'A001 OK done\r\n'],
+                                       'UID', 'fetch', '1:2', '(FLAGS)')
+        self.assertEqual(self.reported, [])
+
+        recorder.parsed(0.5, {1: {}, 2: {}})
+
+        self.assertEqual(len(self.reported), 1)
+        stats = self.reported[0]
+        self.assertEqual(stats.name, 'UID FETCH')
+        self.assertEqual(stats.untagged_responses, 2)
+        self.assertEqual(stats.parse_time, 0.5)
+        self.assertEqual(stats.message_count, 2)
+
+    def test_columnar_message_count(self):
+        _, recorder = self.run_command([b'* 1 FETCH (UID 5)\r\n',
+                                        b'* 2 FETCH (UID 6)\r\n',
+                                        b'* 3 FETCH (UID 7)\r\n',
+                                        b'A001 OK done\r\n'],
+                                       'UID', 'FETCH', '5:7', '(UID)')
+
+        recorder.parsed(0.5, {'seq': [1, 2, 3], 'uid': [5, 6, 7]})
+
+        self.assertEqual(self.reported[0].message_count, 3)
+
+    def test_failed_parsed_command_reported_immediately(self):
+        self.run_command([b'A001 NO nope\r\n'], 'UID', 'FETCH', '1', '(FLAGS)')
+        self.assertEqual(len(self.reported), 1)
+        self.assertEqual(self.reported[0].status, 'NO')
+
+    def test_literal_bytes_counted(self):
+        imap, _ = self.run_command([], 'NOOP')
+        imap.read(10)
+        imap.lines.append(b'A001 OK done\r\n')
+        imap.readline()
+        self.assertEqual(self.reported[0].bytes_received, 24)
+
+    def test_unicode_bytes_counted(self):
+        imap, _ = self.run_command([], 'NOOP')
+        imap.send('\u0412\u0445\r\n')
+        imap.lines.append(b'A001 OK done\r\n')
+        imap.readline()
+        self.assertEqual(self.reported[0].bytes_sent, len(b'A001 NOOP\r\n') + 6)
+
+    def test_unreported_flushed_on_next_command(self):
+        imap, _ = self.run_command([b'A001 OK done\r\n'], 'LIST', '""', '*')
+        self.assertEqual(self.reported, [])
+        imap._command('NOOP')
+        self.assertEqual([s.name for s in self.reported], ['LIST'])
+
+    def test_uninstall(self):
+        imap, recorder = self.run_command([], 'NOOP')
+        recorder.uninstall()
+        self.assertEqual(len(self.reported), 1)
+        self.assertIsNone(self.reported[0].status)
+        self.assertEqual(imap.readline.__self__, imap)
+
+
+class TestMetricsHook(IMAPClientTest):
+
+    def test_default(self):
+        self.assertIsNone(self.client.metrics_hook)
+
+    def test_set_and_unset(self):
+        hook = Mock()
+        self.client.metrics_hook = hook
+        self.assertIs(self.client.metrics_hook, hook)
+        self.client.metrics_hook = None
+        self.assertIsNone(self.client.metrics_hook)
+
+    def test_parse_time_recorded(self):
+        self.client._imap._simple_command.return_value = ('OK', [b'something'])
+        self.client._imap._untagged_response.return_value = (
+            'LIST', [r'(\HasNoChildren) "/" "A"'])
+        self.client.metrics_hook = Mock()
+        stats = Mock(parse_time=0)
+        self.client._metrics.pending = [stats]
+
+        self.client.list_folders()
+
+        self.client.metrics_hook.assert_called_once_with(stats)
+        self.assertGreater(stats.parse_time, 0)
+
+    def test_pipelined_download(self):
+        self.client._imap = PartialFetchIMAP4(b'0123456789')
+        reported = []
+        self.client.metrics_hook = reported.append
+
+        out = io.BytesIO()
+        self.assertEqual(self.client.download(5, 'TEXT', out, chunk_size=4, in_flight=3), 10)
+
+        self.assertEqual(out.getvalue(), b'0123456789')
+        self.assertEqual([stats.tag for stats in reported], ['A001', 'A002', 'A003'])
+        for stats, size in zip(reported, [4, 4, 2]):
+            self.assertEqual(stats.name, 'UID FETCH')
+            self.assertEqual(stats.status, 'OK')
+            self.assertEqual(stats.untagged_responses, 1)
+            response = '* 1 FETCH (UID 5 BODY[TEXT]<%d> {%d}\r\n)\r\n%s OK FETCH completed\r\n' % (
+                (int(stats.tag[1:]) - 1) * 4, size, stats.tag)
+            self.assertEqual(stats.bytes_received, len(response) + size)
+        self.assertIsNotNone(reported[-1].message_count)
@@ -0,0 +1,94 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+from __future__ import unicode_literals
+
+from imapclient.preview import find_text_part, preview_octets, decode_preview
+from imapclient.response_parser import BodyData, parse_response
+from .util import unittest
+
+
+def body(text):
+    return BodyData.create(parse_response([text])[0])
+
+
+PLAIN = '("TEXT" "PLAIN" ("CHARSET" "UTF-8") NIL NIL "QUOTED-PRINTABLE" 1234 40 NIL NIL NIL NIL)'
+HTML = '("TEXT" "HTML" ("CHARSET" "UTF-8") NIL NIL "BASE64" 5678 120 NIL NIL NIL NIL)'
+IMAGE = '("IMAGE" "PNG" ("NAME" "logo.png") NIL NIL "BASE64" 20480 NIL NIL NIL NIL)'
+
+
+class TestFindTextPart(unittest.TestCase):
+
+    def test_single_part(self):
+        section, part = find_text_part(body(PLAIN))
+        self.assertEqual(section, '1')
+        self.assertEqual(part[1], 'PLAIN')
+
+    def test_no_text(self):
+        self.assertIsNone(find_text_part(body(IMAGE)))
+        self.assertIsNone(find_text_part(body('(%s%s "MIXED")' % (IMAGE, IMAGE))))
+
+    def test_plain_preferred(self):
+        structure = body('((%s%s "ALTERNATIVE")%s "MIXED")' % (HTML, PLAIN, IMAGE))
+        section, part = find_text_part(structure)
+        self.assertEqual(section, '1.2')
+        self.assertEqual(part[1], 'PLAIN')
+
+    def test_html_fallback(self):
+        structure = body('(%s(%s%s "RELATED") "MIXED")' % (IMAGE, HTML, IMAGE))
+        section, part = find_text_part(structure)
+        self.assertEqual(section, '2.1')
+        self.assertEqual(part[1], 'HTML')
+
+
+class TestDecodePreview(unittest.TestCase):
+
+    def part(self, subtype='PLAIN', encoding='7BIT', charset='UTF-8'):
+        return ('TEXT', subtype, ('CHARSET', charset), None, None, encoding, 100, 5)
+
+    def test_plain(self):
+        self.assertEqual(decode_preview(b'Hello\r\n  there,\r\n\r\nhow', self.part(), 100),
+                         'Hello there, how')
+
+    def test_truncated(self):
+        self.assertEqual(decode_preview(b'Hello there', self.part(), 5), 'Hello')
+
+    def test_partial_multibyte_character(self):
+        data = 'caf\xe9'.encode('utf-8')[:-1]
+        self.assertEqual(decode_preview(data, self.part(), 100), 'caf')
+
+    def test_quoted_printable(self):
+        part = self.part(encoding='QUOTED-PRINTABLE')
+        self.assertEqual(decode_preview(b'caf=C3=A9 au=\r\n lait', part, 100), 'caf\xe9 au lait')
+        # Escape cut off by the partial fetch
+        self.assertEqual(decode_preview(b'caf=C3=A9 =C3=A', part, 100), 'caf\xe9')
+
+    def test_base64(self):
+        part = self.part(encoding='BASE64')
+        self.assertEqual(decode_preview(b'Y2Fmw6kgYXUg\r\nbGFpdA==', part, 100), 'caf\xe9 au lait')
+        # Cut off part way through a block
+        self.assertEqual(decode_preview(b'Y2Fmw6kgYXUgbGF', part, 100), 'caf\xe9 au')
+
+    def test_charset(self):
+        part = self.part(charset='ISO-8859-1')
+        self.assertEqual(decode_preview(b'caf\xe9', part, 100), 'caf\xe9')
+        part = self.part(charset='X-UNKNOWN')
+        self.assertEqual(decode_preview(b'caf\xe9', part, 100), 'caf\xe9')
+
+    def test_html(self):
+        data = (b'<html><head><style>p { color: red }</style></head>'
+                b'<body><p>Fish &amp; chips</p><!-- note --><p>to&nbsp;go</p><img src="x')
+        self.assertEqual(decode_preview(data, self.part('HTML'), 100), 'Fish & chips to go')
+
+    def test_text_data(self):
+        self.assertEqual(decode_preview('Hello', self.part(), 100), 'Hello')
+
+    def test_octets(self):
+        self.assertEqual(preview_octets(self.part(), 100), 400)
+        self.assertEqual(preview_octets(self.part(encoding='BASE64'), 100), 600)
+        self.assertEqual(preview_octets(self.part('HTML'), 100), 1600)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,12 +8,15 @@ Unit tests for the FetchTokeniser and FetchParser classes
 
 from __future__ import unicode_literals
 
+import sys
 from datetime import datetime
 from textwrap import dedent
 
+from imapclient import six
 from imapclient.fixed_offset import FixedOffset
-from imapclient.response_parser import parse_response, parse_fetch_response, ParseError
-from imapclient.response_types import Envelope, Address
+from imapclient.response_parser import (parse_response, parse_fetch_response,
+                                        parse_simple_fetch_response, ParseError)
+from imapclient.response_types import Envelope, Address, FlagSet
 from imapclient.test.util import unittest
 
 #TODO: tokenising tests
@@ -127,6 +130,14 @@ class TestParseResponse(unittest.TestCase):
         self._test(r'"foo \"bar\""', 'foo "bar"')
         self._test(r'"foo\\bar"', r'foo\bar')
 
+    def test_quoted_8bit(self):
+        # eg. UTF-8 folder names once UTF8=ACCEPT is enabled
+        name = '\u0412\u0445'.encode('utf-8')
+        line = b'(\\HasNoChildren) "/" "' + name + b'"'
+        if six.PY3:
+            line, name = line.decode('utf-8'), name.decode('utf-8')
+        self._test(line, (('\\HasNoChildren',), '/', name), wrap=False)
+
     def test_square_brackets(self):
         self._test('foo[bar rrr]', 'foo[bar rrr]')
         self._test('"foo[bar rrr]"', 'foo[bar rrr]')
@@ -137,6 +148,18 @@ class TestParseResponse(unittest.TestCase):
     def test_incomplete_tuple(self):
         self._test_parse_error('abc (1 2', 'Tuple incomplete before "\(1 2"')
 
+    def test_incomplete_nested_tuple(self):
+        self._test_parse_error('(1 (2 (3', r'Tuple incomplete before "\(3"')
+
+    def test_very_deep_nesting(self):
+        depth = sys.getrecursionlimit() * 2
+        output = parse_response(['(' * depth + '"x"' + ')' * depth])
+        level = output[0]
+        for _ in range(depth - 1):
+            self.assertEqual(len(level), 1)
+            level = level[0]
+        self.assertEqual(level, ('x',))
+
     def test_bad_literal(self):
         self._test_parse_error([('{99}', 'abc')],
                                'Expecting literal of size 99, got 3')
@@ -314,6 +337,25 @@ class TestParseFetchResponse(unittest.TestCase):
         self.assertTrue(parsed[1][respType][0][0].is_multipart)
         self.assertFalse(parsed[1][respType][0][0][0][0].is_multipart)
 
+    def test_deeply_nested_BODYSTRUCTURE(self):
+        # eg. a long chain of forwarded messages
+        depth = sys.getrecursionlimit() * 2
+        text_part = '("text" "plain" ("charset" "utf-8") NIL NIL "7bit" 16 1 NIL NIL NIL NIL)'
+        structure = text_part
+        for _ in range(depth):
+            structure = '(%s%s "mixed" NIL NIL NIL NIL)' % (structure, text_part)
+        parsed = parse_fetch_response(['1 (BODYSTRUCTURE %s)' % structure])
+
+        body = parsed[1]['BODYSTRUCTURE']
+        for _ in range(depth):
+            self.assertTrue(body.is_multipart)
+            self.assertEqual(len(body[0]), 2)
+            self.assertEqual(body[1], 'mixed')
+            self.assertFalse(body[0][1].is_multipart)
+            body = body[0][0]
+        self.assertFalse(body.is_multipart)
+        self.assertEqual(body[:2], ('text', 'plain'))
+
     def test_partial_fetch(self):
         body = '01234567890123456789'
         self.assertEqual(parse_fetch_response(
@@ -381,6 +423,24 @@ class TestParseFetchResponse(unittest.TestCase):
         check(' 9-Dec-2007 17:08:08 +0000',
               datetime(2007, 12, 9, 17, 8, 8, 0, FixedOffset(0)))
 
+    def test_INTERNALDATE_unpadded_day(self):
+        output = parse_fetch_response(['3 (INTERNALDATE "9-Feb-2007 17:08:08 -0430")'],
+                                      normalise_times=False)
+        self.assertEqual(output[3]['INTERNALDATE'],
+                         datetime(2007, 2, 9, 17, 8, 8, 0, FixedOffset(-4*60 - 30)))
+
+    def test_INTERNALDATE_shared_tzinfo(self):
+        output = parse_fetch_response(['1 (INTERNALDATE " 9-Feb-2007 17:08:08 +0100")',
+                                       '2 (INTERNALDATE "10-Mar-2008 01:02:03 +0100")'],
+                                      normalise_times=False)
+        self.assertIs(output[1]['INTERNALDATE'].tzinfo, FixedOffset.for_minutes(60))
+        self.assertIs(output[2]['INTERNALDATE'].tzinfo, FixedOffset.for_minutes(60))
+
+    def test_INTERNALDATE_invalid(self):
+        for date_str in ('32-Feb-2007 17:08:08 +0100', ' 9-Foo-2007 17:08:08 +0100', 'garbage'):
+            self.assertRaises(ValueError, parse_fetch_response,
+                              ['1 (INTERNALDATE "%s")' % date_str])
+
     def test_mixed_types(self):
         self.assertEqual(parse_fetch_response([('1 (INTERNALDATE " 9-Feb-2007 17:08:08 +0100" RFC822 {21}',
                                                 'Subject: test\r\n\r\nbody'),
@@ -392,6 +452,132 @@ class TestParseFetchResponse(unittest.TestCase):
                                'SEQ': 1}})
 
 
+
+class TestParseSimpleFetchResponse(unittest.TestCase):
+
+    def check_same(self, text, **kwargs):
+        expected = parse_fetch_response(text, **kwargs)
+        actual = parse_simple_fetch_response(text, **kwargs)
+        self.assertEqual(actual, expected)
+        return actual
+
+    def test_none_special_case(self):
+        self.assertEqual(parse_simple_fetch_response([None]), {})
+
+    def test_flags(self):
+        self.check_same(['1 (FLAGS (\\Seen \\Flagged $Label1 Junk))',
+                         '2 (FLAGS ())'])
+
+    def test_all_items(self):
+        out = self.check_same(['3 (UID 12 FLAGS (\\Seen) RFC822.SIZE 1234 MODSEQ (98765) '
+                               'INTERNALDATE " 9-Feb-2007 17:08:08 +0100")'])
+        self.assertEqual(out[12]['MODSEQ'], (98765,))
+        self.assertEqual(out[12]['SEQ'], 3)
+
+    def test_not_uid_is_key(self):
+        self.check_same(['3 (UID 12 FLAGS ())', '4 (UID 13 FLAGS ())'], uid_is_key=False)
+
+    def test_aware_times(self):
+        self.check_same(['1 (INTERNALDATE "12-Feb-2007 17:08:08 +0200")'], normalise_times=False)
+
+    def test_same_message_repeated(self):
+        self.check_same(['2 (FLAGS (Foo))', '2 (MODSEQ (4))'])
+
+    def test_fallback(self):
+        for text in (['1 (FLAGS (NIL))'],
+                     ['1 (FLAGS (123))'],
+                     ['1 (FLAGS  (\\Seen))'],
+                     ['1 (flags (\\Seen))'],
+                     ['1 (UID 4 X-GM-LABELS (foo))'],
+                     ['1 (FLAGS ("quoted"))'],
+                     [('1 (UID 4 RFC822 {4}', 'abcd'), ')']):
+            self.check_same(text)
+
+    def test_compact(self):
+        text = ['1 (UID 12 FLAGS (\\Seen) RFC822.SIZE 99)']
+        out = parse_simple_fetch_response(text, result_type='compact')
+        self.assertEqual(out[12].flags, ('\\Seen',))
+        self.assertEqual(out, parse_fetch_response(text))
+
+        text.append('2 (UID 13 X-GM-LABELS (foo))')
+        out = parse_simple_fetch_response(text, result_type='compact')
+        self.assertEqual(out[13]['X-GM-LABELS'], ('foo',))
+        self.assertEqual(out[13].seq, 2)
+
+    def test_flags_shared(self):
+        out = parse_simple_fetch_response(['1 (FLAGS (\\Seen Junk))', '2 (FLAGS (\\Seen Junk))'])
+        self.assertIs(out[1]['FLAGS'], out[2]['FLAGS'])
+        self.assertIsInstance(out[1]['FLAGS'], FlagSet)
+
+        out = parse_fetch_response(['1 (X-GM-LABELS (foo "bar baz"))', '2 (X-GM-LABELS (foo "bar baz"))'])
+        self.assertIs(out[1]['X-GM-LABELS'], out[2]['X-GM-LABELS'])
+
+    def test_unknown_result_type(self):
+        self.assertRaises(ValueError, parse_simple_fetch_response, ['1 (UID 2)'], result_type='foo')
+
+    def test_errors_from_fallback(self):
+        self.assertRaises(ParseError, parse_simple_fetch_response, ['x (FLAGS ())'])
+        self.assertRaises(ParseError, parse_simple_fetch_response, ['1 (UID x)'])
+
+
+
+class TestTolerantFetchParsing(unittest.TestCase):
+
+    def test_good_response_unchanged(self):
+        failures = []
+        text = ['1 (UID 10 FLAGS (\\Seen))', '2 (UID 11 FLAGS ())']
+        self.assertEqual(parse_fetch_response(text, failures=failures),
+                         parse_fetch_response(text))
+        self.assertEqual(failures, [])
+
+    def test_bad_message_skipped(self):
+        bad = '2 (UID 11 INTERNALDATE "not a date")'
+        failures = []
+        out = parse_fetch_response(['1 (UID 10 RFC822.SIZE 100)', bad, '3 (UID 12 RFC822.SIZE 300)'],
+                                   failures=failures)
+
+        self.assertEqual(out, {10: {'SEQ': 1, 'RFC822.SIZE': 100},
+                               12: {'SEQ': 3, 'RFC822.SIZE': 300}})
+        self.assertEqual(len(failures), 1)
+        seq, raw, error = failures[0]
+        self.assertEqual(seq, 2)
+        self.assertEqual(raw, [bad])
+        self.assertIsInstance(error, ValueError)
+
+    def test_bad_message_with_literals(self):
+        text = [('1 (UID 10 BODY[] {4}', 'abcd'), ')',
+                ('2 (UID 11 BODY[] {99}', 'short'), ')',
+                ('3 (UID 12 BODY[] {2}', 'ok'), ' FLAGS (\\Seen))']
+        failures = []
+        out = parse_fetch_response(text, failures=failures)
+
+        self.assertEqual(sorted(out.keys()), [10, 12])
+        self.assertEqual(out[12]['BODY[]'], 'ok')
+        self.assertEqual(out[12]['FLAGS'], ('\\Seen',))
+        self.assertEqual([(f.seq, f.raw) for f in failures], [(2, text[2:4])])
+        self.assertIsInstance(failures[0].error, ParseError)
+
+    def test_unknown_seq(self):
+        failures = []
+        out = parse_fetch_response(['x (UID 10)', '2 (UID 11)'], failures=failures)
+        self.assertEqual(out, {11: {'SEQ': 2}})
+        self.assertEqual([(f.seq, f.raw) for f in failures], [(None, ['x (UID 10)'])])
+
+    def test_compact_results(self):
+        failures = []
+        out = parse_fetch_response(['1 (UID 10 RFC822.SIZE 100)', '2 (UID x)'],
+                                   result_type='compact', failures=failures)
+        self.assertEqual(out[10].size, 100)
+        self.assertEqual(len(failures), 1)
+
+    def test_simple_parser(self):
+        failures = []
+        out = parse_simple_fetch_response(['1 (UID 10 FLAGS ())',
+                                           '2 (UID 11 INTERNALDATE "32-Feb-2007 17:08:08 +0100")'],
+                                          failures=failures)
+        self.assertEqual(out, {10: {'SEQ': 1, 'FLAGS': ()}})
+        self.assertEqual([f.seq for f in failures], [2])
+
 def add_crlf(text):
     return CRLF.join(text.splitlines()) + CRLF
 
@@ -399,5 +585,3 @@ def add_crlf(text):
 system_offset = FixedOffset.for_system()
 def datetime_to_native(dt):
     return dt.astimezone(system_offset).replace(tzinfo=None)
-
-
@@ -0,0 +1,254 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+from __future__ import unicode_literals
+
+import pickle
+import sys
+from datetime import datetime
+
+from imapclient.fixed_offset import FixedOffset
+from imapclient.response_types import (Address, Envelope, FetchRecord, FlagSet,
+                                       HeaderMap, LazyEnvelope, decode_encoded_words,
+                                       intern_flags)
+from .util import unittest
+
+
+class TestFetchRecord(unittest.TestCase):
+
+    def setUp(self):
+        self.record = FetchRecord({'SEQ': 3, 'UID': 12, 'FLAGS': ('\\Seen',),
+                                   'RFC822.SIZE': 1234, 'X-GM-LABELS': ('foo',)})
+
+    def test_attributes(self):
+        self.assertEqual(self.record.seq, 3)
+        self.assertEqual(self.record.uid, 12)
+        self.assertEqual(self.record.flags, ('\\Seen',))
+        self.assertEqual(self.record.size, 1234)
+        self.assertRaises(AttributeError, getattr, self.record, 'internaldate')
+
+    def test_dict_access(self):
+        self.assertEqual(self.record['RFC822.SIZE'], 1234)
+        self.assertEqual(self.record['X-GM-LABELS'], ('foo',))
+        self.assertRaises(KeyError, lambda: self.record['MODSEQ'])
+        self.assertRaises(KeyError, lambda: self.record['ENVELOPE'])
+        self.assertTrue('FLAGS' in self.record)
+        self.assertFalse('MODSEQ' in self.record)
+        self.assertIsNone(self.record.get('MODSEQ'))
+        self.assertEqual(sorted(self.record.keys()),
+                         ['FLAGS', 'RFC822.SIZE', 'SEQ', 'UID', 'X-GM-LABELS'])
+        self.assertEqual(len(self.record), 5)
+
+    def test_setitem(self):
+        self.record['MODSEQ'] = (4,)
+        self.record['BODY[]'] = 'body'
+        self.assertEqual(self.record.modseq, (4,))
+        self.assertEqual(self.record['BODY[]'], 'body')
+
+    def test_equality(self):
+        self.assertEqual(self.record, {'SEQ': 3, 'UID': 12, 'FLAGS': ('\\Seen',),
+                                       'RFC822.SIZE': 1234, 'X-GM-LABELS': ('foo',)})
+        self.assertEqual(self.record, FetchRecord(dict(self.record.items())))
+        self.assertNotEqual(self.record, FetchRecord({'SEQ': 3}))
+
+    def test_smaller_than_dict(self):
+        record = FetchRecord({'SEQ': 1, 'FLAGS': ()})
+        self.assertFalse(hasattr(record, '__dict__'))
+        self.assertLess(sys.getsizeof(record), sys.getsizeof({'SEQ': 1, 'FLAGS': ()}))
+
+
+
+class TestFlagSet(unittest.TestCase):
+
+    def test_tuple_compatible(self):
+        flags = FlagSet(['\\Seen', 'foo'])
+        self.assertEqual(flags, ('\\Seen', 'foo'))
+        self.assertEqual(hash(flags), hash(('\\Seen', 'foo')))
+        self.assertTrue('foo' in flags)
+        self.assertEqual(repr(flags), "FlagSet(%r)" % (('\\Seen', 'foo'),))
+
+    def test_set_operations(self):
+        flags = FlagSet(['a', 'b', 'c'])
+        self.assertEqual(flags & ['c', 'b', 'x'], ('b', 'c'))
+        self.assertEqual(flags | ('d', 'a'), ('a', 'b', 'c', 'd'))
+        self.assertEqual(flags - set(['a']), ('b', 'c'))
+        self.assertEqual(flags ^ ('c', 'd'), ('a', 'b', 'd'))
+        self.assertIsInstance(flags - ['a'], FlagSet)
+        self.assertTrue(FlagSet(['b', 'a']).issubset(flags))
+        self.assertTrue(flags.issuperset(['c']))
+        self.assertFalse(flags.issuperset(['x']))
+
+    def test_union_deduplicated(self):
+        seen = intern_flags(['\\Seen'])
+        self.assertIs(seen | ('\\Seen',), seen)
+        self.assertEqual(seen | ('a', 'a'), ('\\Seen', 'a'))
+        self.assertEqual(FlagSet(['a', 'a', 'b']) | (), ('a', 'b'))
+        self.assertIs(FlagSet(['a', 'a']) | ['a'], intern_flags(['a']))
+
+
+class TestInternFlags(unittest.TestCase):
+
+    def test_shared(self):
+        first = intern_flags(['\\Seen', 'Junk'])
+        second = intern_flags(('\\Seen', 'Junk'))
+        self.assertIs(first, second)
+        self.assertIsInstance(first, FlagSet)
+
+    def test_atoms_shared(self):
+        first = intern_flags([''.join(['\\', 'Flagged'])])
+        second = intern_flags([''.join(['\\', 'Flagged']), 'other'])
+        self.assertIs(first[0], second[0])
+
+
+
+RAW_ENVELOPE = ('Sun, 24 Mar 2013 22:06:10 +0200', 'subject',
+                (('name', None, 'address1', 'domain1.com'),),
+                None,
+                (('name', None, 'address1', 'domain1.com'),),
+                (('name', None, 'address2', 'domain2.com'),
+                 (None, None, 'address3', 'domain3.com')),
+                None, None, '<reply-to-id>', '<msg_id>')
+
+ENVELOPE = Envelope(
+    datetime(2013, 3, 24, 22, 6, 10, 0, FixedOffset.for_minutes(120)), 'subject',
+    (Address('name', None, 'address1', 'domain1.com'),),
+    None,
+    (Address('name', None, 'address1', 'domain1.com'),),
+    (Address('name', None, 'address2', 'domain2.com'),
+     Address(None, None, 'address3', 'domain3.com')),
+    None, None, '<reply-to-id>', '<msg_id>')
+
+
+class TestLazyEnvelope(unittest.TestCase):
+
+    def setUp(self):
+        self.envelope = LazyEnvelope(RAW_ENVELOPE, normalise_times=False)
+
+    def test_attributes(self):
+        for name in Envelope._fields:
+            self.assertEqual(getattr(self.envelope, name), getattr(ENVELOPE, name))
+
+    def test_only_accessed_fields_converted(self):
+        envelope = LazyEnvelope(('bad date',) + RAW_ENVELOPE[1:])
+        self.assertEqual(envelope.subject, 'subject')
+        self.assertEqual(envelope.message_id, '<msg_id>')
+        self.assertRaises(ValueError, getattr, envelope, 'date')
+
+    def test_fields_cached(self):
+        self.assertIs(self.envelope.to, self.envelope.to)
+        self.assertIs(self.envelope.date, self.envelope[0])
+
+    def test_sequence(self):
+        self.assertEqual(len(self.envelope), 10)
+        self.assertEqual(self.envelope[-1], '<msg_id>')
+        self.assertEqual(self.envelope[1:3], ENVELOPE[1:3])
+        self.assertRaises(IndexError, lambda: self.envelope[10])
+        date, subject = tuple(self.envelope)[:2]
+        self.assertEqual(subject, 'subject')
+
+    def test_equality(self):
+        self.assertEqual(self.envelope, ENVELOPE)
+        self.assertEqual(ENVELOPE, self.envelope)
+        self.assertEqual(self.envelope, LazyEnvelope(RAW_ENVELOPE, normalise_times=False))
+        self.assertNotEqual(self.envelope, ENVELOPE._replace(subject='other'))
+        self.assertEqual(hash(self.envelope), hash(ENVELOPE))
+
+    def test_namedtuple_interface(self):
+        self.assertEqual(self.envelope._fields, Envelope._fields)
+        self.assertEqual(self.envelope._asdict(), ENVELOPE._asdict())
+        self.assertEqual(self.envelope._replace(subject='other'),
+                         ENVELOPE._replace(subject='other'))
+        materialised = self.envelope.materialise()
+        self.assertIsInstance(materialised, Envelope)
+        self.assertEqual(materialised, ENVELOPE)
+        self.assertEqual(repr(self.envelope), repr(ENVELOPE))
+
+    def test_pickle(self):
+        envelope = LazyEnvelope(RAW_ENVELOPE)
+        unpickled = pickle.loads(pickle.dumps(envelope))
+        self.assertIsInstance(unpickled, Envelope)
+        self.assertEqual(unpickled, envelope)
+
+
+class TestDecodedAccessors(unittest.TestCase):
+
+    def test_decoded_subject(self):
+        envelope = ENVELOPE._replace(subject='Re: =?utf-8?q?caf=C3=A9?= au lait')
+        self.assertEqual(envelope.decoded_subject, 'Re: caf\xe9 au lait')
+        self.assertEqual(envelope.subject, 'Re: =?utf-8?q?caf=C3=A9?= au lait')
+
+    def test_lazy_envelope_decoded_subject(self):
+        envelope = LazyEnvelope(RAW_ENVELOPE[:1] + ('=?iso-8859-1?q?=E9t=E9?=',) + RAW_ENVELOPE[2:])
+        self.assertEqual(envelope.decoded_subject, '\xe9t\xe9')
+
+    def test_decoded_name(self):
+        address = Address('=?utf-8?b?w6lsw6h2ZQ==?=', None, 'pupil', 'example.com')
+        self.assertEqual(address.decoded_name, '\xe9l\xe8ve')
+        self.assertIsNone(Address(None, None, 'pupil', 'example.com').decoded_name)
+
+    def test_plain_and_bytes(self):
+        self.assertEqual(decode_encoded_words('plain'), 'plain')
+        self.assertEqual(decode_encoded_words(b'=?utf-8?q?caf=C3=A9?='), 'caf\xe9')
+
+    def test_undecodable_left_alone(self):
+        self.assertEqual(decode_encoded_words('=?x-unknown?q?abc?='), '=?x-unknown?q?abc?=')
+
+    def test_cached(self):
+        raw = '=?utf-8?q?cached_subject?='
+        self.assertIs(decode_encoded_words(raw), decode_encoded_words(raw))
+
+
+class TestHeaderMap(unittest.TestCase):
+
+    def setUp(self):
+        self.headers = HeaderMap('From: Alice <alice@example.com>\r\n'
+                                 'Subject: a long\r\n subject\r\n'
+                                 'List-Id: <dev.example.com>\r\n'
+                                 'Received: one\r\n'
+                                 'received: two\r\n'
+                                 '\r\n')
+
+    def test_lookup(self):
+        self.assertEqual(self.headers['from'], 'Alice <alice@example.com>')
+        self.assertEqual(self.headers['LIST-ID'], '<dev.example.com>')
+        self.assertEqual(self.headers.get('To'), None)
+        self.assertEqual(self.headers.get('To', 'x'), 'x')
+        self.assertRaises(KeyError, lambda: self.headers['To'])
+        self.assertTrue('subject' in self.headers)
+        self.assertFalse('To' in self.headers)
+
+    def test_unfolding(self):
+        self.assertEqual(self.headers['Subject'], 'a long subject')
+
+    def test_repeated(self):
+        self.assertEqual(self.headers['Received'], 'one')
+        self.assertEqual(self.headers.get_all('RECEIVED'), ['one', 'two'])
+        self.assertIsNone(self.headers.get_all('To'))
+
+    def test_non_ascii(self):
+        subject = '\u041f\u0440\u0438\u0432\u0435\u0442, \u0445\u043e\u0440\u043e\u0448\u043e'
+        headers = HeaderMap(b'Subject: ' + subject.encode('utf-8') + b'\r\nTo: bob\r\n\r\n')
+        self.assertEqual(headers['subject'], subject)
+        self.assertEqual(headers['to'], 'bob')
+
+        headers = HeaderMap(b'Subject: caf\xe9\r\n\r\n')
+        self.assertEqual(headers['subject'], 'caf\xe9')
+
+    def test_names(self):
+        self.assertEqual(self.headers.keys(), ['From', 'Subject', 'List-Id', 'Received'])
+        self.assertEqual(len(self.headers), 4)
+        self.assertEqual(self.headers.items()[0], ('From', 'Alice <alice@example.com>'))
+
+    def test_bytes(self):
+        headers = HeaderMap(b'Subject: caf\xe9\n\tau lait\n')
+        self.assertEqual(headers['subject'], 'caf\xe9\tau lait')
+
+    def test_lazy(self):
+        headers = HeaderMap('Subject: x\r\n')
+        self.assertIsNone(headers._values)
+        headers.get('anything')
+        self.assertIsNotNone(headers._values)
+
+if __name__ == '__main__':
+    unittest.main()
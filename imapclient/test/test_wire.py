@@ -0,0 +1,105 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+from __future__ import unicode_literals
+
+import imaplib
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from imapclient.imapclient import IMAPClient
+from imapclient.wire import ReplayIMAPClient, WireRecorder, iter_records
+from .fake_imap_server import FakeIMAPServer
+from .util import unittest
+
+
+def run_session(client):
+    results = [client.login('user', 's3cret'),
+               client.capabilities(),
+               client.create_folder('Archive'),
+               client.append('Archive', b'Subject: hi\r\n\r\nthere\r\n'),
+               client._imap.select('Archive'),
+               client._imap.fetch('1', '(FLAGS RFC822.SIZE BODY[])'),
+               client.logout()]
+    return results
+
+
+class TestRecordAndReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeIMAPServer().start()
+        self.addCleanup(self.server.stop)
+
+    def record(self, dest):
+        host, port = self.server.address
+        client = IMAPClient(host, port=port, record_to=dest)
+        return run_session(client)
+
+    def test_round_trip(self):
+        recording = BytesIO()
+        recorded = self.record(recording)
+
+        recording.seek(0)
+        replayed = run_session(ReplayIMAPClient(recording))
+        self.assertEqual(replayed, recorded)
+
+    def test_recording_to_file(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'session.wire')
+        recorded = self.record(path)
+
+        kinds = set(kind for kind, _ in iter_records(path))
+        self.assertEqual(kinds, set(['T', 'C', 'S']))
+        self.assertEqual(run_session(ReplayIMAPClient(path)), recorded)
+
+    def test_credentials_redacted(self):
+        recording = BytesIO()
+        self.record(recording)
+
+        data = recording.getvalue()
+        self.assertNotIn(b's3cret', data)
+        self.assertIn(b' LOGIN **REDACTED**\r\n', data)
+
+    def test_mismatched_command(self):
+        recording = BytesIO()
+        self.record(recording)
+        recording.seek(0)
+
+        client = ReplayIMAPClient(recording)
+        client.login('user', 's3cret')
+        # The recording has CAPABILITY next. (logout() isn't used as
+        # imaplib's logout swallows errors under Python 2.)
+        self.assertRaises(imaplib.IMAP4.abort, client.noop)
+
+
+class TestWireRecorder(unittest.TestCase):
+
+    def test_authenticate_redacted(self):
+        out = BytesIO()
+        recorder = WireRecorder(out)
+        recorder.start_command('AUTHENTICATE')
+        recorder.client(b'ABCD1 AUTHENTICATE XOAUTH2\r\n')
+        recorder.server(b'+ \r\n')
+        recorder.client(b'dXNlcj1zb21ldXNlcg==\r\n')
+        recorder.end_command()
+        recorder.server(b'ABCD1 OK done\r\n')
+
+        out.seek(0)
+        self.assertEqual(list(iter_records(out)), [
+            ('T', b'ABCD1 AUTHENTICATE'),
+            ('C', b'ABCD1 AUTHENTICATE XOAUTH2 **REDACTED**\r\n'),
+            ('S', b'+ \r\n'),
+            ('C', b'**REDACTED**\r\n'),
+            ('S', b'ABCD1 OK done\r\n'),
+        ])
+
+    def test_bad_recording(self):
+        self.assertRaises(ValueError, list, iter_records(BytesIO(b'junk\n')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,246 @@
+# Copyright (c) 2014, Menno Smits
+# Released subject to the New BSD License
+# Please see http://en.wikipedia.org/wiki/BSD_licenses
+
+"""
+Recording and replay of the raw data exchanged with an IMAP server.
+
+A recording is made by passing *record_to* when creating an
+:py:class:`imapclient.IMAPClient`. Credentials sent with the LOGIN and
+AUTHENTICATE commands are redacted. :py:class:`ReplayIMAPClient` feeds
+a recording back to the client so that parsing can be profiled and
+benchmarked without a network connection or the original account.
+
+Recordings are a sequence of records, each consisting of a kind and a
+length on a line by itself followed by the data and a newline. The
+kinds are:
+
+* ``T``: the tag and name of a command about to be sent
+* ``C``: data sent by the client
+* ``S``: data received from the server
+"""
+
+from __future__ import unicode_literals
+
+import imaplib
+import re
+from collections import deque
+from io import BytesIO
+
+from .imapclient import IMAPClient
+from .six import string_types, text_type
+
+__all__ = ['WireRecorder', 'ReplayIMAP4', 'ReplayIMAPClient', 'iter_records']
+
+MAGIC = b'IMAPCLIENT-WIRE 1\n'
+
+_REDACTED_COMMANDS = ('LOGIN', 'AUTHENTICATE')
+_redact_re = re.compile(br'^(\S+ (?:LOGIN|AUTHENTICATE [^\s]+))', re.IGNORECASE)
+
+
+class WireRecorder(object):
+    """
+    Writes wire data to *dest*, which may be a filename or a file
+    object opened in binary mode. Files opened by the recorder are
+    closed by ``close()``.
+    """
+
+    def __init__(self, dest):
+        if isinstance(dest, string_types):
+            self.file = open(dest, 'wb')
+            self._owned = True
+        else:
+            self.file = dest
+            self._owned = False
+        self._command = None
+        self._tagged = False
+        self._redacting = False
+        self.file.write(MAGIC)
+
+    def close(self):
+        if self._owned and not self.file.closed:
+            self.file.close()
+
+    def start_command(self, name):
+        self._command = name
+        self._tagged = False
+        self._redacting = name.upper() in _REDACTED_COMMANDS
+
+    def end_command(self):
+        self._command = None
+        self._redacting = False
+
+    def client(self, data):
+        if isinstance(data, text_type):
+            # Under Python 2 imaplib builds command lines from the
+            # unicode arguments it's given. These are only non-ASCII
+            # once UTF8=ACCEPT is enabled.
+            data = data.encode('utf-8')
+        if self._command is not None and not self._tagged:
+            # The first data sent for a command starts with its tag
+            self._tagged = True
+            tag = data.split(b' ', 1)[0]
+            self._write(b'T', tag + b' ' + self._command.encode('ascii'))
+            if self._redacting:
+                data = _redact_re.match(data).group(1) + b' **REDACTED**\r\n'
+        elif self._redacting:
+            data = b'**REDACTED**\r\n'
+        self._write(b'C', data)
+
+    def server(self, data):
+        self._write(b'S', data)
+
+    def _write(self, kind, data):
+        self.file.write(kind + (' %d\n' % len(data)).encode('ascii') + data + b'\n')
+        self.file.flush()
+
+
+def iter_records(src):
+    """Yield ``(kind, data)`` tuples from a recording. *src* may be a
+    filename or a binary file object.
+    """
+    if isinstance(src, string_types):
+        with open(src, 'rb') as f:
+            for record in iter_records(f):
+                yield record
+        return
+    if src.readline() != MAGIC:
+        raise ValueError('not an IMAPClient wire recording')
+    while True:
+        line = src.readline()
+        if not line:
+            return
+        kind, length = line.split()
+        data = src.read(int(length))
+        src.read(1)
+        yield kind.decode('ascii'), data
+
+
+_recording_classes = {}
+
+
+def recording_imap_class(base):
+    """Return a subclass of the imaplib class *base* which passes all
+    wire data to a WireRecorder.
+    """
+    cls = _recording_classes.get(base)
+    if cls is not None:
+        return cls
+
+    # imaplib's classes are old-style on Python 2 so super() can't be used
+    class RecordingIMAP4(base):
+
+        def __init__(self, recorder, *args):
+            self._wire_recorder = recorder
+            base.__init__(self, *args)
+
+        def _command(self, name, *args):
+            self._wire_recorder.start_command(name)
+            try:
+                return base._command(self, name, *args)
+            finally:
+                self._wire_recorder.end_command()
+
+        def send(self, data):
+            self._wire_recorder.client(data)
+            return base.send(self, data)
+
+        def readline(self):
+            line = base.readline(self)
+            self._wire_recorder.server(line)
+            return line
+
+        def read(self, size):
+            data = base.read(self, size)
+            self._wire_recorder.server(data)
+            return data
+
+        def shutdown(self):
+            try:
+                base.shutdown(self)
+            finally:
+                self._wire_recorder.close()
+
+    _recording_classes[base] = RecordingIMAP4
+    return RecordingIMAP4
+
+
+class ReplayIMAP4(imaplib.IMAP4):
+    """
+    An imaplib.IMAP4 replacement which reads server responses from a
+    recording instead of a socket.
+
+    Tags in the recorded responses are rewritten to match the tags of
+    the commands being replayed. An ``abort`` error is raised if the
+    commands issued don't match those in the recording.
+    """
+
+    def __init__(self, recording):
+        self._recording = recording
+        imaplib.IMAP4.__init__(self)
+
+    def open(self, host='', port=imaplib.IMAP4_PORT, *args):
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.file = None
+        commands = deque()
+        server = []
+        for kind, data in iter_records(self._recording):
+            if kind == 'T':
+                tag, name = data.split(b' ', 1)
+                commands.append((tag, name.decode('ascii')))
+            elif kind == 'S':
+                server.append(data)
+        self._replay_commands = commands
+        self._replay_stream = BytesIO(b''.join(server))
+        self._tag_map = {}
+        self._expected = None
+
+    def _command(self, name, *args):
+        self._expected = name
+        try:
+            return imaplib.IMAP4._command(self, name, *args)
+        finally:
+            self._expected = None
+
+    def send(self, data):
+        if self._expected is None:
+            return
+        name, self._expected = self._expected, None
+        if not self._replay_commands:
+            raise self.abort('no more commands in recording (got %s)' % name)
+        tag, recorded_name = self._replay_commands.popleft()
+        if recorded_name.upper() != name.upper():
+            raise self.abort('expected %s command in recording, got %s' % (recorded_name, name))
+        self._tag_map[tag] = data.split(b' ', 1)[0]
+
+    def readline(self):
+        line = self._replay_stream.readline()
+        tag, sep, rest = line.partition(b' ')
+        new_tag = self._tag_map.get(tag)
+        if new_tag:
+            return new_tag + sep + rest
+        return line
+
+    def read(self, size):
+        return self._replay_stream.read(size)
+
+    def shutdown(self):
+        pass
+
+
+class ReplayIMAPClient(IMAPClient):
+    """
+    An IMAPClient which replays the server responses from
+    *recording* (a filename or binary file object) instead of
+    connecting to a server. The same commands must be issued, in the
+    same order, as when the recording was made.
+    """
+
+    def __init__(self, recording, use_uid=True):
+        self._recording = recording
+        super(ReplayIMAPClient, self).__init__('replay', use_uid=use_uid)
+
+    def _create_IMAP4(self):
+        return ReplayIMAP4(self._recording)
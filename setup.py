@@ -57,6 +57,7 @@ setup(name='IMAPClient',
       packages=find_packages(),
       package_data=dict(imapclient=['examples/*.py']),
       tests_require=['mock==0.8.0'],
+      extras_require={'numpy': ['numpy']},
       description="Easy-to-use, Pythonic and complete IMAP client library",
       long_description=desc,
       classifiers=[